@@ -0,0 +1,125 @@
+"""
+Times each stage of the api.py analysis pipeline on synthetic GPX
+
+Usage: python -m benchmarks.bench_analysis --sizes 1000 10000 --output results.json [--compare previous.json]
+"""
+import sys
+import json
+import time
+import argparse
+import platform
+import subprocess
+from datetime import datetime
+from benchmarks import gpx_generator
+from project2.api import parse_gpx_file, parse_gpx_waypoints, build_route_grid, generate_path, compute_loops, compute_speed_violation, compute_stop_violation, compute_liveness
+
+# stages renamed since older output files were written, old -> new.
+# build_route_grid also walks the route path, which the old run did
+# outside the timings, so its ratio against generate_grid_fence is
+# only a rough one
+STAGE_RENAMES = {'generate_grid_fence': 'build_route_grid'}
+
+def timed(func, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def bench_size(size, args):
+    vehicle_gpx = gpx_generator.to_gpx(gpx_generator.vehicle_points(
+        size,
+        loops=args.loops,
+        stop_count=args.stops,
+        noise_m=args.noise,
+        stop_dwell=args.stop_dwell,
+        gap_every=args.gap_every,
+        gap_seconds=args.gap_seconds,
+        seed=args.seed
+    ))
+    route_gpx = gpx_generator.to_gpx(gpx_generator.route_points())
+    stops_gpx = gpx_generator.to_waypoints_gpx(gpx_generator.stop_corners(args.stops))
+
+    results = []
+
+    def record(stage, func):
+        seconds, result = timed(func, args.repeat)
+        results.append({'size': size, 'stage': stage, 'seconds': seconds})
+        print(f'{size:>10}  {stage:<28}{seconds:>12.4f}s', flush=True)
+        return result
+
+    gps_data_vehicle = record('parse_gpx_file', lambda: parse_gpx_file(vehicle_gpx))
+    gps_data_route = parse_gpx_file(route_gpx)
+    stops = parse_gpx_waypoints(stops_gpx)
+
+    route_grid = record('build_route_grid', lambda: build_route_grid(gps_data_route, stops, args.cell_size))
+    vehicle_path = record('generate_path', lambda: generate_path(gps_data_vehicle, route_grid['grid'], keep_outside=True))
+    record('compute_loops', lambda: compute_loops(route_grid['route_path'], vehicle_path, route_grid['grid'], route_grid['adjacency']))
+    record('compute_speed_violation', lambda: compute_speed_violation(gps_data_vehicle, 'Explicit', args.speed_limit, args.speed_time))
+    record('compute_stop_violation', lambda: compute_stop_violation(stops, gps_data_vehicle, args.stop_min, args.stop_max))
+    record('compute_liveness', lambda: compute_liveness(gps_data_vehicle, args.liveness_limit))
+
+    return results
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, previous_path):
+    with open(previous_path) as f:
+        previous = {(r['size'], STAGE_RENAMES.get(r['stage'], r['stage'])): r['seconds'] for r in json.load(f)['results']}
+
+    print(f'\n{"size":>10}  {"stage":<28}{"before":>10}{"after":>10}{"ratio":>8}')
+    for result in results:
+        before = previous.get((result['size'], result['stage']))
+        if before:
+            print(f"{result['size']:>10}  {result['stage']:<28}{before:>10.4f}{result['seconds']:>10.4f}{result['seconds'] / before:>8.2f}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000])
+    parser.add_argument('--loops', type=int, default=None, help='laps to drive, derived from the size by default')
+    parser.add_argument('--stops', type=int, default=8)
+    parser.add_argument('--noise', type=float, default=5.0, help='GPS noise in meters')
+    parser.add_argument('--stop-dwell', type=int, default=60, help='seconds spent at each stop')
+    parser.add_argument('--gap-every', type=int, default=0, help='fixes between liveness gaps, 0 for none')
+    parser.add_argument('--gap-seconds', type=int, default=900)
+    parser.add_argument('--cell-size', type=float, default=0.1)
+    parser.add_argument('--speed-limit', type=float, default=40)
+    parser.add_argument('--speed-time', type=float, default=30)
+    parser.add_argument('--stop-min', type=float, default=30)
+    parser.add_argument('--stop-max', type=float, default=120)
+    parser.add_argument('--liveness-limit', type=float, default=300)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='bench_output.json')
+    parser.add_argument('--compare', help='previous output file to compare against')
+    args = parser.parse_args()
+
+    results = []
+    for size in args.sizes:
+        results += bench_size(size, args)
+
+    output = {
+        'meta': {
+            'timestamp': datetime.utcnow().isoformat(),
+            'commit': git_commit(),
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'parameters': vars(args)
+        },
+        'results': results
+    }
+
+    with open(args.output, 'w') as f:
+        json.dump(output, f, indent=2)
+
+    if args.compare:
+        compare(results, args.compare)
+
+if __name__ == '__main__':
+    main()
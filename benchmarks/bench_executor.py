@@ -0,0 +1,77 @@
+"""
+Analysis inline against the process pool, to place ANALYSIS_PARALLEL_MIN_POINTS
+
+Usage: python -m benchmarks.bench_executor --sizes 5000 10000 20000 40000 [--workers 4] [--output results.json]
+"""
+import os
+import json
+import time
+import argparse
+from benchmarks import gpx_generator
+from project2 import app
+from project2 import executor
+from project2.api import parse_gpx_file, parse_gpx_waypoints, build_route_grid, split_trips
+
+def timed(func, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def bench_size(size, route_grid, parameters, args):
+    gps_data = parse_gpx_file(gpx_generator.to_gpx(gpx_generator.vehicle_points(size, gap_every=args.gap_every, seed=args.seed)))
+    jobs = [(trip, parameters, route_grid) for trip in split_trips(gps_data, parameters['liveness_time_limit'])]
+
+    # 0 sends every job to the pool, a bound above the size keeps it inline
+    app.config['ANALYSIS_PARALLEL_MIN_POINTS'] = size + 1
+    inline = timed(lambda: executor.run_analyses(jobs), args.repeat)
+    app.config['ANALYSIS_PARALLEL_MIN_POINTS'] = 0
+    pool = timed(lambda: executor.run_analyses(jobs), args.repeat)
+
+    return {'size': size, 'trips': len(jobs), 'inline_s': inline, 'pool_s': pool, 'speedup': inline / pool}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[2500, 5000, 10000, 20000, 40000, 80000])
+    parser.add_argument('--workers', type=int, default=executor.ANALYSIS_WORKERS)
+    parser.add_argument('--gap-every', type=int, default=4000, help='fixes between liveness gaps, each gap starts a trip')
+    parser.add_argument('--stops', type=int, default=8)
+    parser.add_argument('--cell-size', type=float, default=0.1)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write results as JSON to this file')
+    args = parser.parse_args()
+
+    app.config['ANALYSIS_WORKERS'] = args.workers
+    gps_data_route = parse_gpx_file(gpx_generator.to_gpx(gpx_generator.route_points()))
+    stops = parse_gpx_waypoints(gpx_generator.to_waypoints_gpx(gpx_generator.stop_corners(args.stops)))
+    route_grid = build_route_grid(gps_data_route, stops, args.cell_size)
+    parameters = {
+        'cell_size': args.cell_size, 'stop_min_time': 30, 'stop_max_time': 120,
+        'speeding_time_limit': 30, 'speeding_speed_limit': 40, 'liveness_time_limit': 300,
+        'deviation_distance': 100, 'deviation_min_time': 60
+    }
+
+    # start the workers before timing anything
+    executor.get_executor().submit(os.getpid).result()
+
+    results = []
+    print(f"{'size':>10}{'trips':>8}{'inline s':>12}{'pool s':>12}{'speedup':>10}  ({args.workers} workers)")
+    for size in args.sizes:
+        result = bench_size(size, route_grid, parameters, args)
+        results.append(result)
+        print(f"{result['size']:>10}{result['trips']:>8}{result['inline_s']:>12.4f}{result['pool_s']:>12.4f}{result['speedup']:>10.2f}", flush=True)
+
+    faster = [result['size'] for result in results if result['speedup'] > 1]
+    print(f"\nthe pool is faster from {faster[0]} fixes" if faster else '\nthe pool is never faster')
+    executor.reset_executor()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'workers': args.workers, 'results': results}, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+"""
+Login throughput for candidate password hash settings
+
+Usage: python -m benchmarks.bench_login [--methods pbkdf2:sha256:150000 ...]
+"""
+import time
+import json
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from project2 import app
+from project2.security import hash_password, verify_password
+from werkzeug.security import check_password_hash
+
+DEFAULT_METHODS = ['pbkdf2:sha256:150000', 'pbkdf2:sha256:260000', 'pbkdf2:sha256:600000']
+
+def bench_method(method, logins, concurrency):
+    # as if {method} were configured, so logins do not trigger a rehash
+    app.config['PASSWORD_HASH_METHOD'] = method
+    pwhash = hash_password('benchmark-password')
+
+    start = time.perf_counter()
+    for _ in range(5):
+        check_password_hash(pwhash, 'benchmark-password')
+    single = (time.perf_counter() - start) / 5
+
+    # logins arrive from {concurrency} request threads and share the pool
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as requests:
+        results = list(requests.map(lambda _: verify_password(pwhash, 'benchmark-password'), range(logins)))
+    elapsed = time.perf_counter() - start
+
+    assert all(valid and new_hash is None for valid, new_hash in results)
+
+    return {
+        'method': method,
+        'verify_ms': single * 1000,
+        'logins': logins,
+        'concurrency': concurrency,
+        'elapsed_s': elapsed,
+        'logins_per_s': logins / elapsed
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--methods', nargs='+', default=DEFAULT_METHODS)
+    parser.add_argument('--logins', type=int, default=50)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--output', help='write results as JSON to this file')
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'method':<28}{'verify ms':>12}{'logins/s':>12}")
+    for method in args.methods:
+        result = bench_method(method, args.logins, args.concurrency)
+        results.append(result)
+        print(f"{result['method']:<28}{result['verify_ms']:>12.1f}{result['logins_per_s']:>12.1f}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""
+Synthetic GPX for benchmarks: a circular reference route, stop
+fences spread along it, and vehicles that drive the route with
+GPS noise, dwell at stops and drop out for gaps
+"""
+import math
+import random
+from datetime import datetime, timedelta
+
+CENTER = (14.6549, 121.0645)
+DEGREES_PER_KM = 0.009
+START_TIME = datetime(2021, 3, 1, 6, 0, 0)
+
+def route_position(fraction, radius_km):
+    angle = 2 * math.pi * fraction
+    radius = radius_km * DEGREES_PER_KM
+    return CENTER[0] + radius * math.sin(angle), CENTER[1] + radius * math.cos(angle)
+
+def route_points(n=500, radius_km=2.0):
+    """
+    One lap of the reference route
+    """
+    points = []
+    for i in range(n):
+        lat, lon = route_position(i / n, radius_km)
+        points.append((lat, lon, START_TIME + timedelta(seconds=i), None))
+    return points
+
+def stop_fractions(stop_count):
+    return [(k + 0.5) / stop_count for k in range(stop_count)]
+
+def stop_corners(stop_count=8, radius_km=2.0, half_size_m=40):
+    """
+    Top left and bottom right corners of each stop fence,
+    in the order csv_to_gpx_stops writes them
+    """
+    half_size = half_size_m / 1000.0 * DEGREES_PER_KM
+    corners = []
+    for fraction in stop_fractions(stop_count):
+        lat, lon = route_position(fraction, radius_km)
+        corners.append((lat + half_size, lon - half_size))
+        corners.append((lat - half_size, lon + half_size))
+    return corners
+
+def vehicle_points(n, loops=None, stop_count=8, radius_km=2.0, speed_kmh=30.0, interval=5, noise_m=5.0, stop_dwell=60, gap_every=0, gap_seconds=900, explicit_speed=0.5, seed=0):
+    """
+    Drives laps of the route in about {n} fixes.
+    Input:  loops laps to drive, by default as many as {speed_kmh}
+            allows; given explicitly it sets the speed instead
+            interval, stop_dwell, gap_seconds in seconds
+            noise_m standard deviation of the GPS noise in meters
+            gap_every fixes between liveness gaps, 0 for none
+            explicit_speed share of fixes that carry a <speed>
+    Output: list of (lat, lon, time, speed)
+    """
+    rng = random.Random(seed)
+    noise = noise_m / 1000.0 * DEGREES_PER_KM
+    lap_km = 2 * math.pi * radius_km
+    if loops is None:
+        loops = max(1, round(n * interval * speed_kmh / 3600.0 / lap_km))
+
+    dwell_fixes = int(stop_dwell // interval)
+    moving_fixes = max(n - loops * stop_count * dwell_fixes, 1)
+    step = loops / moving_fixes
+
+    stops = [lap + fraction for lap in range(loops) for fraction in stop_fractions(stop_count)]
+    next_stop = 0
+
+    points = []
+    progress = 0.0
+    time = START_TIME
+
+    def emit(fraction, speed):
+        lat, lon = route_position(fraction % 1, radius_km)
+        lat += rng.gauss(0, noise)
+        lon += rng.gauss(0, noise)
+        if speed is not None and rng.random() >= explicit_speed:
+            speed = None
+        points.append((lat, lon, time, speed))
+
+    for i in range(moving_fixes):
+        # vary the sampling interval so the speed swings around its mean
+        dt = interval * (1 + 0.4 * math.sin(i / 50.0))
+        progress += step
+        time += timedelta(seconds=dt)
+
+        if gap_every and i and i % gap_every == 0:
+            time += timedelta(seconds=gap_seconds)
+
+        emit(progress, step * lap_km / (dt / 3600.0))
+
+        while next_stop < len(stops) and progress >= stops[next_stop]:
+            for _ in range(dwell_fixes):
+                time += timedelta(seconds=interval)
+                emit(stops[next_stop], 0.0)
+            next_stop += 1
+
+    return points
+
+def to_gpx(points):
+    lines = ['<?xml version="1.0" encoding="UTF-8"?>', '<gpx version="1.0" creator="benchmarks">', '<trk><trkseg>']
+    for lat, lon, time, speed in points:
+        speed = f'<speed>{speed:.3f}</speed>' if speed is not None else ''
+        lines.append(f'<trkpt lat="{lat:.7f}" lon="{lon:.7f}"><ele>20.0</ele><time>{time.strftime("%Y-%m-%dT%H:%M:%SZ")}</time>{speed}</trkpt>')
+    lines.append('</trkseg></trk></gpx>')
+    return '\n'.join(lines).encode('utf-8')
+
+def to_waypoints_gpx(corners):
+    lines = ['<?xml version="1.0" encoding="UTF-8"?>', '<gpx version="1.0" creator="benchmarks">']
+    for lat, lon in corners:
+        lines.append(f'<wpt lat="{lat:.7f}" lon="{lon:.7f}"></wpt>')
+    lines.append('</gpx>')
+    return '\n'.join(lines).encode('utf-8')
@@ -1,4 +1,5 @@
 import os 
+import multiprocessing
 from flask import Flask
 from project2.config import Config
 from flask_sqlalchemy import SQLAlchemy
@@ -9,4 +10,7 @@ cors = CORS(app)
 app.config.from_object(Config)
 db = SQLAlchemy(app)
 
-from project2 import routes
\ No newline at end of file
+# analysis workers are spawned from the server and only run
+# project2.stages, so they leave out the routes and their clients
+if multiprocessing.current_process().name == 'MainProcess':
+    from project2 import routes, profiler
\ No newline at end of file
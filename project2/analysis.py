@@ -0,0 +1,805 @@
+import math
+from datetime import datetime
+import numpy as np
+from haversine import haversine, haversine_vector
+
+# the trajectory analyses. Analysis workers import this module, so it
+# must not import the app, the database or the models
+
+class Point():
+    __slots__ = ('lat', 'lon')
+
+    def __init__(self, lat, lon):
+        self.lat = lat
+        self.lon = lon
+
+class Polygon():
+    __slots__ = ('top_left_pt', 'bottom_right_pt')
+
+    def __init__(self, top_left_pt, bottom_right_pt):
+        self.top_left_pt = top_left_pt
+        self.bottom_right_pt = bottom_right_pt
+
+    def contains(self, point):
+        if self.top_left_pt.lat >= point.lat and self.top_left_pt.lon <= point.lon and self.bottom_right_pt.lat < point.lat and self.bottom_right_pt.lon > point.lon:
+            return True
+        else:
+            return False
+
+    def contains_coordinates(self, lat, lon):
+        return self.top_left_pt.lat >= lat and self.top_left_pt.lon <= lon and self.bottom_right_pt.lat < lat and self.bottom_right_pt.lon > lon
+
+def to_datetime(timestamp, tzinfo=None):
+    if math.isnan(timestamp):
+        return None
+    return datetime.fromtimestamp(timestamp, tzinfo)
+
+class Trajectory():
+    """
+    GPS fixes as parallel float arrays instead of one dict per fix.
+    Times are epoch seconds, missing elevation/speed/time are NaN.
+    Indexing and iteration still give the point dicts that
+    parse_gpx_file used to return.
+    """
+    __slots__ = ('latitude', 'longitude', 'elevation', 'timestamp', 'speed', 'tzinfo')
+
+    def __init__(self, latitude, longitude, elevation, timestamp, speed, tzinfo=None):
+        self.latitude = np.asarray(latitude, dtype=np.float64)
+        self.longitude = np.asarray(longitude, dtype=np.float64)
+        self.elevation = np.asarray(elevation, dtype=np.float64)
+        self.timestamp = np.asarray(timestamp, dtype=np.float64)
+        self.speed = np.asarray(speed, dtype=np.float64)
+        self.tzinfo = tzinfo
+
+    @classmethod
+    def from_points(cls, points):
+        nan = float('nan')
+        tzinfo = next((point['time'].tzinfo for point in points if point.get('time') is not None), None)
+
+        return cls(
+            [point['latitude'] for point in points],
+            [point['longitude'] for point in points],
+            [nan if point.get('elevation') is None else point['elevation'] for point in points],
+            [nan if point.get('time') is None else point['time'].timestamp() for point in points],
+            [nan if point.get('speed') is None else point['speed'] for point in points],
+            tzinfo
+        )
+
+    def __len__(self):
+        return len(self.latitude)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return Trajectory(self.latitude[index], self.longitude[index], self.elevation[index], self.timestamp[index], self.speed[index], self.tzinfo)
+
+        elevation = self.elevation[index]
+        speed = self.speed[index]
+
+        return {
+            'latitude': float(self.latitude[index]),
+            'longitude': float(self.longitude[index]),
+            'elevation': None if np.isnan(elevation) else float(elevation),
+            'time': self.time(index),
+            'speed': None if np.isnan(speed) else float(speed)
+        }
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def time(self, index):
+        return to_datetime(float(self.timestamp[index]), self.tzinfo)
+
+    def take(self, indices):
+        return Trajectory(self.latitude[indices], self.longitude[indices], self.elevation[indices], self.timestamp[indices], self.speed[indices], self.tzinfo)
+
+    def unique_times(self):
+        """
+        One fix per timestamp, placed where the timestamp first
+        appears and holding the values of its last occurrence
+        """
+        timestamp = self.timestamp
+        if len(timestamp) < 2 or np.all(timestamp[1:] > timestamp[:-1]):
+            return self
+
+        first = np.unique(timestamp, return_index=True)[1]
+        last = len(timestamp) - 1 - np.unique(timestamp[::-1], return_index=True)[1]
+
+        return self.take(last[np.argsort(first, kind='stable')])
+
+def concatenate_trajectories(trajectories):
+    tzinfo = next((trajectory.tzinfo for trajectory in trajectories if trajectory.tzinfo is not None), None)
+    fields = ('latitude', 'longitude', 'elevation', 'timestamp', 'speed')
+
+    return Trajectory(*[np.concatenate([getattr(trajectory, field) for trajectory in trajectories]) for field in fields], tzinfo)
+
+def as_trajectory(gps_data):
+    if isinstance(gps_data, Trajectory):
+        return gps_data
+    return Trajectory.from_points(gps_data)
+
+def compute_distance_travelled(gps_data):
+    """
+    Calculates total distance travelled in km
+    """
+    gps_data = as_trajectory(gps_data)
+    lat = gps_data.latitude.tolist()
+    lon = gps_data.longitude.tolist()
+
+    distance_travelled = 0.0
+    for i in range(len(lat) - 1):
+        distance_travelled += haversine((lat[i], lon[i]), (lat[i+1], lon[i+1]))
+    
+    return '%.2f'%(distance_travelled)
+
+def sec_to_minute(seconds):
+    return seconds / 60.0
+
+def sec_to_hour(seconds):
+    return seconds / 3600.0
+
+def speed_between_points(lon1, lat1, time1, lon2, lat2, time2):
+    """
+    Given 2 GPS points, calculate the speed between them
+    """
+    return speed_between_timestamps(lon1, lat1, time1.timestamp(), lon2, lat2, time2.timestamp())
+
+def speed_between_timestamps(lon1, lat1, timestamp1, lon2, lat2, timestamp2):
+    d_time = sec_to_hour(timestamp2 - timestamp1)
+    d_distance = haversine((lat1, lon1), (lat2, lon2))
+    return d_distance / d_time
+
+def location_speeds(gps_data):
+    """
+    Speed in km/hr from each fix to the next, len(gps_data) - 1 values
+    """
+    points = np.column_stack((gps_data.latitude, gps_data.longitude))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return haversine_vector(points[:-1], points[1:]) / sec_to_hour(np.diff(gps_data.timestamp))
+
+def run_durations(timestamp, first, last):
+    """
+    Seconds from fix first to fix last of each run. A fix without a
+    time inside a run leaves it without a duration, as adding up the
+    gaps one fix at a time did.
+    """
+    missing = np.concatenate(([0], np.cumsum(np.isnan(timestamp))))
+    duration = timestamp[last] - timestamp[first]
+    duration[missing[last + 1] > missing[first]] = np.nan
+    return duration
+
+def compute_speed_violation(gps_data, type, speed_limit, time):
+    """
+    Determines if a speed violation of {speed_limit}
+    occured for {time} minutes, given {type} of analysis.
+    Input:
+        type = "Explicit" or "Location"
+        speed_limit in km/hr
+        time in seconds
+    Each fix but the last gets a speed, runs of fixes at or over the
+    limit are found from the edges of that mask, and a run that a
+    slower fix ends after {time} seconds or more is a violation.
+    With {time} 0 only those runs are reported. The per-fix loop this
+    replaced also reported the previous run again at every further
+    slower fix, and failed on a track that started below the limit.
+    """
+    if type not in ("Explicit", "Location"):
+        raise ValueError(f'unknown speed analysis {type}')
+
+    gps_data = as_trajectory(gps_data)
+    if len(gps_data) < 2:
+        return []
+
+    timestamp = gps_data.timestamp
+    speed = location_speeds(gps_data)
+
+    if type == "Explicit":
+        explicit_speed = gps_data.speed[:-1]
+        speed = np.where(np.isnan(explicit_speed), speed, explicit_speed)
+
+    over = np.concatenate(([0], speed >= speed_limit, [0])).astype(np.int8)
+    edges = np.flatnonzero(np.diff(over))
+    first, end = edges[0::2], edges[1::2]
+
+    # a run still going at the last fix with a speed is never ended
+    ended = end < len(speed)
+    first, last = first[ended], end[ended] - 1
+
+    duration = run_durations(timestamp, first, last)
+    violations = duration >= time
+
+    lat = gps_data.latitude
+    lon = gps_data.longitude
+    list_violations = []
+    for start_index, end_index, time_elapsed in zip(first[violations].tolist(), last[violations].tolist(), duration[violations].tolist()):
+        violation = {
+            'duration': time_elapsed,
+            'lat1': float(lat[start_index]),
+            'long1': float(lon[start_index]),
+            'time1': gps_data.time(start_index),
+            'lat2': float(lat[end_index]),
+            'long2': float(lon[end_index]),
+            'time2': gps_data.time(end_index)
+        }
+
+        list_violations.append(violation)
+
+    return list_violations
+
+def speed_series(gps_data):
+    """
+    The speed at each fix as compute_speed_violation's "Explicit"
+    analysis takes it: the GPX speed where there is one, otherwise
+    the speed to the next fix
+    Output: timestamp, speed (km/hr) arrays without the fixes that
+            have no speed
+    """
+    gps_data = as_trajectory(gps_data)
+    timestamp = gps_data.timestamp
+    speed = gps_data.speed.copy()
+
+    if len(gps_data) > 1:
+        location_speed = location_speeds(gps_data)
+        missing = np.isnan(speed[:-1])
+        speed[:-1][missing] = location_speed[missing]
+
+    known = np.isfinite(speed) & ~np.isnan(timestamp)
+    return timestamp[known], speed[known]
+
+def largest_triangle_three_buckets(x, y, threshold):
+    """
+    Downsamples the series (x, y) to {threshold} points that keep its
+    shape: the first and last point, and from each bucket between
+    them the point spanning the largest triangle with the point kept
+    before it and the average of the next bucket
+    Output: indices of the kept points
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    every = (n - 2) / (threshold - 2)
+    edges = np.floor(np.arange(threshold - 1) * every).astype(np.int64) + 1
+    edges[-1] = n - 1
+
+    indices = np.empty(threshold, dtype=np.int64)
+    indices[0], indices[-1] = 0, n - 1
+    a = 0
+
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        average_x = x[end:next_end].mean()
+        average_y = y[end:next_end].mean()
+
+        area = np.abs((x[a] - average_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (average_y - y[a]))
+        a = start + int(np.argmax(area))
+        indices[i + 1] = a
+
+    return indices
+
+def speed_profile(gps_data, width):
+    """
+    The speed series of {gps_data} downsampled to {width} points
+    Output: dict of timestamps, speeds and the number of points
+            before downsampling
+    """
+    timestamp, speed = speed_series(gps_data)
+    kept = largest_triangle_three_buckets(timestamp, speed, width)
+
+    return {
+        'timestamps': timestamp[kept].tolist(),
+        'speeds': np.round(speed[kept], 2).tolist(),
+        'points': len(timestamp)
+    }
+
+def fence_membership(latitude, longitude, fences):
+    """
+    Input:  latitude, longitude arrays
+            fences (list of (top left Point, bottom right Point))
+    Output: boolean array, one row per fence, True where the fix is
+            inside by the same bounds as Polygon.contains
+    """
+    latitude = np.asarray(latitude, dtype=np.float64)
+    longitude = np.asarray(longitude, dtype=np.float64)
+
+    top = np.array([point1.lat for point1, point2 in fences], dtype=np.float64)[:, None]
+    left = np.array([point1.lon for point1, point2 in fences], dtype=np.float64)[:, None]
+    bottom = np.array([point2.lat for point1, point2 in fences], dtype=np.float64)[:, None]
+    right = np.array([point2.lon for point1, point2 in fences], dtype=np.float64)[:, None]
+
+    return (top >= latitude) & (left <= longitude) & (bottom < latitude) & (right > longitude)
+
+def fence_transitions(membership):
+    """
+    Input:  membership from fence_membership
+    Output: fence, enter, exit index arrays, one entry per run of
+            fixes inside a fence: fixes enter .. exit - 1 are inside,
+            exit == number of fixes when the run lasts to the end.
+            Runs are ordered by fence, then by time.
+    """
+    membership = np.atleast_2d(membership)
+    padded = np.zeros((membership.shape[0], membership.shape[1] + 2), dtype=np.int8)
+    padded[:, 1:-1] = membership
+
+    edges = np.diff(padded, axis=1)
+    fence, enter = np.nonzero(edges == 1)
+    exit = np.nonzero(edges == -1)[1]
+
+    return fence, enter, exit
+
+def stop_violations(gps_data, min_time, max_time, fences):
+    gps_data = as_trajectory(gps_data)
+    timestamp = gps_data.timestamp
+    if not fences or not len(timestamp):
+        return []
+
+    fence, enter, exit = fence_transitions(fence_membership(gps_data.latitude, gps_data.longitude, fences))
+
+    # a run only counts once a fix outside the fence ends it
+    closed = exit < len(timestamp)
+    fence, enter, last = fence[closed], enter[closed], exit[closed] - 1
+
+    fence_time = timestamp[last] - timestamp[enter]
+    violating = (fence_time < min_time) | (fence_time > max_time)
+
+    results = []
+    for k, i, j, duration in zip(fence[violating].tolist(), enter[violating].tolist(), last[violating].tolist(), fence_time[violating].tolist()):
+        point1, point2 = fences[k]
+        results.append({
+            'duration': duration,
+            'time1': gps_data.time(i),
+            'time2': gps_data.time(j),
+            'center_lat': (point1.lat + point2.lat) / 2,
+            'center_long': (point1.lon + point2.lon) / 2,
+            'violation': 'below limit' if duration < min_time else 'above limit'
+        })
+
+    return results
+
+def stop_violation(gps_data, min_time, max_time, point1, point2):
+    return stop_violations(gps_data, min_time, max_time, [(point1, point2)])
+
+def stop_fences(stops):
+    """
+    The stop waypoints, top left and bottom right corner of each
+    fence in turn, as a list of (point1, point2)
+    """
+    fences = []
+    for i in range(len(stops)):
+        if i % 2 == 0:
+            point1 = Point(stops[i]['latitude'], stops[i]['longitude'])
+            point2 = Point(stops[i+1]['latitude'], stops[i+1]['longitude'])
+            fences.append((point1, point2))
+
+    return fences
+
+def compute_stop_violation(stops, gps_data_vehicle, min_time, max_time):
+    return stop_violations(gps_data_vehicle, min_time, max_time, stop_fences(stops))
+
+def stop_arrivals(gps_data, fences):
+    """
+    Output: stop, timestamp arrays, one entry for every time the
+            vehicle enters a stop fence
+    """
+    gps_data = as_trajectory(gps_data)
+    if not fences or not len(gps_data):
+        return np.zeros(0, dtype=np.int64), np.zeros(0)
+
+    fence, enter, exit = fence_transitions(fence_membership(gps_data.latitude, gps_data.longitude, fences))
+    return fence, gps_data.timestamp[enter]
+
+def compute_headways(arrivals, min_headway, max_headway):
+    """
+    Headways between consecutive vehicles at each stop, from one
+    sort of every arrival by stop and time instead of comparing
+    vehicles pairwise.
+    Input:  arrivals (list of (vehicle id, stop array, timestamp
+            array) from stop_arrivals)
+            min_headway, max_headway in seconds
+    Output: dict of stops (stop -> count, mean and standard deviation
+            of the headways) and events, headways under
+            {min_headway} ("bunching") or over {max_headway} ("gap")
+    """
+    if not sum(len(stop) for vehicle_id, stop, timestamp in arrivals):
+        return {'stops': {}, 'events': []}
+
+    vehicle = np.concatenate([np.full(len(stop), vehicle_id, dtype=np.int64) for vehicle_id, stop, timestamp in arrivals])
+    stop = np.concatenate([stop for vehicle_id, stop, timestamp in arrivals])
+    timestamp = np.concatenate([timestamp for vehicle_id, stop, timestamp in arrivals])
+
+    order = np.lexsort((timestamp, stop))
+    vehicle, stop, timestamp = vehicle[order], stop[order], timestamp[order]
+
+    # a vehicle drifting in and out of a fence arrives only once
+    reentry = (stop[1:] == stop[:-1]) & (vehicle[1:] == vehicle[:-1]) & (np.diff(timestamp) < min_headway)
+    keep = np.concatenate([[True], ~reentry])
+    vehicle, stop, timestamp = vehicle[keep], stop[keep], timestamp[keep]
+
+    following = np.flatnonzero(stop[1:] == stop[:-1]) + 1
+    headway = timestamp[following] - timestamp[following - 1]
+
+    stops = {}
+    for k in np.unique(stop[following]).tolist():
+        stop_headway = headway[stop[following] == k]
+        stops[k] = {'count': len(stop_headway), 'mean': float(stop_headway.mean()), 'std': float(stop_headway.std())}
+
+    events = []
+    flagged = (headway < min_headway) | (headway > max_headway)
+    for i, value in zip(following[flagged].tolist(), headway[flagged].tolist()):
+        events.append({
+            'type': 'bunching' if value < min_headway else 'gap',
+            'stop': int(stop[i]),
+            'headway': value,
+            'leader': int(vehicle[i - 1]),
+            'follower': int(vehicle[i]),
+            'time1': float(timestamp[i - 1]),
+            'time2': float(timestamp[i])
+        })
+
+    return {'stops': stops, 'events': events}
+
+def compute_deviations(gps_data, route_index, max_distance, min_time):
+    """
+    Finds where the vehicle left its route: runs of fixes farther
+    than {max_distance} meters from the reference path, lasting at
+    least {min_time} seconds. Like stop violations, a run only
+    counts once a fix back on the route ends it.
+    Input:  gps_data (Trajectory or array of dictionaries)
+            route_index (SegmentIndex of the reference path)
+    Output: list of dictionaries, distance is the farthest the
+            vehicle got from the route, at lat, long
+    """
+    gps_data = as_trajectory(gps_data)
+    timestamp = gps_data.timestamp
+    if not len(timestamp):
+        return []
+
+    distance = route_index.nearest(gps_data.latitude, gps_data.longitude)[0]
+    _, enter, exit = fence_transitions(distance > max_distance)
+
+    closed = exit < len(timestamp)
+    enter, last = enter[closed], exit[closed] - 1
+    duration = timestamp[last] - timestamp[enter]
+
+    results = []
+    for first, last, duration in zip(enter.tolist(), last.tolist(), duration.tolist()):
+        if duration < min_time:
+            continue
+
+        farthest = first + int(np.argmax(distance[first:last + 1]))
+        results.append({
+            'duration': duration,
+            'distance': float(distance[farthest]),
+            'time1': gps_data.time(first),
+            'time2': gps_data.time(last),
+            'lat': float(gps_data.latitude[farthest]),
+            'long': float(gps_data.longitude[farthest])
+        })
+
+    return results
+
+def compute_liveness(gps_data, time_limit):
+    """
+    Determines total "aliveness" time of a vehicle. The
+    vehicle is considered "alive" if the gaps between
+    GPS readings are less than given {time_limit}.
+    Input:  gps_data (Trajectory or array of dictionaries)
+            time_limit (in seconds)
+    Output: total_liveness (in seconds)
+            results (array of dictionaries)
+    """
+    gps_data = as_trajectory(gps_data)
+    timestamp = gps_data.timestamp.tolist()
+
+    results = []
+    total_liveness = 0
+    start_index = 0
+
+    for i in range(len(timestamp) - 1):
+        time_diff = timestamp[i+1] - timestamp[i]
+
+        if time_diff >= time_limit:
+            segment_liveness = timestamp[i] - timestamp[start_index]
+            results.append({
+                "liveness": segment_liveness,
+                "time1": gps_data.time(start_index),
+                "time2": gps_data.time(i)
+            })
+            start_index = i + 1
+            total_liveness += segment_liveness
+    
+    segment_liveness = timestamp[-1] - timestamp[start_index]
+    results.append({
+        "liveness": segment_liveness,
+        "time1": gps_data.time(start_index),
+        "time2": gps_data.time(len(timestamp) - 1)
+    })
+    total_liveness += segment_liveness
+    results = {'total_liveness': total_liveness, 'segments': results}
+
+    return results
+
+def split_trips(gps_data, time_limit):
+    """
+    Splits {gps_data} into trips wherever consecutive fixes are
+    {time_limit} seconds or more apart, the gaps compute_liveness
+    ends its segments at
+    Output: list of Trajectory, one per trip, in order
+    """
+    gps_data = as_trajectory(gps_data)
+    if not len(gps_data):
+        return []
+    if time_limit is None or len(gps_data) == 1:
+        return [gps_data]
+
+    cuts = (np.flatnonzero(np.diff(gps_data.timestamp) >= time_limit) + 1).tolist()
+    return [gps_data[start:stop] for start, stop in zip([0] + cuts, cuts + [len(gps_data)])]
+
+class GridFence():
+    """
+    Grid of square cells over the box from point1 (top left) to
+    point2 (bottom right). Only the row and column edges are stored,
+    so memory does not grow with the area.
+    Cells are numbered row * width + col, top left first.
+    """
+    __slots__ = ('lat_edges', 'lon_edges', 'rows', 'width')
+
+    def __init__(self, point1, point2, side_interval):
+        # accumulate the edges exactly as the cells used to be laid out,
+        # so neighbouring cells share their boundary values
+        lat_edges = [point1.lat]
+        while lat_edges[-1] > point2.lat:
+            lat_edges.append(lat_edges[-1] - side_interval)
+
+        lon_edges = [point1.lon]
+        while lon_edges[-1] < point2.lon:
+            lon_edges.append(lon_edges[-1] + side_interval)
+
+        self.lat_edges = np.array(lat_edges)
+        self.lon_edges = np.array(lon_edges)
+        self.rows = len(lat_edges) - 1
+        self.width = len(lon_edges) - 1
+
+    def __len__(self):
+        return self.rows * self.width
+
+    def cell_numbers(self, latitude, longitude):
+        """
+        Input:  latitude, longitude arrays
+        Output: cell number of each coordinate, -1 outside the grid
+        """
+        # rows hold top >= lat > bottom, columns left <= lon < right
+        i = np.searchsorted(-self.lat_edges, -np.asarray(latitude, dtype=np.float64), side='right') - 1
+        j = np.searchsorted(self.lon_edges, np.asarray(longitude, dtype=np.float64), side='right') - 1
+
+        inside = (i >= 0) & (i < self.rows) & (j >= 0) & (j < self.width)
+        return np.where(inside, i * self.width + j, -1)
+
+def generate_grid_fence(point1, point2, side_length):
+    return GridFence(point1, point2, side_length * 0.009)
+
+def generate_path(gps_data, grid_fence, keep_outside=False):
+    gps_data = as_trajectory(gps_data)
+
+    if isinstance(grid_fence, GridFence):
+        cells = grid_fence.cell_numbers(gps_data.latitude, gps_data.longitude)
+        if not keep_outside:
+            # a fix outside the grid does not break a run of the same cell
+            cells = cells[cells >= 0]
+        if not len(cells):
+            return []
+
+        changed = np.empty(len(cells), dtype=bool)
+        changed[0] = True
+        np.not_equal(cells[1:], cells[:-1], out=changed[1:])
+        return cells[changed].tolist()
+
+    lat = gps_data.latitude.tolist()
+    lon = gps_data.longitude.tolist()
+
+    path = []
+    current_fence = -1
+
+    for k in range(len(lat)):
+        for i in range(len(grid_fence)):
+            if grid_fence[i].contains_coordinates(lat[k], lon[k]):
+                if current_fence != i:
+                    current_fence = i 
+                    path.append(i)
+                    break
+
+    return path
+
+def prefix_table(pattern):
+    """
+    KMP failure function: table[i] is the length of the longest
+    proper prefix of pattern[:i + 1] that is also its suffix
+    """
+    table = [0] * len(pattern)
+    k = 0
+    for i in range(1, len(pattern)):
+        while k and pattern[i] != pattern[k]:
+            k = table[k - 1]
+        if pattern[i] == pattern[k]:
+            k += 1
+        table[i] = k
+    return table
+
+def count_occurrences(pattern, sequence):
+    """
+    Counts the occurrences of {pattern} in {sequence}, overlapping
+    ones included, comparing whole cell ids in linear time
+    """
+    if not len(pattern):
+        return 0
+
+    table = prefix_table(pattern)
+    count = 0
+    k = 0
+    for cell in sequence:
+        while k and cell != pattern[k]:
+            k = table[k - 1]
+        if cell == pattern[k]:
+            k += 1
+        if k == len(pattern):
+            count += 1
+            k = table[k - 1]
+    return count
+
+def route_check(set_route, vehicle_route):
+    """
+    Number of times the vehicle path contains the whole route path
+    """
+    return count_occurrences(list(set_route), list(vehicle_route))
+
+def compute_loops(route, traj, grid_cells, adjacency=None):
+    errors = 0
+    loops = 0
+    r = 0
+    i = 0
+    while i < len(traj):
+        if traj[i] == route[r]:
+            r += 1
+        else:
+            ind = find_current_index(traj[i], route)
+            # "Local" Errors
+            if ind != -1:
+                if ind > r:
+                    r = ind + 1
+                elif ind < r:
+                    # a path shorter than the route, e.g. a short trip, may not reach ind
+                    if ind < len(traj) and traj[ind] == route[0]:
+                        if traj[i - 1] == route[1]:
+                            r = ind + 1
+                        else: 
+                            r = len(route) 
+                    else:
+                        r = ind + 1
+            # "Foreign" Errors
+            elif ind == -1:
+                i, r, detour, missed_route = detour_info(i, r, route, traj)
+                errors += check_neighbors(detour, missed_route, grid_cells, adjacency)
+        if r == len(route):
+            r = r % len(route)
+            if errors == 0:
+                loops += 1
+            else:
+                errors = 0
+        i += 1
+    return loops
+
+def detour_info(i, r, route, traj):
+    detour = []
+    missed_route = []
+    sub_traj = traj[i:]
+    _i = i
+    
+    # Find Detour List
+    for j in range(len(sub_traj)):
+        if find_current_index(sub_traj[j], route) == -1:
+            detour.append(sub_traj[j])
+            i += 1
+        else:
+            break
+
+    # Find Missing Route
+    if _i == 0:
+        if find_current_index(traj[i], route) == 0:
+            missed_route = [route[0]]
+        else:
+            end_index = find_current_index(traj[i], route) + 1
+            missed_route = route[0:end_index]
+        r = find_current_index(traj[i], route) + 1
+    elif _i != 0:
+        start_index = find_current_index(traj[_i-1], route)
+        if i == len(traj):
+            missed_route = route[start_index:len(route)]
+            r = len(route) # arbitrary, traj has already ended
+        else:
+            end_index = find_current_index(traj[i], route) + 1
+            if end_index < start_index:
+                missed_route = route[start_index:len(route)]
+                missed_route.append(end_index)
+            else:
+                missed_route = route[start_index:end_index]
+            r = find_current_index(traj[i], route) + 1
+    return i, r, detour, missed_route
+
+def check_neighbors(detour, missed_route, grid_cells, adjacency=None):
+    # A detour cell must be adjacent to at least one missed_route cell
+    err = 0
+    width = grid_cells.width
+    length = len(grid_cells)
+
+    for d in detour:
+        for r in missed_route:
+            neighbors = adjacency.get(r) if adjacency else None
+            if neighbors is None:
+                neighbors = adjacent_cells(r, width, length)
+            if d not in neighbors:
+                err = 1
+                break
+    return err
+
+def adjacent_cells(d, w, l):
+    # Top Left
+    if d == 0:
+        return [d+1, d+w, d+w+1]
+    # Top Right
+    elif d == w-1:
+        return [d-1, d+w-1, d+w]
+    # Bottom Left
+    elif d == l-w:
+        return [d-w, d-w+1, d+1]
+    # Bottom Right
+    elif d == l-1:
+        return [d-w-1, d-w, d-1]
+    # North
+    elif d < w:
+        return [d-1, d+1, d+w-1, d+w, d+w+1]
+    # South
+    elif (d < l) and (d >= l-w):
+        return [d-w-1, d-w, d-w+1, d-1, d+1]
+    # West
+    elif d % w == 0:
+        return [d-w, d-w+1, d+1, d+w, d+w+1]
+    # East
+    elif d % w == w - 1:
+        return [d-w-1, d-w, d-1, d+w-1, d+w]
+    # Middle
+    else:
+        return [d-w-1, d-w, d-w+1, d-1, d+1, d+w-1, d+w, d+w+1]
+
+def find_current_index(cell, route_list):
+    # Find what index in the route_list the trajectory cell exists in
+    for i in range(len(route_list)):
+        if route_list[i] == cell:
+            return i
+    return -1
+
+def analyze_loops(gps_data, parameters, route_grid):
+    # fixes outside the route grid count as one detour cell
+    vehicle_path = generate_path(gps_data, route_grid['grid'], keep_outside=True)
+    return compute_loops(route_grid['route_path'], vehicle_path, route_grid['grid'], route_grid['adjacency'])
+
+def analyze_speeding(gps_data, parameters, route_grid):
+    return compute_speed_violation(gps_data, "Explicit", parameters['speeding_speed_limit'], parameters['speeding_time_limit'])
+
+def analyze_stops(gps_data, parameters, route_grid):
+    return compute_stop_violation(route_grid['stops'], gps_data, parameters['stop_min_time'], parameters['stop_max_time'])
+
+def analyze_liveness(gps_data, parameters, route_grid):
+    return compute_liveness(gps_data, parameters['liveness_time_limit'])
+
+def analyze_deviations(gps_data, parameters, route_grid):
+    return compute_deviations(gps_data, route_grid['route_index'], parameters['deviation_distance'], parameters['deviation_min_time'])
+
+# independent of each other, so they can run in any order or in parallel
+ANALYSIS_STAGES = {
+    'loops': analyze_loops,
+    'speeding': analyze_speeding,
+    'stops': analyze_stops,
+    'liveness': analyze_liveness,
+    'deviations': analyze_deviations
+}
@@ -1,25 +1,35 @@
-from project2.models import Vehicle, Route, Parameters, Analysis, Distance, Loops, Speeding, Stops, Liveness
-from project2 import db
-from haversine import haversine
-from datetime import datetime
+from project2.models import Vehicle, Route, Parameters, Analysis, Distance, Loops, Speeding, Stops, Liveness, Deviation, Trip, AnalysisTail, GPSCutoffTime
+from project2 import app, db
+from project2.metrics import stage
+from project2.spatial import SegmentIndex
+from project2.analysis import Point, Polygon, to_datetime, Trajectory, concatenate_trajectories, as_trajectory, compute_distance_travelled, sec_to_minute, sec_to_hour, speed_between_points, speed_between_timestamps, location_speeds, run_durations, compute_speed_violation, speed_series, largest_triangle_three_buckets, speed_profile, fence_membership, fence_transitions, stop_violations, stop_violation, stop_fences, compute_stop_violation, stop_arrivals, compute_headways, compute_deviations, compute_liveness, split_trips, GridFence, generate_grid_fence, generate_path, prefix_table, count_occurrences, route_check, compute_loops, detour_info, check_neighbors, adjacent_cells, find_current_index, analyze_loops, analyze_speeding, analyze_stops, analyze_liveness, analyze_deviations, ANALYSIS_STAGES
+from haversine import haversine, haversine_vector
+from datetime import datetime, timezone
+from array import array
+from collections import OrderedDict
+from xml.etree import ElementTree
+import io
+import math
+import itertools
+import time
+import threading
+import numpy as np
 import gpxpy
 import gpxpy.gpx
+import gpxpy.gpxfield
+from dateutil import tz
 
-class Point():
-    def __init__(self, lat, lon):
-        self.lat = lat
-        self.lon = lon
-
-class Polygon():
-    def __init__(self, top_left_pt, bottom_right_pt):
-        self.top_left_pt = top_left_pt
-        self.bottom_right_pt = bottom_right_pt
+def parse_time(value):
+    """
+    A time given as ISO 8601 or epoch seconds, as a datetime
+    """
+    if isinstance(value, str):
+        try:
+            value = float(value)
+        except ValueError:
+            return gpxpy.gpxfield.TIME_TYPE.from_string(value)
 
-    def contains(self, point):
-        if self.top_left_pt.lat >= point.lat and self.top_left_pt.lon <= point.lon and self.bottom_right_pt.lat < point.lat and self.bottom_right_pt.lon > point.lon:
-            return True
-        else:
-            return False
+    return datetime.fromtimestamp(value, timezone.utc)
 
 def list_to_string(list):
     return ','.join(str(element) for element in list)
@@ -39,31 +49,51 @@ def create_geojson_feature(gps_data):
         "coordinates": []
     }
 
-    for location in gps_data:
-        point = [location['longitude'], location['latitude']]
-        geojson["coordinates"].append(point)
-        
+    gps_data = as_trajectory(gps_data)
+    geojson["coordinates"] = np.column_stack((gps_data.longitude, gps_data.latitude)).tolist()
+
     return geojson
 
+def encode_polyline(gps_data, precision=5):
+    """
+    Encodes the coordinates with the Encoded Polyline Algorithm,
+    zigzag varint deltas packed into printable characters
+    """
+    gps_data = as_trajectory(gps_data)
+    factor = 10 ** precision
+    encoded = []
+    prev_lat = 0
+    prev_long = 0
+
+    for latitude, longitude in zip(gps_data.latitude.tolist(), gps_data.longitude.tolist()):
+        lat = int(math.floor(latitude * factor + 0.5))
+        long = int(math.floor(longitude * factor + 0.5))
+
+        for delta in (lat - prev_lat, long - prev_long):
+            value = ~(delta << 1) if delta < 0 else delta << 1
+            while value >= 0x20:
+                encoded.append(chr((0x20 | (value & 0x1f)) + 63))
+                value >>= 5
+            encoded.append(chr(value + 63))
+
+        prev_lat = lat
+        prev_long = long
+
+    return ''.join(encoded)
+
+def create_polyline_feature(gps_data, precision=5):
+    return {
+        "type": "EncodedPolyline",
+        "precision": precision,
+        "coordinates": encode_polyline(gps_data, precision)
+    }
+
 def generate_corner_pts(gps_data, buffer=0.1):
-    greatest_lat = gps_data[0].get('latitude')
-    least_lat = gps_data[0].get('latitude')
-    greatest_long = gps_data[0].get('longitude')
-    least_long = gps_data[0].get('longitude')
-
-    for point in gps_data:
-        point_lat = point.get('latitude')
-        point_long = point.get('longitude')
-
-        if point_lat > greatest_lat:
-            greatest_lat = point_lat 
-        elif point_lat < least_lat:
-            least_lat = point_lat
-        
-        if point_long > greatest_long:
-            greatest_long = point_long
-        elif point_long < least_long:
-            least_long = point_long
+    gps_data = as_trajectory(gps_data)
+    greatest_lat = float(gps_data.latitude.max())
+    least_lat = float(gps_data.latitude.min())
+    greatest_long = float(gps_data.longitude.max())
+    least_long = float(gps_data.longitude.min())
 
     # 1km * buffer, buffer by default is 0.1 (100m), buffer is set to cell_size
     greatest_lat += 0.009 * buffer
@@ -98,25 +128,175 @@ def csv_to_gpx_stops(stop_file):
 
     return gpx 
 
-def parse_gpx_file(gpx_file_location):
+SERVICE_TIMEZONE = 'UTC'
+
+def service_date(gps_data):
+    """
+    The date in SERVICE_TIMEZONE of the first fix with a time, None
+    if there is none
+    """
+    timed = np.flatnonzero(~np.isnan(gps_data.timestamp))
+    if not len(timed):
+        return None
+    return datetime.fromtimestamp(gps_data.timestamp[timed[0]], tz.gettz(app.config.get('SERVICE_TIMEZONE', SERVICE_TIMEZONE))).date()
+
+def past_cutoff(cutoff, date=None):
+    """
+    A check to call on each fix's time in turn, True from the first
+    fix past {cutoff} (a datetime.time in SERVICE_TIMEZONE) on the
+    service date onwards. The service date is {date}, by default the
+    date of the first fix with a time, so a log that runs past
+    midnight stays cut off.
     """
-    Parses GPX file to output array of objects
+    zone = tz.gettz(app.config.get('SERVICE_TIMEZONE', SERVICE_TIMEZONE))
+    end = None if cutoff is None or date is None else datetime.combine(date, cutoff, zone)
+    passed = False
+
+    def check(time):
+        nonlocal end, passed
+        if cutoff is None or time is None or passed:
+            return passed
+
+        # a time without a zone is read as service time
+        if time.tzinfo is None:
+            time = time.replace(tzinfo=zone)
+        if end is None:
+            end = datetime.combine(time.astimezone(zone).date(), cutoff, zone)
+        passed = time > end
+        return passed
+
+    return check
+
+def stream_gpx_file(gpx_file, cutoff=None, counts=None, date=None):
     """
-    points = []
-    gpx = gpxpy.parse(gpx_file_location)
+    Reads the track points with iterparse, dropping each one once
+    read, so the whole GPX tree never sits in memory. Fields are
+    converted the way gpxpy does: <speed> only exists in GPX 1.0.
+    Fixes from the first one past {cutoff} on are skipped as they
+    are read, counts['dropped'] gets how many.
+    """
+    if isinstance(gpx_file, str):
+        gpx_file = gpx_file.encode('utf-8')
+    if isinstance(gpx_file, bytes):
+        gpx_file = io.BytesIO(gpx_file)
+
+    nan = float('nan')
+    latitude = array('d')
+    longitude = array('d')
+    elevation = array('d')
+    timestamp = array('d')
+    speed = array('d')
+    tzinfo = None
+    dropped = 0
+    cut_off = past_cutoff(cutoff, date)
+
+    root = None
+    parents = []
+
+    for event, element in ElementTree.iterparse(gpx_file, events=('start', 'end')):
+        if event == 'start':
+            if root is None:
+                root = element
+                namespace = element.tag[:element.tag.index('}') + 1] if element.tag.startswith('{') else ''
+                version = element.get('version') or '1.0'
+                trkpt_tag = namespace + 'trkpt'
+                fields = {namespace + 'ele': 'ele', namespace + 'time': 'time'}
+                if version == '1.0':
+                    fields[namespace + 'speed'] = 'speed'
+            parents.append(element)
+            continue
+
+        parents.pop()
+        if element.tag != trkpt_tag:
+            continue
+
+        values = {}
+        for child in element:
+            field = fields.get(child.tag)
+            if field and field not in values:
+                values[field] = child.text
+
+        parents[-1].remove(element)
+
+        time = gpxpy.gpxfield.TIME_TYPE.from_string(values.get('time'))
+        if cut_off(time):
+            dropped += 1
+            continue
+
+        latitude.append(float(element.get('lat').strip()))
+        longitude.append(float(element.get('lon').strip()))
+        elevation.append(nan if values.get('ele') is None else float(values['ele'].strip()))
+        speed.append(nan if values.get('speed') is None else float(values['speed'].strip()))
+
+        if time is None:
+            timestamp.append(nan)
+        else:
+            if tzinfo is None:
+                tzinfo = time.tzinfo
+            timestamp.append(time.timestamp())
+
+    if counts is not None:
+        counts['dropped'] = dropped
+
+    return Trajectory(latitude, longitude, elevation, timestamp, speed, tzinfo)
+
+def read_gpx_file(gpx_file, cutoff=None, counts=None, date=None):
+    """
+    Reads the track points through a full gpxpy parse
+    """
+    nan = float('nan')
+    latitude = array('d')
+    longitude = array('d')
+    elevation = array('d')
+    timestamp = array('d')
+    speed = array('d')
+    tzinfo = None
+    dropped = 0
+    cut_off = past_cutoff(cutoff, date)
+
+    gpx = gpxpy.parse(gpx_file)
     for track in gpx.tracks:
         for segment in track.segments:
             for point in segment.points:
-                points.append({
-                    'latitude': point.latitude,
-                    'longitude': point.longitude,
-                    'elevation': point.elevation,
-                    'time': point.time,
-                    'speed': point.speed
-                })
-    unique_points = list({point['time']:point for point in points}.values())
+                if cut_off(point.time):
+                    dropped += 1
+                    continue
+
+                latitude.append(point.latitude)
+                longitude.append(point.longitude)
+                elevation.append(nan if point.elevation is None else point.elevation)
+                speed.append(nan if point.speed is None else point.speed)
+
+                if point.time is None:
+                    timestamp.append(nan)
+                else:
+                    if tzinfo is None:
+                        tzinfo = point.time.tzinfo
+                    timestamp.append(point.time.timestamp())
+
+    if counts is not None:
+        counts['dropped'] = dropped
 
-    return unique_points
+    return Trajectory(latitude, longitude, elevation, timestamp, speed, tzinfo)
+
+def parse_gpx_file(gpx_file_location, cutoff=None, counts=None, date=None):
+    """
+    Parses GPX file into a Trajectory with one fix per timestamp
+    Input:  cutoff (datetime.time in SERVICE_TIMEZONE), fixes from the
+            first one past it on the service date are dropped
+            counts (dict, e.g. a stage record) gets counts['dropped']
+            date, the service date when the file continues a track
+            that started earlier, by default the file's first date
+    """
+    try:
+        trajectory = stream_gpx_file(gpx_file_location, cutoff, counts, date)
+    except (ElementTree.ParseError, AttributeError, ValueError):
+        # leave anything unusual to gpxpy
+        if hasattr(gpx_file_location, 'seek'):
+            gpx_file_location.seek(0)
+        trajectory = read_gpx_file(gpx_file_location, cutoff, counts, date)
+
+    return trajectory.unique_times()
 
 def parse_gpx_waypoints(gpx_file):
     waypoints = []
@@ -127,386 +307,256 @@ def parse_gpx_waypoints(gpx_file):
 
     return waypoints
 
-def compute_distance_travelled(gps_data):
-    """
-    Calculates total distance travelled in km
-    """
-    distance_travelled = 0.0
-    for i in range(len(gps_data) - 1):
-        distance_travelled += haversine((gps_data[i].get('latitude'), gps_data[i].get('longitude')), 
-            (gps_data[i+1].get('latitude'), gps_data[i+1].get('longitude')))
-    
-    return '%.2f'%(distance_travelled)
-
-def sec_to_minute(seconds):
-    return seconds / 60.0
-
-def sec_to_hour(seconds):
-    return seconds / 3600.0
-
-def speed_between_points(lon1, lat1, time1, lon2, lat2, time2):
-    """
-    Given 2 GPS points, calculate the speed between them
-    """
-    d_time = sec_to_hour(time2.timestamp() - time1.timestamp())
-    d_distance = haversine((lat1, lon1), (lat2, lon2))
-    return d_distance / d_time
-
-def compute_speed_violation(gps_data, type, speed_limit, time):
-    """
-    Determines if a speed violation of {speed_limit}
-    occured for {time} minutes, given {type} of analysis.
-    Input:
-        type = "Explicit" or "Location"
-        speed_limit in km/hr
-        time in seconds
-    """
-    time_elapsed = 0
-    first_point = True
-    list_violations = []
-    for i in range(len(gps_data) - 1):
-        time0 = gps_data[i-1].get("time")
-        lon1 = gps_data[i].get("longitude")
-        lat1 = gps_data[i].get("latitude")
-        time1 = gps_data[i].get("time")
-        lon2 = gps_data[i+1].get("longitude")
-        lat2 = gps_data[i+1].get("latitude")
-        time2 = gps_data[i+1].get("time")
-
-        if type == "Explicit":
-            if(gps_data[i].get("speed") is None):
-                speed = speed_between_points(lon1, lat1, time1, lon2, lat2, time2)
-            else:
-                speed = gps_data[i].get("speed")
-        elif type == "Location":
-            speed = speed_between_points(lon1, lat1, time1, lon2, lat2, time2)
-
-        if speed >= speed_limit: 
-            if first_point == True:
-                starting_point = gps_data[i]
-                first_point = False
-            else: 
-                time_elapsed += time1.timestamp() - time0.timestamp() 
-        else:
-            if time_elapsed >= time:
-                violation = {
-                    'duration': time_elapsed, 
-                    'lat1': starting_point['latitude'],
-                    'long1': starting_point['longitude'],
-                    'time1': starting_point['time'],
-                    'lat2': gps_data[i-1]['latitude'],
-                    'long2': gps_data[i-1]['longitude'],
-                    'time2': gps_data[i-1]['time']
-                }
-
-                list_violations.append(violation)
-            time_elapsed = 0
-            first_point = True
-
-    return list_violations
-
-def stop_violation(gps_data, min_time, max_time, point1, point2):
-    fence = Polygon(point1, point2)
-    index_start = -1
-    results = []
-
-    for i in range(len(gps_data)):
-        pt = Point(gps_data[i].get('latitude'), gps_data[i].get('longitude'))
-
-        if fence.contains(pt):
-            if index_start == -1:
-                index_start = i
-        else:
-            if index_start != -1:
-                timer_start = gps_data[index_start].get('time').timestamp()
-                timer_end = gps_data[i-1].get('time').timestamp()
-                fence_time = timer_end - timer_start
-
-                if fence_time < min_time or fence_time > max_time:
-                    center_lat = (point1.lat + point2.lat) / 2
-                    center_long = (point1.lon + point2.lon) / 2
-
-                    violation = {
-                        'duration': fence_time,
-                        'time1': gps_data[index_start].get('time'),
-                        'time2': gps_data[i-1].get('time'),
-                        'center_lat': center_lat,
-                        'center_long': center_long
-                    }
-
-                    if fence_time < min_time:
-                        violation['violation'] = 'below limit'
-                    elif fence_time > max_time:
-                        violation['violation'] = 'above limit'
-
-                    results.append(violation)
-                
-                index_start = -1
+def clear_vehicle_info(analysis):
+    """
+    Deletes the results of {analysis} so it can be computed again
+    """
+    records = [analysis.distance, analysis.loops, analysis.tail] + analysis.speeding + analysis.stops + analysis.liveness_segments + analysis.deviations + analysis.trips
+    for record in records:
+        if record is not None:
+            db.session.delete(record)
 
-    return results
+    analysis.total_liveness = None
+    analysis.cell_size = None
+    db.session.commit()
 
-def compute_stop_violation(stops, gps_data_vehicle, min_time, max_time):
-    stop_violations = []
-    for i in range(len(stops)):
-        if i % 2 == 0:
-            point1 = Point(stops[i]['latitude'], stops[i]['longitude'])
-            point2 = Point(stops[i+1]['latitude'], stops[i+1]['longitude'])
-            stop_violations += stop_violation(gps_data_vehicle, min_time, max_time, point1, point2)
-
-    return stop_violations
-
-def compute_liveness(gps_data, time_limit):
-    """
-    Determines total "aliveness" time of a vehicle. The
-    vehicle is considered "alive" if the gaps between
-    GPS readings are less than given {time_limit}.
-    Input:  gps_data (array of dictionaries)
-            time_limit (in seconds)
-    Output: total_liveness (in seconds)
-            results (array of dictionaries)
-    """
-    results = []
-    total_liveness = 0
-    start_index = 0
-
-    for i in range(len(gps_data) - 1):
-        time0 = gps_data[i].get("time")
-        time1 = gps_data[i+1].get("time")
-        time_diff = time1.timestamp() - time0.timestamp()
-
-        if time_diff >= time_limit:
-            segment_liveness = time0.timestamp() - gps_data[start_index].get("time").timestamp()
-            results.append({
-                "liveness": segment_liveness,
-                "time1": gps_data[start_index].get("time"),
-                "time2": gps_data[i].get("time")
-            })
-            start_index = i + 1
-            total_liveness += segment_liveness
-    
-    time0 = gps_data[start_index].get("time")
-    time1 = gps_data[-1].get("time")
-    segment_liveness = time1.timestamp() - time0.timestamp()
-    results.append({
-        "liveness": segment_liveness,
-        "time1": time0,
-        "time2": time1
-    })
-    total_liveness += segment_liveness
-    results = {'total_liveness': total_liveness, 'segments': results}
+def copy_vehicle_info(source, analysis):
+    """
+    Stores the results of analysis {source} again as the results of
+    {analysis}, for a vehicle with the same track
+    """
+    for name in ('total_liveness', 'cell_size', 'stop_min_time', 'stop_max_time', 'speeding_time_limit', 'speeding_speed_limit', 'liveness_time_limit'):
+        setattr(analysis, name, getattr(source, name))
+
+    if source.distance:
+        db.session.add(Distance(source.distance.distance, analysis.id))
+    if source.loops:
+        db.session.add(Loops(source.loops.loops, analysis.id))
+    if source.tail:
+        db.session.add(AnalysisTail(analysis.id, source.tail.state))
+
+    for row in source.speeding:
+        db.session.add(Speeding(row.duration, row.time1, row.time2, row.lat1, row.long1, row.lat2, row.long2, analysis.id))
+    for row in source.stops:
+        db.session.add(Stops(row.violation, row.duration, row.time1, row.time2, row.center_lat, row.center_long, analysis.id))
+    for row in source.liveness_segments:
+        db.session.add(Liveness(row.liveness, row.time1, row.time2, analysis.id))
+    for row in source.deviations:
+        db.session.add(Deviation(row.duration, row.distance, row.time1, row.time2, row.lat, row.long, analysis.id))
+    for row in source.trips:
+        db.session.add(Trip(row.number, row.time1, row.time2, row.points, row.loops, row.speeding, row.stops, row.deviations, analysis.id))
+
+    with stage('db_commit') as record:
+        record['rows'] = len(db.session.new)
+        db.session.commit()
+
+ROUTE_GRID_CACHE_SIZE = 32
+BUNCHING_HEADWAY = 120
+GAP_HEADWAY = 1800
+DEVIATION_DISTANCE = 100
+DEVIATION_MIN_TIME = 60
+
+route_grids = OrderedDict()
+route_grids_lock = threading.Lock()
+route_grid_builds = itertools.count()
+
+def build_route_grid(gps_data_route, stops, cell_size):
+    """
+    Grid anchored to the route's reference path and stops, padded by
+    one cell, so every vehicle on the route shares its cell numbering.
+    Output: dict of grid, route_path, adjacency (cell -> neighbours
+            for each route_path cell), stops, route_index, the
+            SegmentIndex of the reference path, and build, a number
+            unique to this grid in this process
+    """
+    gps_data_route = as_trajectory(gps_data_route)
+    latitude = np.concatenate([gps_data_route.latitude, [stop['latitude'] for stop in stops]])
+    longitude = np.concatenate([gps_data_route.longitude, [stop['longitude'] for stop in stops]])
+    missing = np.full(len(latitude), np.nan)
 
-    return results
+    point1, point2 = generate_corner_pts(Trajectory(latitude, longitude, missing, missing, missing), cell_size)
+    grid_fence = generate_grid_fence(point1, point2, cell_size)
+    route_path = generate_path(gps_data_route, grid_fence)
+    adjacency = {cell: frozenset(adjacent_cells(cell, grid_fence.width, len(grid_fence))) for cell in set(route_path)}
+
+    return {
+        'grid': grid_fence,
+        'route_path': route_path,
+        'adjacency': adjacency,
+        'stops': stops,
+        'route_index': SegmentIndex(gps_data_route.latitude, gps_data_route.longitude),
+        'build': next(route_grid_builds)
+    }
 
-def generate_grid_fence(point1, point2, side_length):
-    grid_fence = []
+def route_grid_key(route):
+    return (route.id, route.ref_filename, route.stop_filename, route.parameters.cell_size)
 
-    side_interval = side_length * 0.009
+def get_route_grid(route, load_route):
+    """
+    build_route_grid for {route}, cached per route files and cell_size.
+    load_route() returns (gps_data_route, stops) and is only called
+    when the grid is not cached yet.
+    """
+    key = route_grid_key(route)
 
-    latitude = point1.lat
-    longitude = point1.lon
+    with route_grids_lock:
+        route_grid = route_grids.get(key)
+        if route_grid is not None:
+            route_grids.move_to_end(key)
+            return route_grid
 
-    while latitude > point2.lat:
-        row = []
+    gps_data_route, stops = load_route()
+    with stage('grid') as record:
+        route_grid = build_route_grid(gps_data_route, stops, route.parameters.cell_size)
+        record['cells'] = len(route_grid['grid'])
 
-        while longitude < point2.lon:
-            top_left_pt = Point(latitude, longitude)
-            bottom_right_pt = Point(latitude - side_interval, longitude + side_interval)
+    with route_grids_lock:
+        route_grids[key] = route_grid
+        while len(route_grids) > app.config.get('ROUTE_GRID_CACHE_SIZE', ROUTE_GRID_CACHE_SIZE):
+            route_grids.popitem(last=False)
 
-            geofence = Polygon(top_left_pt, bottom_right_pt)
-            row.append(geofence)
+    return route_grid
 
-            longitude += side_interval
+def discard_route_grids(route_id):
+    with route_grids_lock:
+        for key in [key for key in route_grids if key[0] == route_id]:
+            del route_grids[key]
 
-        longitude = point1.lon
-        latitude -= side_interval
+GPS_CUTOFF_CACHE_SECONDS = 60
 
-        grid_fence.append(row)
+gps_cutoff = {'time': None, 'expires': 0}
+gps_cutoff_lock = threading.Lock()
 
-    return grid_fence
+def get_gps_cutoff():
+    """
+    The GPSCutoffTime set by an admin as a datetime.time, or None.
+    Read from the database at most once every GPS_CUTOFF_CACHE_SECONDS
+    per process.
+    """
+    now = time.monotonic()
+    with gps_cutoff_lock:
+        if now < gps_cutoff['expires']:
+            return gps_cutoff['time']
 
-def generate_path(gps_data, grid_fence):
-    path = []
-    current_fence = -1
+    cut_off_time = GPSCutoffTime.query.first()
+    return set_gps_cutoff(cut_off_time.time if cut_off_time else None)
 
-    if isinstance(grid_fence[0], list):
-        for point in gps_data:
-            pt = Point(point.get('latitude'), point.get('longitude'))
-            for i in range(len(grid_fence)):
-                for j in range(len(grid_fence[0])):
-                    if grid_fence[i][j].contains(pt):
-                        fence_number = i * len(grid_fence[0]) + j
-                        if current_fence != fence_number:
-                            current_fence = fence_number
-                            path.append(fence_number)
-                            break
-                else:
-                    continue
-                break
-    else:
-        for point in gps_data:
-            pt = Point(point.get('latitude'), point.get('longitude'))
-            for i in range(len(grid_fence)):
-                if grid_fence[i].contains(pt):
-                    if current_fence != i:
-                        current_fence = i 
-                        path.append(i)
-                        break
-
-    return path
-
-def route_check(set_route, vehicle_route):
-    set_route = "".join([str(x) for x in set_route])
-    vehicle_route = "".join([str(x) for x in vehicle_route])
-
-    loops = 0
-    start = 0 
-    while start < len(vehicle_route):
-        pos = vehicle_route.find(set_route, start)
-
-        if pos != -1:
-            start = pos + 1
-            loops += 1
-        else:
-            break
-
-    return loops
-
-def compute_loops(route, traj, grid_cells):
-    errors = 0
-    loops = 0
-    r = 0
-    i = 0
-    while i < len(traj):
-        if traj[i] == route[r]:
-            r += 1
-        else:
-            ind = find_current_index(traj[i], route)
-            # "Local" Errors
-            if ind != -1:
-                if ind > r:
-                    r = ind + 1
-                elif ind < r:
-                    if traj[ind] == route[0]:
-                        if traj[i - 1] == route[1]:
-                            r = ind + 1
-                        else: 
-                            r = len(route) 
-                    else:
-                        r = ind + 1
-            # "Foreign" Errors
-            elif ind == -1:
-                i, r, detour, missed_route = detour_info(i, r, route, traj)
-                errors += check_neighbors(detour, missed_route, grid_cells)
-        if r == len(route):
-            r = r % len(route)
-            if errors == 0:
-                loops += 1
-            else:
-                errors = 0
-        i += 1
-    return loops
-
-def detour_info(i, r, route, traj):
-    detour = []
-    missed_route = []
-    sub_traj = traj[i:]
-    _i = i
-    
-    # Find Detour List
-    for j in range(len(sub_traj)):
-        if find_current_index(sub_traj[j], route) == -1:
-            detour.append(sub_traj[j])
-            i += 1
-        else:
-            break
+def set_gps_cutoff(cutoff):
+    with gps_cutoff_lock:
+        gps_cutoff['time'] = cutoff
+        gps_cutoff['expires'] = time.monotonic() + app.config.get('GPS_CUTOFF_CACHE_SECONDS', GPS_CUTOFF_CACHE_SECONDS)
+        return cutoff
 
-    # Find Missing Route
-    if _i == 0:
-        if find_current_index(traj[i], route) == 0:
-            missed_route = [route[0]]
-        else:
-            end_index = find_current_index(traj[i], route) + 1
-            missed_route = route[0:end_index]
-        r = find_current_index(traj[i], route) + 1
-    elif _i != 0:
-        start_index = find_current_index(traj[_i-1], route)
-        if i == len(traj):
-            missed_route = route[start_index:len(route)]
-            r = len(route) # arbitrary, traj has already ended
-        else:
-            end_index = find_current_index(traj[i], route) + 1
-            if end_index < start_index:
-                missed_route = route[start_index:len(route)]
-                missed_route.append(end_index)
-            else:
-                missed_route = route[start_index:end_index]
-            r = find_current_index(traj[i], route) + 1
-    return i, r, detour, missed_route
-
-def check_neighbors(detour, missed_route, grid_cells):
-    # A detour cell must be adjacent to at least one missed_route cell
-    err = 0
-    width = len(grid_cells[0])
-    length = len(grid_cells) * len(grid_cells[0])
-
-    for d in detour:
-        for r in missed_route:
-            if d not in adjacent_cells(r, width, length):
-                err = 1
-                break
-    return err
-
-def adjacent_cells(d, w, l):
-    # Top Left
-    if d == 0:
-        return [d+1, d+w, d+w+1]
-    # Top Right
-    elif d == w-1:
-        return [d-1, d+w-1, d+w]
-    # Bottom Left
-    elif d == l-w:
-        return [d-w, d-w+1, d+1]
-    # Bottom Right
-    elif d == l-1:
-        return [d-w-1, d-w, d-1]
-    # North
-    elif d < w:
-        return [d-1, d+1, d+w-1, d+w, d+w+1]
-    # South
-    elif (d < l) and (d >= l-w):
-        return [d-w-1, d-w, d-w+1, d-1, d+1]
-    # West
-    elif d % w == 0:
-        return [d-w, d-w+1, d+1, d+w, d+w+1]
-    # East
-    elif d % w == w - 1:
-        return [d-w-1, d-w, d-1, d+w-1, d+w]
-    # Middle
-    else:
-        return [d-w-1, d-w, d-w+1, d-1, d+1, d+w-1, d+w, d+w+1]
-
-def find_current_index(cell, route_list):
-    # Find what index in the route_list the trajectory cell exists in
-    for i in range(len(route_list)):
-        if route_list[i] == cell:
-            return i
-    return -1
-
-def compute_vehicle_info(vehicle, route, gps_data_vehicle, gps_data_route, stops):
-    # compute loops
-    point1, point2 = generate_corner_pts(gps_data_vehicle, route.parameters.cell_size)
-    grid_fence = generate_grid_fence(point1, point2, route.parameters.cell_size)
-    vehicle_path = generate_path(gps_data_vehicle, grid_fence)
-    route_path = generate_path(gps_data_route, grid_fence)
-    loops = compute_loops(route_path, vehicle_path, grid_fence)
+SPEED_PROFILE_CACHE_SIZE = 128
+
+speed_profiles = OrderedDict()
+speed_profiles_lock = threading.Lock()
+
+def get_speed_profile(vehicle, width, load_track):
+    """
+    speed_profile of {vehicle}'s track, cached per vehicle, width and
+    GPS cutoff time until a segment is appended. load_track() returns
+    the track and is only called when the profile is not cached yet.
+    """
+    key = (vehicle.id, vehicle.filename, len(vehicle.segments), get_gps_cutoff(), width)
+
+    with speed_profiles_lock:
+        profile = speed_profiles.get(key)
+        if profile is not None:
+            speed_profiles.move_to_end(key)
+            return profile
+
+    gps_data = load_track()
+    with stage('speed_profile') as record:
+        profile = speed_profile(gps_data, width)
+        profile['tzinfo'] = gps_data.tzinfo
+        record['points'] = profile['points']
+
+    with speed_profiles_lock:
+        speed_profiles[key] = profile
+        while len(speed_profiles) > app.config.get('SPEED_PROFILE_CACHE_SIZE', SPEED_PROFILE_CACHE_SIZE):
+            speed_profiles.popitem(last=False)
+
+    return profile
 
-    loops_record = Loops(loops, vehicle.analysis.id)
+def analysis_parameters(parameters):
+    """
+    The parameters the analysis stages use, as a plain dict
+    """
+    return {
+        'cell_size': parameters.cell_size,
+        'stop_min_time': parameters.stop_min_time,
+        'stop_max_time': parameters.stop_max_time,
+        'speeding_time_limit': parameters.speeding_time_limit,
+        'speeding_speed_limit': parameters.speeding_speed_limit,
+        'liveness_time_limit': parameters.liveness_time_limit,
+        'deviation_distance': app.config.get('DEVIATION_DISTANCE', DEVIATION_DISTANCE),
+        'deviation_min_time': app.config.get('DEVIATION_MIN_TIME', DEVIATION_MIN_TIME)
+    }
+
+def analyze_stages(gps_data, parameters, route_grid):
+    """
+    Runs every analysis stage in this thread
+    Output: dict of stage name -> result
+    """
+    results = {}
+    for name, analyze in ANALYSIS_STAGES.items():
+        with stage(name) as record:
+            results[name] = analyze(gps_data, parameters, route_grid)
+            record['points'] = len(gps_data)
+    return results
+
+def merge_trip_results(trips, results):
+    """
+    Input:  trips (from split_trips) and their analyze_stages results
+    Output: the results of the whole track: loops add up, violations
+            and liveness segments follow one another, and 'trips'
+            holds the tally of each trip
+    """
+    merged = {
+        'loops': sum(result['loops'] for result in results),
+        'speeding': [violation for result in results for violation in result['speeding']],
+        'stops': [violation for result in results for violation in result['stops']],
+        'liveness': {
+            'total_liveness': sum(result['liveness']['total_liveness'] for result in results),
+            'segments': [segment for result in results for segment in result['liveness']['segments']]
+        },
+        'deviations': [deviation for result in results for deviation in result['deviations']],
+        'trips': []
+    }
+
+    for number, (trip, result) in enumerate(zip(trips, results), 1):
+        # a trip has no gaps, so it is one liveness segment
+        segment = result['liveness']['segments'][0]
+        merged['trips'].append({
+            'number': number,
+            'time1': segment['time1'],
+            'time2': segment['time2'],
+            'points': len(trip),
+            'loops': result['loops'],
+            'speeding': len(result['speeding']),
+            'stops': len(result['stops']),
+            'deviations': len(result['deviations'])
+        })
+
+    return merged
+
+def compute_vehicle_info(vehicle, route, gps_data_vehicle, route_grid, results=None):
+    """
+    Stores the analysis of {gps_data_vehicle}, trip by trip.
+    {results} from merge_trip_results, e.g. computed on the process
+    pool, are stored as they are, otherwise the stages run here.
+    """
+    if results is None:
+        parameters = analysis_parameters(route.parameters)
+        trips = split_trips(gps_data_vehicle, parameters['liveness_time_limit'])
+        results = merge_trip_results(trips, [analyze_stages(trip, parameters, route_grid) for trip in trips])
+
+    loops_record = Loops(results['loops'], vehicle.analysis.id)
     db.session.add(loops_record)
     vehicle.analysis.cell_size = route.parameters.cell_size
 
-    # compute speeding
-    speeding_violations = compute_speed_violation(gps_data_vehicle, "Explicit", route.parameters.speeding_speed_limit, route.parameters.speeding_time_limit)
-
+    speeding_violations = results['speeding']
     if not speeding_violations:
         speeding = Speeding(-1, datetime.fromtimestamp(0), datetime.fromtimestamp(0), 0, 0, 0, 0, vehicle.analysis.id)
         db.session.add(speeding)
@@ -517,9 +567,7 @@ def compute_vehicle_info(vehicle, route, gps_data_vehicle, gps_data_route, stops
     vehicle.analysis.speeding_time_limit = route.parameters.speeding_time_limit
     vehicle.analysis.speeding_speed_limit = route.parameters.speeding_speed_limit
 
-    # compute stop
-    stop_violations = compute_stop_violation(stops, gps_data_vehicle, route.parameters.stop_min_time, route.parameters.stop_max_time)
-
+    stop_violations = results['stops']
     if not stop_violations:
         stop = Stops('no violation', -1, datetime.fromtimestamp(0), datetime.fromtimestamp(0), 0, 0, vehicle.analysis.id)
         db.session.add(stop)
@@ -530,13 +578,24 @@ def compute_vehicle_info(vehicle, route, gps_data_vehicle, gps_data_route, stops
     vehicle.analysis.stop_min_time = route.parameters.stop_min_time
     vehicle.analysis.stop_max_time = route.parameters.stop_max_time
 
-    # compute liveness
-    liveness = compute_liveness(gps_data_vehicle, route.parameters.liveness_time_limit)
-
+    liveness = results['liveness']
     vehicle.analysis.total_liveness = liveness['total_liveness']
     for segment in liveness['segments']:
         liveness_segment = Liveness(segment['liveness'], segment['time1'], segment['time2'], vehicle.analysis.id)
         db.session.add(liveness_segment)
     vehicle.analysis.liveness_time_limit = route.parameters.liveness_time_limit
 
-    db.session.commit()
\ No newline at end of file
+    deviations = results['deviations']
+    if not deviations:
+        deviation = Deviation(-1, 0, datetime.fromtimestamp(0), datetime.fromtimestamp(0), 0, 0, vehicle.analysis.id)
+        db.session.add(deviation)
+    else:
+        for deviation in deviations:
+            db.session.add(Deviation(deviation['duration'], deviation['distance'], deviation['time1'], deviation['time2'], deviation['lat'], deviation['long'], vehicle.analysis.id))
+
+    for trip in results['trips']:
+        db.session.add(Trip(trip['number'], trip['time1'], trip['time2'], trip['points'], trip['loops'], trip['speeding'], trip['stops'], trip['deviations'], vehicle.analysis.id))
+
+    with stage('db_commit') as record:
+        record['rows'] = len(db.session.new)
+        db.session.commit()
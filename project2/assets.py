@@ -0,0 +1,116 @@
+import os
+import re
+import mimetypes
+from zlib import adler32
+from flask import request, abort
+from werkzeug.wrappers import Response
+from werkzeug.wsgi import wrap_file
+
+# build tools put a content hash in the filename, e.g. app.3f2a1b9c.js
+HASHED_FILENAME = re.compile(r'[.-][0-9a-f]{8,}\.\w+$')
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+REVALIDATE_CACHE_CONTROL = 'no-cache'
+PRECOMPRESSED = (('br', '.br'), ('gzip', '.gz'))
+
+class StaticFile():
+    __slots__ = ('path', 'size', 'mtime', 'etag')
+
+    def __init__(self, path, stat):
+        self.path = path
+        self.size = stat.st_size
+        self.mtime = int(stat.st_mtime)
+        self.etag = f"{stat.st_mtime}-{stat.st_size}-{adler32(path.encode('utf-8')) & 0xffffffff}"
+
+class StaticAsset():
+    __slots__ = ('file', 'mimetype', 'cache_control', 'encodings')
+
+    def __init__(self, file, mimetype, cache_control):
+        self.file = file
+        self.mimetype = mimetype
+        self.cache_control = cache_control
+        self.encodings = {}
+
+class StaticIndex():
+    """
+    In-memory index of the static folder, built once so that
+    serving a file does not stat the disk. Precompressed .br/.gz
+    siblings are served when the client accepts them.
+    """
+    def __init__(self, root, index_file='index.html'):
+        self.root = root
+        self.index_file = index_file
+        self.assets = {}
+        self.build()
+
+    def build(self):
+        assets = {}
+        files = {}
+
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                key = os.path.relpath(path, self.root).replace(os.sep, '/')
+                files[key] = StaticFile(path, os.stat(path))
+
+        for key, file in files.items():
+            if any(key.endswith(suffix) and key[:-len(suffix)] in files for encoding, suffix in PRECOMPRESSED):
+                continue
+
+            mimetype = mimetypes.guess_type(key)[0] or 'application/octet-stream'
+            if HASHED_FILENAME.search(key):
+                cache_control = IMMUTABLE_CACHE_CONTROL
+            else:
+                cache_control = REVALIDATE_CACHE_CONTROL
+
+            asset = StaticAsset(file, mimetype, cache_control)
+            for encoding, suffix in PRECOMPRESSED:
+                if key + suffix in files:
+                    asset.encodings[encoding] = files[key + suffix]
+
+            assets[key] = asset
+
+        self.assets = assets
+
+    def lookup(self, path):
+        asset = self.assets.get(path)
+
+        # unknown paths belong to the single page app
+        if asset is None:
+            asset = self.assets.get(self.index_file)
+
+        return asset
+
+    def negotiate(self, asset):
+        for encoding, suffix in PRECOMPRESSED:
+            if encoding in asset.encodings and request.accept_encodings[encoding]:
+                return encoding, asset.encodings[encoding]
+
+        return None, asset.file
+
+    def send(self, path):
+        asset = self.lookup(path)
+
+        if asset is None:
+            abort(404)
+
+        encoding, file = self.negotiate(asset)
+
+        try:
+            f = open(file.path, 'rb')
+        except OSError:
+            # the tree changed since startup
+            self.build()
+            abort(404)
+
+        rv = Response(wrap_file(request.environ, f), mimetype=asset.mimetype, direct_passthrough=True)
+        rv.content_length = file.size
+        rv.last_modified = file.mtime
+        rv.set_etag(file.etag)
+        rv.headers['Cache-Control'] = asset.cache_control
+
+        if asset.encodings:
+            rv.vary.add('Accept-Encoding')
+        if encoding:
+            rv.content_encoding = encoding
+
+        return rv.make_conditional(request, accept_ranges=True, complete_length=file.size)
@@ -0,0 +1,113 @@
+import os
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from project2 import app
+from project2.api import ROUTE_GRID_CACHE_SIZE, ANALYSIS_STAGES, analyze_stages, split_trips, merge_trip_results
+from project2.metrics import record_stage
+from project2.stages import SharedTrajectory, SharedRouteGrid, run_stage
+
+# below this the hand-off to the pool costs more than it saves, see
+# benchmarks/bench_executor.py
+ANALYSIS_PARALLEL_MIN_POINTS = 20000
+# leave a core to the server itself
+ANALYSIS_WORKERS = max((os.cpu_count() or 1) - 1, 1)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def get_executor():
+    """
+    The shared process pool, or None when ANALYSIS_WORKERS is 0.
+    Workers are spawned rather than forked, so they do not inherit
+    the server's threads and database connections, and they only
+    import project2.stages.
+    """
+    global _executor
+
+    workers = app.config.get('ANALYSIS_WORKERS', ANALYSIS_WORKERS)
+    if not workers:
+        return None
+
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+        return _executor
+
+def reset_executor():
+    global _executor
+
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False)
+        _executor = None
+
+def run_analyses(jobs):
+    """
+    Input:  jobs (list of (gps_data, parameters, route_grid)), e.g.
+            one per trip, parameters from analysis_parameters
+    Output: analyze_stages results in the order of jobs
+    Every stage of every job is its own task on the process pool.
+    Each route grid goes to a worker once, not with every task.
+    Jobs below ANALYSIS_PARALLEL_MIN_POINTS fixes in total are not
+    worth the hand-off and run here.
+    """
+    executor = get_executor()
+    min_points = app.config.get('ANALYSIS_PARALLEL_MIN_POINTS', ANALYSIS_PARALLEL_MIN_POINTS)
+    cache_size = app.config.get('ROUTE_GRID_CACHE_SIZE', ROUTE_GRID_CACHE_SIZE)
+
+    if executor is None or sum(len(job[0]) for job in jobs) < min_points:
+        return [analyze_stages(*job) for job in jobs]
+
+    shared = []
+    grids = {}
+    try:
+        futures = []
+        for gps_data, parameters, route_grid in jobs:
+            if route_grid['build'] not in grids:
+                grids[route_grid['build']] = SharedRouteGrid(route_grid, cache_size)
+                shared.append(grids[route_grid['build']])
+            grid_handle = grids[route_grid['build']].handle()
+
+            trajectory = SharedTrajectory(gps_data)
+            shared.append(trajectory)
+            futures.append({
+                name: executor.submit(run_stage, name, trajectory.handle(), parameters, grid_handle)
+                for name in ANALYSIS_STAGES
+            })
+
+        results = []
+        for stage_futures in futures:
+            result = {}
+            for name, future in stage_futures.items():
+                result[name], record = future.result()
+                record_stage(record)
+            results.append(result)
+
+        return results
+    except BrokenProcessPool:
+        app.logger.exception('analysis process pool broke, running the analysis inline')
+        reset_executor()
+        return [analyze_stages(*job) for job in jobs]
+    finally:
+        for block in shared:
+            block.release()
+
+def run_trip_analyses(tracks, parameters, route_grid):
+    """
+    Input:  tracks (list of Trajectory), one per vehicle, on one route
+    Output: merge_trip_results results in the order of tracks
+    Each track is split into trips at the liveness gaps and every trip
+    is a job of its own, so a long log spreads over the whole pool.
+    """
+    trips = [split_trips(track, parameters['liveness_time_limit']) for track in tracks]
+    results = run_analyses([(trip, parameters, route_grid) for track_trips in trips for trip in track_trips])
+
+    merged = []
+    start = 0
+    for track_trips in trips:
+        merged.append(merge_trip_results(track_trips, results[start:start + len(track_trips)]))
+        start += len(track_trips)
+
+    return merged
@@ -0,0 +1,750 @@
+import json
+import math
+import threading
+from collections import deque
+from datetime import datetime, timezone, timedelta
+from sqlalchemy.exc import IntegrityError
+import numpy as np
+from haversine import haversine, haversine_vector
+from project2 import app, db
+from project2.models import Distance, Loops, Speeding, Stops, Liveness, Deviation, Trip, AnalysisTail, LiveSession
+from project2.metrics import stage
+from project2.api import Point, Trajectory, to_datetime, parse_time, speed_between_timestamps, check_neighbors, route_grid_key, DEVIATION_DISTANCE, DEVIATION_MIN_TIME
+
+LIVE_IDLE_TIMEOUT = 3600
+
+class MonitorState():
+    """
+    state() gives the fields named in STATE as plain JSON values,
+    restore() puts them back
+    """
+    __slots__ = ()
+    STATE = ()
+
+    def state(self):
+        return {name: getattr(self, name) for name in self.STATE}
+
+    def restore(self, state):
+        for name in self.STATE:
+            setattr(self, name, state[name])
+
+class SpeedingMonitor(MonitorState):
+    """
+    compute_speed_violation one fix at a time. A fix's speed may
+    need the fix after it, so each fix is judged when the next
+    one arrives.
+    """
+    __slots__ = ('type', 'speed_limit', 'time', 'previous', 'current', 'start', 'time_elapsed')
+    STATE = ('previous', 'current', 'start', 'time_elapsed')
+
+    def __init__(self, speed_limit, time, type="Explicit"):
+        self.type = type
+        self.speed_limit = speed_limit
+        self.time = time
+        self.previous = None
+        self.current = None
+        self.start = None
+        self.time_elapsed = 0
+
+    def update(self, fix):
+        """
+        Input:  fix (lat, lon, timestamp, speed)
+        Output: violation dict or None
+        """
+        violation = None
+        if self.current is not None:
+            violation = self.judge(self.current, fix)
+
+        self.previous, self.current = self.current, fix
+        return violation
+
+    def judge(self, fix, following):
+        lat, lon, timestamp, explicit_speed = fix
+
+        if self.type == "Explicit" and not math.isnan(explicit_speed):
+            speed = explicit_speed
+        else:
+            speed = speed_between_timestamps(lon, lat, timestamp, following[1], following[0], following[2])
+
+        if speed >= self.speed_limit:
+            if self.start is None:
+                self.start = fix
+            else:
+                self.time_elapsed += timestamp - self.previous[2]
+            return None
+
+        violation = None
+        if self.start is not None and self.time_elapsed >= self.time:
+            violation = {
+                'duration': self.time_elapsed,
+                'lat1': self.start[0],
+                'long1': self.start[1],
+                'time1': self.start[2],
+                'lat2': self.previous[0],
+                'long2': self.previous[1],
+                'time2': self.previous[2]
+            }
+
+        self.time_elapsed = 0
+        self.start = None
+        return violation
+
+class StopMonitor(MonitorState):
+    """
+    stop_violation for one stop fence, one fix at a time
+    """
+    __slots__ = ('point1', 'point2', 'min_time', 'max_time', 'start', 'last')
+    STATE = ('start', 'last')
+
+    def __init__(self, point1, point2, min_time, max_time):
+        self.point1 = point1
+        self.point2 = point2
+        self.min_time = min_time
+        self.max_time = max_time
+        self.start = None
+        self.last = None
+
+    def update(self, fix):
+        lat, lon, timestamp = fix[0], fix[1], fix[2]
+        point1, point2 = self.point1, self.point2
+
+        # same bounds as Polygon(point1, point2).contains
+        if point1.lat >= lat and point1.lon <= lon and point2.lat < lat and point2.lon > lon:
+            if self.start is None:
+                self.start = timestamp
+            self.last = timestamp
+            return None
+
+        if self.start is None:
+            return None
+
+        fence_time = self.last - self.start
+        violation = None
+
+        if fence_time < self.min_time or fence_time > self.max_time:
+            violation = {
+                'duration': fence_time,
+                'time1': self.start,
+                'time2': self.last,
+                'center_lat': (point1.lat + point2.lat) / 2,
+                'center_long': (point1.lon + point2.lon) / 2,
+                'violation': 'below limit' if fence_time < self.min_time else 'above limit'
+            }
+
+        self.start = None
+        return violation
+
+class DeviationMonitor(MonitorState):
+    """
+    compute_deviations one fix at a time, given each fix's
+    distance from the route
+    """
+    __slots__ = ('max_distance', 'min_time', 'start', 'last', 'farthest')
+    STATE = ('start', 'last', 'farthest')
+
+    def __init__(self, max_distance, min_time):
+        self.max_distance = max_distance
+        self.min_time = min_time
+        self.start = None
+        self.last = None
+        self.farthest = None
+
+    def update(self, fix, distance):
+        if distance > self.max_distance:
+            if self.start is None:
+                self.start = fix[2]
+                self.farthest = None
+            if self.farthest is None or distance > self.farthest[0]:
+                self.farthest = (distance, fix[0], fix[1])
+            self.last = fix[2]
+            return None
+
+        if self.start is None:
+            return None
+
+        deviation = None
+        if self.last - self.start >= self.min_time:
+            deviation = {
+                'duration': self.last - self.start,
+                'distance': self.farthest[0],
+                'time1': self.start,
+                'time2': self.last,
+                'lat': self.farthest[1],
+                'long': self.farthest[2]
+            }
+
+        self.start = None
+        return deviation
+
+class LivenessMonitor(MonitorState):
+    """
+    compute_liveness one fix at a time. Closed segments are returned
+    as they end, the open one is in summary().
+    """
+    __slots__ = ('time_limit', 'start', 'last', 'total_liveness')
+    STATE = ('start', 'last', 'total_liveness')
+
+    def __init__(self, time_limit):
+        self.time_limit = time_limit
+        self.start = None
+        self.last = None
+        self.total_liveness = 0
+
+    def update(self, fix):
+        timestamp = fix[2]
+        segment = None
+
+        if self.last is not None and timestamp - self.last >= self.time_limit:
+            segment = {'liveness': self.last - self.start, 'time1': self.start, 'time2': self.last}
+            self.total_liveness += segment['liveness']
+            self.start = None
+
+        if self.start is None:
+            self.start = timestamp
+        self.last = timestamp
+
+        return segment
+
+    def summary(self):
+        if self.start is None:
+            return {'total_liveness': 0, 'current': None}
+
+        current = {'liveness': self.last - self.start, 'time1': self.start, 'time2': self.last}
+        return {'total_liveness': self.total_liveness + current['liveness'], 'current': current}
+
+class LoopMonitor(MonitorState):
+    """
+    compute_loops over a vehicle path that arrives one cell at a time.
+    compute_loops can look back at the first len(route) cells of the
+    path, so those are kept, and a cell is held back until the one it
+    refers to has arrived. Memory follows the route, not the trip.
+    """
+    STATE = ('head', 'last_cell', 'count', 'previous', 'r', 'errors', 'loops', 'detour_start', 'detour_timestamp', 'before_detour')
+
+    def __init__(self, route_grid):
+        self.route_grid = route_grid
+        self.grid = route_grid['grid']
+        self.adjacency = route_grid['adjacency']
+        self.route = route_grid['route_path']
+        self.route_index = {}
+        for i, cell in enumerate(self.route):
+            self.route_index.setdefault(cell, i)
+
+        self.head = []
+        self.pending = deque()
+        self.last_cell = None
+        self.count = 0
+        self.previous = None
+        self.r = 0
+        self.errors = 0
+        self.loops = 0
+        self.detour = None
+        self.detour_start = 0
+        self.detour_timestamp = None
+        self.before_detour = None
+
+    def state(self):
+        state = super().state()
+        state['pending'] = list(self.pending)
+        state['detour'] = None if self.detour is None else list(self.detour)
+        return state
+
+    def restore(self, state):
+        super().restore(state)
+        self.pending = deque(tuple(item) for item in state['pending'])
+        self.detour = None if state['detour'] is None else set(state['detour'])
+
+    def final_loops(self):
+        """
+        Loops as compute_loops would count them if the path ended here
+        """
+        monitor = LoopMonitor(self.route_grid)
+        monitor.restore(self.state())
+        monitor.finish()
+        return monitor.loops
+
+    def find(self, cell):
+        return self.route_index.get(cell, -1)
+
+    def update(self, cell, timestamp):
+        """
+        Output: list of (loops, timestamp) for each loop completed
+        """
+        if cell == self.last_cell or not self.route:
+            return []
+        self.last_cell = cell
+
+        if len(self.head) < len(self.route):
+            self.head.append(cell)
+        self.pending.append((cell, timestamp))
+
+        return self.drain(False)
+
+    def finish(self):
+        completed = self.drain(True)
+
+        # a path that ends off route closes whatever was left of the loop
+        if self.detour is not None and self.detour_start != 0:
+            start_index = self.find(self.before_detour)
+            self.errors += check_neighbors(self.detour, self.route[start_index:], self.grid, self.adjacency)
+            self.r = len(self.route)
+            completed += self.complete(self.detour_timestamp)
+            self.detour = None
+
+        return completed
+
+    def drain(self, final):
+        completed = []
+
+        while self.pending:
+            cell, timestamp = self.pending[0]
+            ind = self.find(cell)
+
+            # compute_loops reads path[ind] here, wait until it exists
+            if not final and self.detour is None and ind != -1 and cell != self.route[self.r] and ind < self.r and ind >= len(self.head):
+                break
+
+            self.pending.popleft()
+            completed += self.step(cell, ind, timestamp)
+
+        return completed
+
+    def step(self, cell, ind, timestamp):
+        i = self.count
+        self.count += 1
+        route = self.route
+
+        if self.detour is not None:
+            if ind == -1:
+                self.detour.add(cell)
+                self.detour_timestamp = timestamp
+                self.previous = cell
+                return []
+
+            # back on route, same bookkeeping as detour_info
+            if self.detour_start == 0:
+                missed_route = route[0:ind + 1]
+            else:
+                start_index = self.find(self.before_detour)
+                end_index = ind + 1
+                if end_index < start_index:
+                    missed_route = route[start_index:len(route)]
+                    missed_route.append(end_index)
+                else:
+                    missed_route = route[start_index:end_index]
+
+            self.r = ind + 1
+            self.errors += check_neighbors(self.detour, missed_route, self.grid, self.adjacency)
+            self.detour = None
+
+        elif cell == route[self.r]:
+            self.r += 1
+
+        elif ind != -1:
+            # "Local" Errors
+            if ind > self.r:
+                self.r = ind + 1
+            elif ind < self.r:
+                if ind < len(self.head) and self.head[ind] == route[0]:
+                    if self.previous == route[1]:
+                        self.r = ind + 1
+                    else:
+                        self.r = len(route)
+                else:
+                    self.r = ind + 1
+
+        else:
+            # "Foreign" Errors
+            self.detour = {cell}
+            self.detour_start = i
+            self.detour_timestamp = timestamp
+            self.before_detour = self.previous
+            self.previous = cell
+            return []
+
+        self.previous = cell
+        return self.complete(timestamp)
+
+    def complete(self, timestamp):
+        if self.r != len(self.route):
+            return []
+
+        self.r = self.r % len(self.route)
+        if self.errors == 0:
+            self.loops += 1
+            return [(self.loops, timestamp)]
+
+        self.errors = 0
+        return []
+
+class LiveVehicle():
+    """
+    Online analysis of one vehicle on one route. update() takes each
+    new batch of fixes and returns the violations, liveness gaps and
+    loop completions they caused. Fixes no later than the last one
+    seen are dropped. A liveness gap ends the trip: every monitor but
+    liveness starts over, as split_trips does for a whole track.
+    """
+    def __init__(self, route, route_grid):
+        self.grid_key = route_grid_key(route)
+        self.route_grid = route_grid
+        self.parameters = route.parameters
+        self.liveness = LivenessMonitor(route.parameters.liveness_time_limit)
+        self.completed_loops = 0
+        self.start_trip(1)
+
+        self.lock = threading.Lock()
+        self.tzinfo = None
+        self.last_fix = None
+        self.points = 0
+        self.dropped = 0
+        self.distance = 0.0
+
+    def update(self, gps_data):
+        with self.lock:
+            if self.tzinfo is None:
+                self.tzinfo = gps_data.tzinfo
+
+            fixes = zip(gps_data.latitude.tolist(), gps_data.longitude.tolist(), gps_data.timestamp.tolist(), gps_data.speed.tolist())
+            cells = self.route_grid['grid'].cell_numbers(gps_data.latitude, gps_data.longitude).tolist()
+            distances = self.route_grid['route_index'].nearest(gps_data.latitude, gps_data.longitude)[0].tolist()
+            events = []
+
+            time_limit = self.liveness.time_limit
+
+            for fix, cell, distance in zip(fixes, cells, distances):
+                if math.isnan(fix[2]) or (self.last_fix is not None and fix[2] <= self.last_fix[2]):
+                    self.dropped += 1
+                    continue
+
+                if self.last_fix is not None:
+                    self.distance += haversine((self.last_fix[0], self.last_fix[1]), (fix[0], fix[1]))
+                    if time_limit is not None and fix[2] - self.last_fix[2] >= time_limit:
+                        events += self.end_trip()
+                self.last_fix = fix
+                self.points += 1
+
+                if self.trip['time1'] is None:
+                    self.trip['time1'] = fix[2]
+                self.trip['time2'] = fix[2]
+                self.trip['points'] += 1
+
+                events += self.observe(fix, cell, distance)
+
+            return events
+
+    def start_trip(self, number):
+        parameters = self.parameters
+        stops = self.route_grid['stops']
+
+        self.speeding = SpeedingMonitor(parameters.speeding_speed_limit, parameters.speeding_time_limit)
+        self.stops = [
+            StopMonitor(*stop_corners(stops, i), parameters.stop_min_time, parameters.stop_max_time)
+            for i in range(0, len(stops) - 1, 2)
+        ]
+        self.loops = LoopMonitor(self.route_grid)
+        self.deviations = DeviationMonitor(app.config.get('DEVIATION_DISTANCE', DEVIATION_DISTANCE), app.config.get('DEVIATION_MIN_TIME', DEVIATION_MIN_TIME))
+        self.trip = {'number': number, 'time1': None, 'time2': None, 'points': 0, 'speeding': 0, 'stops': 0, 'deviations': 0}
+
+    def end_trip(self):
+        """
+        Closes the current trip. Violations still open at its end are
+        dropped, as they would be at the end of a whole track.
+        """
+        events = self.loop_events(self.loops.finish())
+        trip = dict(self.trip, loops=self.loops.loops)
+        self.completed_loops += self.loops.loops
+        self.start_trip(trip['number'] + 1)
+
+        return events + [self.event('trip', trip)]
+
+    def current_trip(self):
+        return self.event('trip', dict(self.trip, loops=self.loops.final_loops()))
+
+    def loop_events(self, completed):
+        return [self.event('loop', {'loops': self.completed_loops + loops, 'time': timestamp}) for loops, timestamp in completed]
+
+    def observe(self, fix, cell, distance):
+        events = []
+
+        violation = self.speeding.update(fix)
+        if violation:
+            events.append(self.event('speeding', violation))
+            self.trip['speeding'] += 1
+
+        for monitor in self.stops:
+            violation = monitor.update(fix)
+            if violation:
+                events.append(self.event('stop', violation))
+                self.trip['stops'] += 1
+
+        segment = self.liveness.update(fix)
+        if segment:
+            events.append(self.event('liveness', segment))
+
+        events += self.loop_events(self.loops.update(cell, fix[2]))
+
+        deviation = self.deviations.update(fix, distance)
+        if deviation:
+            events.append(self.event('deviation', deviation))
+            self.trip['deviations'] += 1
+
+        return events
+
+    def finish(self):
+        with self.lock:
+            return self.loop_events(self.loops.finish())
+
+    def state(self):
+        with self.lock:
+            return {
+                'grid_key': list(self.grid_key),
+                'utcoffset': None if self.tzinfo is None else self.tzinfo.utcoffset(None).total_seconds(),
+                'last_fix': self.last_fix,
+                'points': self.points,
+                'dropped': self.dropped,
+                'distance': self.distance,
+                'speeding': self.speeding.state(),
+                'stops': [monitor.state() for monitor in self.stops],
+                'liveness': self.liveness.state(),
+                'loops': self.loops.state(),
+                'deviations': self.deviations.state(),
+                'trip': self.trip,
+                'completed_loops': self.completed_loops
+            }
+
+    @classmethod
+    def from_state(cls, route, route_grid, state):
+        """
+        Resumes a LiveVehicle saved with state(), or returns None
+        if the route grid it was built on has changed since
+        """
+        vehicle = cls(route, route_grid)
+        if list(vehicle.grid_key) != state['grid_key'] or len(vehicle.stops) != len(state['stops']) or 'trip' not in state:
+            return None
+
+        if state['utcoffset'] is not None:
+            vehicle.tzinfo = timezone(timedelta(seconds=state['utcoffset']))
+        vehicle.last_fix = state['last_fix']
+        vehicle.points = state['points']
+        vehicle.dropped = state['dropped']
+        vehicle.distance = state['distance']
+        vehicle.speeding.restore(state['speeding'])
+        for monitor, monitor_state in zip(vehicle.stops, state['stops']):
+            monitor.restore(monitor_state)
+        vehicle.liveness.restore(state['liveness'])
+        vehicle.loops.restore(state['loops'])
+        vehicle.deviations.restore(state['deviations'])
+        vehicle.trip = dict(state['trip'])
+        vehicle.completed_loops = state['completed_loops']
+
+        return vehicle
+
+    @classmethod
+    def after_track(cls, route, route_grid, gps_data, trips):
+        """
+        The LiveVehicle update(gps_data) would leave behind, built by
+        replaying only the last trip. Every monitor but liveness starts
+        over at a liveness gap, so earlier trips only leave totals,
+        which come from {trips}, the merge_trip_results tally of
+        {gps_data}. Returns None unless the fixes with a time are in
+        order and ahead of those without one, as update() would drop
+        some fixes otherwise.
+        """
+        timestamp = gps_data.timestamp
+        timed = len(timestamp) - int(np.count_nonzero(np.isnan(timestamp)))
+        if not trips or np.isnan(timestamp[:timed]).any() or np.any(timestamp[1:timed] <= timestamp[:timed - 1]):
+            return None
+
+        vehicle = cls(route, route_grid)
+        vehicle.start_trip(len(trips))
+
+        start = 0
+        for trip in trips[:-1]:
+            vehicle.liveness.total_liveness += timestamp[start + trip['points'] - 1] - timestamp[start]
+            vehicle.completed_loops += trip['loops']
+            start += trip['points']
+
+        if start:
+            # the distance up to the last trip's first fix, gap included
+            points = np.column_stack((gps_data.latitude[:start + 1], gps_data.longitude[:start + 1]))
+            vehicle.distance = sum(haversine_vector(points[:-1], points[1:]).tolist())
+            vehicle.points = start
+
+        vehicle.update(gps_data[start:])
+        return vehicle
+
+    def event(self, type, data):
+        event = dict(data, type=type)
+        for key in ('time', 'time1', 'time2'):
+            if key in event:
+                event[key] = to_datetime(event[key], self.tzinfo)
+        return event
+
+    def summary(self):
+        with self.lock:
+            liveness = self.liveness.summary()
+            return {
+                'points': self.points,
+                'dropped': self.dropped,
+                'distance': '%.2f'%(self.distance),
+                'loops': self.completed_loops + self.loops.loops,
+                'trips': self.trip['number'],
+                'total_liveness': liveness['total_liveness'],
+                'last_time': to_datetime(self.last_fix[2], self.tzinfo) if self.last_fix else None
+            }
+
+def save_tail(analysis, live_vehicle):
+    state = json.dumps(live_vehicle.state())
+
+    if analysis.tail:
+        analysis.tail.state = state
+    else:
+        db.session.add(AnalysisTail(analysis.id, state))
+
+def extend_vehicle_info(vehicle, live_vehicle, gps_data):
+    """
+    Adds the analysis of {gps_data}, which must follow everything
+    {live_vehicle} has seen of {vehicle}, to the stored results as
+    if the whole trajectory had been analyzed at once
+    """
+    analysis = vehicle.analysis
+    open_segment = analysis.liveness_segments[-1] if analysis.liveness_segments else None
+    open_trip = analysis.trips[-1] if analysis.trips else None
+
+    with stage('live') as record:
+        events = live_vehicle.update(gps_data)
+        record['points'] = len(gps_data)
+
+    speeding = [event for event in events if event['type'] == 'speeding']
+    if speeding:
+        for placeholder in [row for row in analysis.speeding if row.duration == -1]:
+            db.session.delete(placeholder)
+    for violation in speeding:
+        db.session.add(Speeding(violation['duration'], violation['time1'], violation['time2'], violation['lat1'], violation['long1'], violation['lat2'], violation['long2'], analysis.id))
+
+    stops = [event for event in events if event['type'] == 'stop']
+    if stops:
+        for placeholder in [row for row in analysis.stops if row.duration == -1]:
+            db.session.delete(placeholder)
+    for violation in stops:
+        db.session.add(Stops(violation['violation'], violation['duration'], violation['time1'], violation['time2'], violation['center_lat'], violation['center_long'], analysis.id))
+
+    deviations = [event for event in events if event['type'] == 'deviation']
+    if deviations:
+        for placeholder in [row for row in analysis.deviations if row.duration == -1]:
+            db.session.delete(placeholder)
+    for deviation in deviations:
+        db.session.add(Deviation(deviation['duration'], deviation['distance'], deviation['time1'], deviation['time2'], deviation['lat'], deviation['long'], analysis.id))
+
+    # the last stored liveness segment was still open, write it out again
+    if open_segment is not None:
+        db.session.delete(open_segment)
+    summary = live_vehicle.summary()
+    segments = [event for event in events if event['type'] == 'liveness']
+    current = live_vehicle.liveness.summary()['current']
+    # None until the vehicle has sent a timed fix
+    if current is not None:
+        segments.append(live_vehicle.event('liveness', current))
+    for segment in segments:
+        db.session.add(Liveness(segment['liveness'], segment['time1'], segment['time2'], analysis.id))
+    analysis.total_liveness = summary['total_liveness']
+
+    # so was the last trip
+    if open_trip is not None:
+        db.session.delete(open_trip)
+    trips = [event for event in events if event['type'] == 'trip'] + [live_vehicle.current_trip()]
+    for trip in trips:
+        db.session.add(Trip(trip['number'], trip['time1'], trip['time2'], trip['points'], trip['loops'], trip['speeding'], trip['stops'], trip['deviations'], analysis.id))
+
+    loops = live_vehicle.completed_loops + live_vehicle.loops.final_loops()
+    if analysis.loops:
+        analysis.loops.loops = loops
+    else:
+        db.session.add(Loops(loops, analysis.id))
+
+    if analysis.distance:
+        analysis.distance.distance = summary['distance']
+    else:
+        db.session.add(Distance(summary['distance'], analysis.id))
+
+    save_tail(analysis, live_vehicle)
+
+    with stage('db_commit') as record:
+        record['rows'] = len(db.session.new)
+        db.session.commit()
+
+    return events
+
+def stop_corners(stops, i):
+    return Point(stops[i]['latitude'], stops[i]['longitude']), Point(stops[i+1]['latitude'], stops[i+1]['longitude'])
+
+def parse_live_points(points):
+    """
+    Input:  list of {'latitude', 'longitude', 'time', 'speed'?,
+            'elevation'?}, time as ISO 8601 or epoch seconds
+    Output: Trajectory with one fix per timestamp
+    """
+    parsed = []
+    for point in points:
+        fix = dict(point)
+        if fix.get('time') is not None:
+            fix['time'] = parse_time(fix['time'])
+        parsed.append(fix)
+
+    return Trajectory.from_points(parsed).unique_times()
+
+def live_session(route, vehicle_name):
+    """
+    The LiveSession row of {vehicle_name} on {route}, locked until the
+    caller commits, created if there is none yet
+    """
+    query = LiveSession.query.filter_by(route_id=route.id, vehicle_name=vehicle_name).with_for_update()
+    session = query.first()
+    if session is not None:
+        return session
+
+    try:
+        with db.session.begin_nested():
+            session = LiveSession(route.id, vehicle_name, 'null', datetime.utcnow())
+            db.session.add(session)
+    except IntegrityError:
+        # another server process started it first
+        session = query.first()
+    return session
+
+def get_live_vehicle(route, vehicle_name, route_grid):
+    """
+    The live session of {vehicle_name} on {route} as (LiveSession,
+    LiveVehicle). The state is kept in the database so that every
+    server process sees the same session. It is started over when it
+    has been idle for LIVE_IDLE_TIMEOUT seconds or the route grid has
+    changed. save_live_vehicle() stores it back.
+    """
+    idle = datetime.utcnow() - timedelta(seconds=app.config.get('LIVE_IDLE_TIMEOUT', LIVE_IDLE_TIMEOUT))
+    LiveSession.query.filter(LiveSession.updated < idle).delete()
+
+    session = live_session(route, vehicle_name)
+    state = json.loads(session.state)
+    vehicle = LiveVehicle.from_state(route, route_grid, state) if state else None
+    if vehicle is None:
+        vehicle = LiveVehicle(route, route_grid)
+
+    return session, vehicle
+
+def save_live_vehicle(session, live_vehicle):
+    session.state = json.dumps(live_vehicle.state())
+    session.updated = datetime.utcnow()
+
+def pop_live_vehicle(route, vehicle_name, route_grid):
+    """
+    Ends the live session of {vehicle_name} on {route}, returns its
+    LiveVehicle or None if there is no session
+    """
+    session = LiveSession.query.filter_by(route_id=route.id, vehicle_name=vehicle_name).with_for_update().first()
+    if session is None:
+        return None
+
+    state = json.loads(session.state)
+    db.session.delete(session)
+    return LiveVehicle.from_state(route, route_grid, state) if state else None
@@ -0,0 +1,125 @@
+import time
+import threading
+import tracemalloc
+from contextlib import contextmanager
+from flask import g, has_request_context
+from project2 import app
+
+METRICS_PREFIX = 'project2_stage'
+
+if app.config.get('METRICS_TRACEMALLOC', False):
+    tracemalloc.start()
+
+class StageMetrics():
+    """
+    Process-wide totals per stage, rendered in the Prometheus
+    text exposition format
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stages = {}
+
+    def observe(self, record):
+        with self._lock:
+            totals = self.stages.setdefault(record['stage'], {'count': 0, 'wall_seconds': 0.0, 'cpu_seconds': 0.0, 'peak_bytes': 0, 'counts': {}})
+            totals['count'] += 1
+            totals['wall_seconds'] += record['wall_seconds']
+            totals['cpu_seconds'] += record['cpu_seconds']
+            if record.get('peak_bytes') is not None:
+                totals['peak_bytes'] = max(totals['peak_bytes'], record['peak_bytes'])
+            for key, value in record['counts'].items():
+                totals['counts'][key] = totals['counts'].get(key, 0) + value
+
+    def render(self):
+        with self._lock:
+            stages = {name: dict(totals, counts=dict(totals['counts'])) for name, totals in self.stages.items()}
+
+        lines = [
+            f'# HELP {METRICS_PREFIX}_wall_seconds Wall time spent in each analysis stage',
+            f'# TYPE {METRICS_PREFIX}_wall_seconds summary'
+        ]
+        for name, totals in stages.items():
+            lines.append(f'{METRICS_PREFIX}_wall_seconds_sum{{stage="{name}"}} {totals["wall_seconds"]}')
+            lines.append(f'{METRICS_PREFIX}_wall_seconds_count{{stage="{name}"}} {totals["count"]}')
+
+        lines.append(f'# HELP {METRICS_PREFIX}_cpu_seconds_total CPU time of the request thread in each analysis stage')
+        lines.append(f'# TYPE {METRICS_PREFIX}_cpu_seconds_total counter')
+        for name, totals in stages.items():
+            lines.append(f'{METRICS_PREFIX}_cpu_seconds_total{{stage="{name}"}} {totals["cpu_seconds"]}')
+
+        lines.append(f'# HELP {METRICS_PREFIX}_peak_bytes Largest traced allocation peak of each analysis stage')
+        lines.append(f'# TYPE {METRICS_PREFIX}_peak_bytes gauge')
+        for name, totals in stages.items():
+            lines.append(f'{METRICS_PREFIX}_peak_bytes{{stage="{name}"}} {totals["peak_bytes"]}')
+
+        counters = sorted({key for totals in stages.values() for key in totals['counts']})
+        for key in counters:
+            lines.append(f'# HELP {METRICS_PREFIX}_{key}_total {key.capitalize()} handled by each analysis stage')
+            lines.append(f'# TYPE {METRICS_PREFIX}_{key}_total counter')
+            for name, totals in stages.items():
+                if key in totals['counts']:
+                    lines.append(f'{METRICS_PREFIX}_{key}_total{{stage="{name}"}} {totals["counts"][key]}')
+
+        return '\n'.join(lines) + '\n'
+
+metrics = StageMetrics()
+
+@contextmanager
+def stage(name):
+    """
+    Measures the enclosed block as stage {name}. The yielded dict
+    takes counts for the stage, e.g. record['points'] = len(gps_data).
+    Peak allocation needs METRICS_TRACEMALLOC and Python 3.9+, and
+    includes whatever other threads allocate at the same time.
+    """
+    counts = {}
+    tracing = tracemalloc.is_tracing() and hasattr(tracemalloc, 'reset_peak')
+    if tracing:
+        tracemalloc.reset_peak()
+        start_memory = tracemalloc.get_traced_memory()[0]
+
+    start_wall = time.perf_counter()
+    start_cpu = time.thread_time()
+
+    try:
+        yield counts
+    finally:
+        record_stage({
+            'stage': name,
+            'wall_seconds': time.perf_counter() - start_wall,
+            'cpu_seconds': time.thread_time() - start_cpu,
+            'peak_bytes': tracemalloc.get_traced_memory()[1] - start_memory if tracing else None,
+            'counts': counts
+        })
+
+def record_stage(record):
+    """
+    Adds a stage measured elsewhere, e.g. in a worker process
+    """
+    metrics.observe(record)
+
+    if has_request_context():
+        g.setdefault('stage_records', []).append(record)
+
+@app.after_request
+def add_server_timing(response):
+    # per-request stage timings for the browser dev tools
+    records = g.get('stage_records')
+
+    if records and app.config.get('METRICS_DEBUG_HEADERS', False):
+        entries = []
+        for i, record in enumerate(records):
+            description = ' '.join(f'{key}={value}' for key, value in record['counts'].items())
+            entry = f'{i}-{record["stage"]};dur={record["wall_seconds"] * 1000:.1f}'
+            if description:
+                entry += f';desc="{description}"'
+            entries.append(entry)
+
+        response.headers['Server-Timing'] = ', '.join(entries)
+        response.headers['X-Stage-CPU'] = ', '.join(f'{record["stage"]}={record["cpu_seconds"] * 1000:.1f}ms' for record in records)
+
+        peaks = [f'{record["stage"]}={record["peak_bytes"]}' for record in records if record['peak_bytes'] is not None]
+        if peaks:
+            response.headers['X-Stage-Peak-Memory'] = ', '.join(peaks)
+
+    return response
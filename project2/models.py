@@ -1,6 +1,6 @@
 import datetime
 from project2 import db
-from werkzeug.security import generate_password_hash
+from project2.security import hash_password
 
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -11,7 +11,7 @@ class User(db.Model):
 
     def __init__(self, username, password, admin=False, routes=""):
         self.username = username
-        self.password = generate_password_hash(password, method='sha256')
+        self.password = hash_password(password)
         self.admin = admin
         self.routes = routes
 
@@ -41,6 +41,7 @@ class Vehicle(db.Model):
     route_id = db.Column(db.Integer, db.ForeignKey('route.id'))
     route_name = db.Column(db.String(60), nullable=False)
     analysis = db.relationship('Analysis', backref='vehicle', lazy='select', uselist=False)
+    segments = db.relationship('VehicleSegment', backref='vehicle', lazy='select', order_by='VehicleSegment.id')
 
     def __init__(self, filename, name, date, route_id, route_name):
         self.filename = filename
@@ -52,6 +53,79 @@ class Vehicle(db.Model):
     def __repr__(self):
         return f"Vehicle('{self.id}','{self.name}','{self.filename}','{self.date_uploaded}','{self.route_id}','{self.route_name}')"
 
+class VehicleSegment(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    vehicle_id = db.Column(db.Integer, db.ForeignKey('vehicle.id'), nullable=False)
+    filename = db.Column(db.String(80), unique=True, nullable=False)
+    date_uploaded = db.Column(db.Date, nullable=False)
+    time1 = db.Column(db.DateTime, default=None)
+    time2 = db.Column(db.DateTime, default=None)
+    points = db.Column(db.Integer, default=0)
+
+    def __init__(self, vehicle_id, filename, date, time1, time2, points):
+        self.vehicle_id = vehicle_id
+        self.filename = filename
+        self.date_uploaded = date
+        self.time1 = time1
+        self.time2 = time2
+        self.points = points
+
+    def __repr__(self):
+        return f"VehicleSegment('{self.id}','{self.vehicle_id}','{self.filename}','{self.time1}','{self.time2}','{self.points}')"
+
+class VehicleUpload(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    digest = db.Column(db.String(64), nullable=False, index=True)
+    vehicle_id = db.Column(db.Integer, db.ForeignKey('vehicle.id'), nullable=False, unique=True)
+    route_id = db.Column(db.Integer, db.ForeignKey('route.id'), nullable=False)
+    cut_off_time = db.Column(db.Time, default=None)
+    vehicle = db.relationship('Vehicle', lazy='select')
+
+    def __init__(self, digest, vehicle_id, route_id, cut_off_time):
+        self.digest = digest
+        self.vehicle_id = vehicle_id
+        self.route_id = route_id
+        self.cut_off_time = cut_off_time
+
+    def __repr__(self):
+        return f"VehicleUpload('{self.id}','{self.digest}','{self.vehicle_id}','{self.route_id}','{self.cut_off_time}')"
+
+class VehicleVisit(db.Model):
+    __table_args__ = (db.Index('ix_vehicle_visit_cell_hour', 'cell', 'hour'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    vehicle_id = db.Column(db.Integer, db.ForeignKey('vehicle.id'), nullable=False, index=True)
+    cell = db.Column(db.Integer, nullable=False)
+    hour = db.Column(db.Integer, nullable=False)
+    index1 = db.Column(db.Integer, nullable=False)
+    index2 = db.Column(db.Integer, nullable=False)
+    points = db.Column(db.Integer, default=0)
+
+    def __init__(self, vehicle_id, cell, hour, index1, index2, points):
+        self.vehicle_id = vehicle_id
+        self.cell = cell
+        self.hour = hour
+        self.index1 = index1
+        self.index2 = index2
+        self.points = points
+
+    def __repr__(self):
+        return f"VehicleVisit('{self.id}','{self.vehicle_id}','{self.cell}','{self.hour}','{self.index1}','{self.index2}','{self.points}')"
+
+class TrackPart(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    vehicle_id = db.Column(db.Integer, db.ForeignKey('vehicle.id'), nullable=False, index=True)
+    offset = db.Column(db.Integer, nullable=False)
+    length = db.Column(db.Integer, nullable=False)
+
+    def __init__(self, vehicle_id, offset, length):
+        self.vehicle_id = vehicle_id
+        self.offset = offset
+        self.length = length
+
+    def __repr__(self):
+        return f"TrackPart('{self.id}','{self.vehicle_id}','{self.offset}','{self.length}')"
+
 class Parameters(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(60), unique=True, nullable=False)
@@ -84,7 +158,10 @@ class Analysis(db.Model):
     speeding_time_limit = db.Column(db.Integer, default=None, nullable=True)
     speeding_speed_limit = db.Column(db.Integer, default=None, nullable=True)
     liveness_time_limit = db.Column(db.Integer, default=None, nullable=True)
-    liveness_segments = db.relationship('Liveness', backref='analysis', lazy='select')
+    liveness_segments = db.relationship('Liveness', backref='analysis', lazy='select', order_by='Liveness.id')
+    tail = db.relationship('AnalysisTail', backref='analysis', lazy='select', uselist=False)
+    deviations = db.relationship('Deviation', backref='analysis', lazy='select', order_by='Deviation.id')
+    trips = db.relationship('Trip', backref='analysis', lazy='select', order_by='Trip.number')
 
     def __init__(self, vehicle_id):
         self.vehicle_id = vehicle_id
@@ -178,6 +255,113 @@ class Liveness(db.Model):
     def __repr__(self):
         return f"Liveness('{self.id}', '{self.liveness}', '{self.time1}', '{self.time2}', '{self.analysis_id}')"
 
+class Deviation(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    duration = db.Column(db.Integer, default=None)
+    distance = db.Column(db.Float, default=None)
+    time1 = db.Column(db.DateTime, default=None)
+    time2 = db.Column(db.DateTime, default=None)
+    lat = db.Column(db.Float, default=None)
+    long = db.Column(db.Float, default=None)
+    analysis_id = db.Column(db.Integer, db.ForeignKey('analysis.id'))
+
+    def __init__(self, duration, distance, time1, time2, lat, long, analysis_id):
+        self.duration = duration
+        self.distance = distance
+        self.time1 = time1
+        self.time2 = time2
+        self.lat = lat
+        self.long = long
+        self.analysis_id = analysis_id
+
+    def __repr__(self):
+        return f"Deviation('{self.id}', '{self.duration}', '{self.distance}', '{self.time1}', '{self.time2}', '{self.lat}', '{self.long}', '{self.analysis_id}')"
+
+class Trip(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    number = db.Column(db.Integer, nullable=False)
+    time1 = db.Column(db.DateTime, default=None)
+    time2 = db.Column(db.DateTime, default=None)
+    points = db.Column(db.Integer, default=0)
+    loops = db.Column(db.Integer, default=0)
+    speeding = db.Column(db.Integer, default=0)
+    stops = db.Column(db.Integer, default=0)
+    deviations = db.Column(db.Integer, default=0)
+    analysis_id = db.Column(db.Integer, db.ForeignKey('analysis.id'))
+
+    def __init__(self, number, time1, time2, points, loops, speeding, stops, deviations, analysis_id):
+        self.number = number
+        self.time1 = time1
+        self.time2 = time2
+        self.points = points
+        self.loops = loops
+        self.speeding = speeding
+        self.stops = stops
+        self.deviations = deviations
+        self.analysis_id = analysis_id
+
+    def __repr__(self):
+        return f"Trip('{self.id}', '{self.number}', '{self.time1}', '{self.time2}', '{self.points}', '{self.loops}', '{self.analysis_id}')"
+
+class AnalysisTail(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    analysis_id = db.Column(db.Integer, db.ForeignKey('analysis.id'), unique=True)
+    state = db.Column(db.Text, nullable=False)
+
+    def __init__(self, analysis_id, state):
+        self.analysis_id = analysis_id
+        self.state = state
+
+    def __repr__(self):
+        return f"AnalysisTail('{self.id}', '{self.analysis_id}')"
+
+class LiveSession(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    route_id = db.Column(db.Integer, db.ForeignKey('route.id'), nullable=False)
+    vehicle_name = db.Column(db.String(60), nullable=False)
+    state = db.Column(db.Text, nullable=False)
+    updated = db.Column(db.DateTime, nullable=False, index=True)
+    __table_args__ = (db.UniqueConstraint('route_id', 'vehicle_name'),)
+
+    def __init__(self, route_id, vehicle_name, state, updated):
+        self.route_id = route_id
+        self.vehicle_name = vehicle_name
+        self.state = state
+        self.updated = updated
+
+    def __repr__(self):
+        return f"LiveSession('{self.id}', '{self.route_id}', '{self.vehicle_name}')"
+
+class HeadwayEvent(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    route_id = db.Column(db.Integer, db.ForeignKey('route.id'), nullable=False, index=True)
+    date = db.Column(db.Date, nullable=False)
+    event = db.Column(db.String(20), nullable=False)
+    stop = db.Column(db.Integer, nullable=False)
+    headway = db.Column(db.Integer, default=None)
+    leader_id = db.Column(db.Integer, db.ForeignKey('vehicle.id'))
+    follower_id = db.Column(db.Integer, db.ForeignKey('vehicle.id'))
+    time1 = db.Column(db.DateTime, default=None)
+    time2 = db.Column(db.DateTime, default=None)
+    center_lat = db.Column(db.Float, default=None)
+    center_long = db.Column(db.Float, default=None)
+
+    def __init__(self, route_id, date, event, stop, headway, leader_id, follower_id, time1, time2, center_lat, center_long):
+        self.route_id = route_id
+        self.date = date
+        self.event = event
+        self.stop = stop
+        self.headway = headway
+        self.leader_id = leader_id
+        self.follower_id = follower_id
+        self.time1 = time1
+        self.time2 = time2
+        self.center_lat = center_lat
+        self.center_long = center_long
+
+    def __repr__(self):
+        return f"HeadwayEvent('{self.id}', '{self.route_id}', '{self.date}', '{self.event}', '{self.stop}', '{self.headway}', '{self.leader_id}', '{self.follower_id}')"
+
 class GPSCutoffTime(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     time = db.Column(db.Time, default=None)
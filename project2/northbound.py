@@ -0,0 +1,185 @@
+import time
+import threading
+import jwt
+from requests import Session
+from requests.adapters import HTTPAdapter
+from requests.exceptions import RequestException
+from urllib3.util.retry import Retry
+from project2 import app
+
+DEFAULT_TIMEOUT = (3.05, 30)
+DEFAULT_RETRIES = 3
+DEFAULT_POOL_SIZE = 10
+DEFAULT_TOKEN_TTL = 3600
+TOKEN_REFRESH_MARGIN = 60
+
+class NorthboundError(Exception):
+    pass
+
+def read_northbound_config(config_file_path):
+    """
+    Reads the Northbound credentials out of the config file
+    Output: (url, username, password)
+    """
+    northbound_url = ''
+    northbound_username = ''
+    northbound_password = ''
+
+    with open(config_file_path, 'r') as config_file:
+        for line in config_file.readlines():
+            if 'NORTHBOUND_URL' in line[1:15]:
+                northbound_url = line[19:-2]
+            elif 'NORTHBOUND_USERNAME' in line[1:21]:
+                northbound_username = line[24:-2]
+            elif 'NORTHBOUND_PASSWORD' in line[1:21]:
+                northbound_password = line[24:-2]
+
+    return northbound_url, northbound_username, northbound_password
+
+def build_retry(retries, backoff_factor=0.3):
+    kwargs = {
+        'total': retries,
+        'backoff_factor': backoff_factor,
+        'status_forcelist': (500, 502, 503, 504),
+        'raise_on_status': False
+    }
+    methods = frozenset(['GET', 'POST'])
+
+    # urllib3 < 1.26 only knows method_whitelist, 2.x only allowed_methods
+    try:
+        return Retry(allowed_methods=methods, **kwargs)
+    except TypeError:
+        return Retry(method_whitelist=methods, **kwargs)
+
+class NorthboundClient():
+    """
+    Keeps one pooled HTTP session and a cached access token for
+    the Northbound API. The token is refreshed {refresh_margin}
+    seconds before it expires, or when the API answers 401.
+    """
+    def __init__(self, url, username, password, timeout=DEFAULT_TIMEOUT, retries=DEFAULT_RETRIES, pool_size=DEFAULT_POOL_SIZE, token_ttl=DEFAULT_TOKEN_TTL, refresh_margin=TOKEN_REFRESH_MARGIN):
+        self.url = url.rstrip('/')
+        self.username = username
+        self.password = password
+        self.timeout = timeout
+        self.token_ttl = token_ttl
+        self.refresh_margin = refresh_margin
+
+        self.session = Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=build_retry(retries))
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self._token = None
+        self._token_expiry = 0
+        self._lock = threading.Lock()
+
+    def token_expiry(self, login_response, access_token):
+        if login_response.get('expires_in'):
+            return time.time() + float(login_response['expires_in'])
+
+        try:
+            claims = jwt.decode(access_token, options={'verify_signature': False})
+            if claims.get('exp'):
+                return float(claims['exp'])
+        except jwt.PyJWTError:
+            pass
+
+        return time.time() + self.token_ttl
+
+    def login(self):
+        try:
+            res = self.session.post(self.url + '/login', auth=(self.username, self.password), timeout=self.timeout)
+            res.raise_for_status()
+            login_response = res.json()
+        except (RequestException, ValueError) as e:
+            raise NorthboundError(f'Cannot login to Northbound API: {e}')
+
+        access_token = login_response.get('access_token')
+        if not access_token:
+            raise NorthboundError('Cannot login to Northbound API: no access token returned')
+
+        self._token = access_token
+        self._token_expiry = self.token_expiry(login_response, access_token)
+
+        return access_token
+
+    def access_token(self):
+        with self._lock:
+            if self._token is None or time.time() >= self._token_expiry - self.refresh_margin:
+                self.login()
+            return self._token
+
+    def invalidate_token(self):
+        with self._lock:
+            self._token = None
+            self._token_expiry = 0
+
+    def get(self, path, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+
+        try:
+            for attempt in range(2):
+                headers = {'Authorization': 'Bearer ' + self.access_token()}
+                res = self.session.get(self.url + path, headers=headers, **kwargs)
+
+                # token revoked or expired early, log in again once
+                if res.status_code == 401 and attempt == 0:
+                    self.invalidate_token()
+                    continue
+                break
+
+            res.raise_for_status()
+        except RequestException as e:
+            raise NorthboundError(f'Northbound API request failed: {e}')
+
+        return res
+
+    def get_routes(self, path='/routes'):
+        try:
+            routes = self.get(path).json()
+        except ValueError as e:
+            raise NorthboundError(f'Northbound API returned invalid routes: {e}')
+
+        if isinstance(routes, dict):
+            routes = routes.get('routes', [])
+
+        return routes
+
+    def close(self):
+        self.session.close()
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_northbound_client(config_file_path):
+    """
+    Returns the shared client, creating it from the config file
+    on first use
+    """
+    global _client
+
+    with _client_lock:
+        if _client is None:
+            url, username, password = read_northbound_config(config_file_path)
+            _client = NorthboundClient(
+                url,
+                username,
+                password,
+                timeout=app.config.get('NORTHBOUND_TIMEOUT', DEFAULT_TIMEOUT),
+                retries=app.config.get('NORTHBOUND_RETRIES', DEFAULT_RETRIES),
+                pool_size=app.config.get('NORTHBOUND_POOL_SIZE', DEFAULT_POOL_SIZE),
+                token_ttl=app.config.get('NORTHBOUND_TOKEN_TTL', DEFAULT_TOKEN_TTL)
+            )
+        return _client
+
+def reset_northbound_client():
+    """
+    Drops the shared client so the next call picks up new credentials
+    """
+    global _client
+
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+        _client = None
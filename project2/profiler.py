@@ -0,0 +1,100 @@
+import re
+import time
+from flask import g, request, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from project2 import app
+
+SLOW_QUERY_MS = 100
+N_PLUS_ONE_THRESHOLD = 5
+
+WHITESPACE = re.compile(r'\s+')
+PLACEHOLDER_LIST = re.compile(r'\(\s*(?:\?|%s|:\w+)(?:\s*,\s*(?:\?|%s|:\w+))*\s*\)')
+NUMBER = re.compile(r'\b\d+\b')
+
+def profiling_enabled():
+    return app.config.get('SQL_PROFILING', False)
+
+def statement_shape(statement):
+    """
+    Normalizes a statement so that queries differing only in
+    parameter values or IN list length compare equal
+    """
+    shape = WHITESPACE.sub(' ', statement).strip()
+    shape = PLACEHOLDER_LIST.sub('(?)', shape)
+    return NUMBER.sub('N', shape)
+
+# start times are kept per cursor, so a statement that fails cannot
+# leave its start behind for the next one to pop
+@event.listens_for(Engine, 'before_cursor_execute')
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if profiling_enabled() and has_request_context():
+        conn.info.setdefault('query_start', {})[id(cursor)] = time.perf_counter()
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = conn.info.get('query_start', {}).pop(id(cursor), None)
+
+    if start is not None and has_request_context():
+        duration = time.perf_counter() - start
+        g.setdefault('sql_queries', []).append((statement, duration))
+
+@event.listens_for(Engine, 'handle_error')
+def handle_error(exception_context):
+    cursor = exception_context.cursor
+    if cursor is None and exception_context.execution_context is not None:
+        cursor = exception_context.execution_context.cursor
+
+    if exception_context.connection is not None and cursor is not None:
+        exception_context.connection.info.get('query_start', {}).pop(id(cursor), None)
+
+def summarize_queries(queries, threshold=N_PLUS_ONE_THRESHOLD, slow_ms=SLOW_QUERY_MS):
+    """
+    Input:  queries (list of (statement, seconds))
+    Output: count, total time, statement shapes repeated at least
+            {threshold} times (likely N+1) and queries over {slow_ms}
+    """
+    shapes = {}
+    slow = []
+
+    for statement, duration in queries:
+        shape = statement_shape(statement)
+        count, seconds = shapes.get(shape, (0, 0.0))
+        shapes[shape] = (count + 1, seconds + duration)
+
+        if duration * 1000 >= slow_ms:
+            slow.append({'statement': shape, 'seconds': duration})
+
+    repeated = [{'statement': shape, 'count': count, 'seconds': seconds} for shape, (count, seconds) in shapes.items() if count >= threshold]
+    repeated.sort(key=lambda r: r['count'], reverse=True)
+
+    return {
+        'count': len(queries),
+        'seconds': sum(duration for statement, duration in queries),
+        'repeated': repeated,
+        'slow': slow
+    }
+
+@app.after_request
+def report_queries(response):
+    queries = g.get('sql_queries')
+
+    if not queries:
+        return response
+
+    summary = summarize_queries(
+        queries,
+        app.config.get('SQL_N_PLUS_ONE_THRESHOLD', N_PLUS_ONE_THRESHOLD),
+        app.config.get('SQL_SLOW_QUERY_MS', SLOW_QUERY_MS)
+    )
+    endpoint = f'{request.method} {request.path}'
+
+    app.logger.info('%s: %d queries in %.1f ms', endpoint, summary['count'], summary['seconds'] * 1000)
+    for repeated in summary['repeated']:
+        app.logger.warning('%s: possible N+1, %d x %.1f ms total: %s', endpoint, repeated['count'], repeated['seconds'] * 1000, repeated['statement'])
+    for slow in summary['slow']:
+        app.logger.warning('%s: slow query %.1f ms: %s', endpoint, slow['seconds'] * 1000, slow['statement'])
+
+    response.headers['X-SQL-Queries'] = f"{summary['count']};dur={summary['seconds'] * 1000:.1f};repeated={len(summary['repeated'])}"
+
+    return response
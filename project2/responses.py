@@ -0,0 +1,60 @@
+import gzip
+import json
+from flask import request, current_app
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESS_MIN_SIZE = 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+def default(o):
+    """
+    The app's JSONEncoder for what neither serializer handles, so
+    datetimes come out as jsonify writes them with or without orjson
+    """
+    return current_app.json_encoder().default(o)
+
+def dumps(data):
+    if orjson is not None:
+        return orjson.dumps(data, default=default, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME)
+
+    return json.dumps(data, separators=(',', ':'), default=default).encode('utf-8')
+
+def compress(body):
+    """
+    Compresses {body} with the best encoding the client accepts
+    Output: (body, encoding), encoding is None when left as is
+    """
+    if len(body) < current_app.config.get('COMPRESS_MIN_SIZE', COMPRESS_MIN_SIZE):
+        return body, None
+
+    if brotli is not None and request.accept_encodings['br']:
+        return brotli.compress(body, quality=current_app.config.get('BROTLI_QUALITY', BROTLI_QUALITY)), 'br'
+
+    if request.accept_encodings['gzip']:
+        return gzip.compress(body, compresslevel=current_app.config.get('GZIP_LEVEL', GZIP_LEVEL)), 'gzip'
+
+    return body, None
+
+def json_response(data):
+    """
+    jsonify for large payloads: serializes with orjson when it is
+    installed and compresses above COMPRESS_MIN_SIZE bytes
+    """
+    body, encoding = compress(dumps(data))
+
+    rv = current_app.response_class(body, mimetype='application/json')
+    rv.vary.add('Accept-Encoding')
+    if encoding:
+        rv.content_encoding = encoding
+
+    return rv
@@ -3,19 +3,32 @@ import jwt
 import json
 import numpy as np
 import boto3
-from requests import post
+import hashlib
 from functools import wraps
 from werkzeug.utils import secure_filename
-from werkzeug.security import check_password_hash
 from datetime import datetime, timedelta, date
 from flask import request, jsonify, send_file, current_app
 from flask_cors import CORS
+from botocore.exceptions import ClientError
 from project2 import app, db
-from project2.models import User, Vehicle, Route, Parameters, Analysis, Distance, Loops, Speeding, Stops, Liveness, GPSCutoffTime
-from project2.api import parse_gpx_file, compute_distance_travelled, compute_speed_violation, compute_stop_violation, compute_liveness, generate_grid_fence, generate_path, route_check, is_gpx_file, is_csv_file, create_geojson_feature, csv_to_gpx_stops, generate_corner_pts, parse_gpx_waypoints, Point, compute_vehicle_info
+from project2.models import User, Vehicle, Route, Parameters, Analysis, Distance, Loops, Speeding, Stops, Liveness, Deviation, Trip, GPSCutoffTime, VehicleSegment, VehicleUpload, HeadwayEvent
+from project2.api import get_gps_cutoff, set_gps_cutoff, service_date, DEVIATION_DISTANCE, DEVIATION_MIN_TIME, BUNCHING_HEADWAY, GAP_HEADWAY, parse_time, get_speed_profile, stop_fences, stop_arrivals, compute_headways, to_datetime, parse_gpx_file, compute_distance_travelled, compute_speed_violation, compute_stop_violation, compute_liveness, generate_grid_fence, generate_path, route_check, is_gpx_file, is_csv_file, create_geojson_feature, csv_to_gpx_stops, generate_corner_pts, parse_gpx_waypoints, Point, compute_vehicle_info, create_polyline_feature, get_route_grid, discard_route_grids, concatenate_trajectories, clear_vehicle_info, copy_vehicle_info, analysis_parameters
+from project2.assets import StaticIndex
+from project2.responses import json_response
+from project2.metrics import metrics, stage
+from project2.security import LoginBusy, verify_password
+from project2.executor import run_trip_analyses
+from project2.live import LiveVehicle, parse_live_points, get_live_vehicle, save_live_vehicle, pop_live_vehicle, extend_vehicle_info, save_tail
+from project2.tracks import TrackStore, encode_track, VISIT_MAX_DEGREES
+from project2.northbound import NorthboundError, read_northbound_config, get_northbound_client, reset_northbound_client
 
 PER_PAGE = 8
+WINDOW_PADDING = 60
+SPEED_PROFILE_MAX_WIDTH = 4000
+ANALYSIS_BATCH_SIZE = 16
+UPLOAD_CHUNK_SIZE = 1 << 16
 QUERY_LIMIT = 7
+SYNC_CHUNK_SIZE = 500
 CONFIG_FILE_PATH = 'project2/config.py'
 
 AWS_ACCESS_KEY = app.config['AWS_ACCESS_KEY']
@@ -30,14 +43,13 @@ s3 = boto3.client('s3',
     region_name=REGION_NAME
 )
 
+static_index = StaticIndex(app.static_folder)
+track_store = TrackStore(s3, VEHICLE_BUCKET)
+
 @app.route('/', defaults={'path': ''})
 @app.route('/<path:path>')
 def catch_all(path):
-    file_path = os.path.join(app.static_folder, path)
-    if os.path.isfile(file_path):
-        return send_file(file_path)
-    index_path = os.path.join(app.static_folder, 'index.html')
-    return send_file(index_path)
+    return static_index.send(path)
 
 def token_required(f):
     @wraps(f)
@@ -73,6 +85,19 @@ def admin_only(f):
 
     return decorated
 
+@app.route('/metrics', methods=['GET'])
+@token_required
+@admin_only
+def get_metrics(curr_user):
+    return metrics.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+def create_geometry_feature(gps_data):
+    # ?encoding=polyline trades the GeoJSON coordinate arrays for an encoded string
+    if request.args.get('encoding') == 'polyline':
+        return create_polyline_feature(gps_data)
+
+    return create_geojson_feature(gps_data)
+
 @app.route('/api/login', methods=['POST'])
 def login():
     username = request.get_json()['username']
@@ -83,7 +108,16 @@ def login():
     if user is None:
         return jsonify({'error': 'Incorrect credentials'}), 422
 
-    if check_password_hash(user.password, password):
+    try:
+        valid, new_hash = verify_password(user.password, password)
+    except LoginBusy:
+        return jsonify({'error': 'Too many login attempts, try again later'}), 503
+
+    if valid:
+        if new_hash:
+            user.password = new_hash
+            db.session.commit()
+
         token = jwt.encode(
             {
                 'username': user.username, 
@@ -174,7 +208,22 @@ def create_vehicle(curr_user):
 
     # check if gpx_file is valid and add vehicle, analysis
     if gpx_file and is_gpx_file(filename):
-        res = s3.put_object(Body=gpx_file.read(), Bucket=VEHICLE_BUCKET, Key=filename)
+        with stage('upload_digest') as record:
+            content, digest = read_upload(gpx_file)
+            record['bytes'] = len(content)
+
+        cutoff = get_gps_cutoff()
+        source = duplicate_upload(digest, route, cutoff)
+        if source is not None:
+            try:
+                with stage('s3_copy'):
+                    s3.copy_object(CopySource={'Bucket': VEHICLE_BUCKET, 'Key': source.filename}, Bucket=VEHICLE_BUCKET, Key=filename)
+            except ClientError:
+                source = None
+
+        if source is None:
+            with stage('s3_upload'):
+                res = s3.put_object(Body=content, Bucket=VEHICLE_BUCKET, Key=filename)
 
         vehicle = Vehicle(filename, vehicle_name, date, route.id, route_name)
         db.session.add(vehicle)
@@ -184,25 +233,17 @@ def create_vehicle(curr_user):
         db.session.add(analysis)
         db.session.commit()
 
-        gpx_file = s3.get_object(Bucket=VEHICLE_BUCKET, Key=vehicle.filename)['Body'].read()
-        gps_data_vehicle = parse_gpx_file(gpx_file)
+        # the same content was stored and analyzed before, reuse it
+        if source is not None and track_store.copy(source, vehicle):
+            copy_vehicle_info(source.analysis, analysis)
+        else:
+            gps_data_vehicle = load_vehicle_track(vehicle)
+            track_store.index(vehicle, gps_data_vehicle)
+            analyze_vehicle(vehicle, route, gps_data_vehicle)
 
-        # compute distance
-        distance = compute_distance_travelled(gps_data_vehicle)
-        distance_record = Distance(distance, vehicle.analysis.id)
-        db.session.add(distance_record)
+        db.session.add(VehicleUpload(digest, vehicle.id, route.id, cutoff))
         db.session.commit()
 
-        # check and analyze vehicle if ref_file, stop_file, and parameter data are available
-        if route.parameters.cell_size and route.ref_filename:
-            gpx_file = s3.get_object(Bucket=ROUTE_BUCKET, Key=route.ref_filename)['Body'].read()
-            gps_data_route = parse_gpx_file(gpx_file)
-
-            gpx_file = s3.get_object(Bucket=ROUTE_BUCKET, Key=route.stop_filename)['Body'].read()
-            stops = parse_gpx_waypoints(gpx_file)
-
-            compute_vehicle_info(vehicle, route, gps_data_vehicle, gps_data_route, stops)
-
         data = {
             'id': vehicle.id,
             'vehicle_name': vehicle.name,
@@ -216,6 +257,364 @@ def create_vehicle(curr_user):
 
     return jsonify({'error': 'vehicle entry creation failed'}), 400
 
+def read_upload(upload):
+    """
+    The content of an uploaded file and its SHA-256 hex digest,
+    hashed chunk by chunk as it is read
+    """
+    digest = hashlib.sha256()
+    chunks = []
+    for chunk in iter(lambda: upload.read(UPLOAD_CHUNK_SIZE), b''):
+        digest.update(chunk)
+        chunks.append(chunk)
+
+    return b''.join(chunks), digest.hexdigest()
+
+def duplicate_upload(digest, route, cutoff):
+    """
+    A vehicle on {route} uploaded with the same content, parsed with
+    the same GPS cutoff time and analyzed with the route's current
+    parameters, or None
+    """
+    if not route_is_analyzed(route):
+        return None
+
+    for upload in VehicleUpload.query.filter_by(digest=digest, route_id=route.id).order_by(VehicleUpload.id.desc()).all():
+        vehicle = upload.vehicle
+        # appended segments make the track more than the upload
+        if upload.cut_off_time != cutoff or vehicle.route_id != route.id or vehicle.segments:
+            continue
+        if vehicle.analysis and vehicle.analysis.loops and analysis_is_current(vehicle.analysis, route.parameters):
+            return vehicle
+
+    return None
+
+def store_distance(vehicle, gps_data_vehicle):
+    with stage('distance') as record:
+        distance = compute_distance_travelled(gps_data_vehicle)
+        distance_record = Distance(distance, vehicle.analysis.id)
+        db.session.add(distance_record)
+        db.session.commit()
+        record['rows'] = 1
+
+def analyze_vehicle(vehicle, route, gps_data_vehicle):
+    store_distance(vehicle, gps_data_vehicle)
+
+    # check and analyze vehicle if ref_file, stop_file, and parameter data are available
+    # and the GPS cutoff time left any fixes
+    if route_is_analyzed(route) and len(gps_data_vehicle):
+        route_grid = get_route_grid(route, lambda: load_route_files(route))
+        results = run_trip_analyses([gps_data_vehicle], analysis_parameters(route.parameters), route_grid)[0]
+        compute_vehicle_info(vehicle, route, gps_data_vehicle, route_grid, results)
+        save_vehicle_tail(vehicle, route, route_grid, gps_data_vehicle, results)
+
+def save_vehicle_tail(vehicle, route, route_grid, gps_data_vehicle, results):
+    """
+    Keeps the live state after {vehicle}'s whole track, which the
+    next appended segment continues from. Only the last trip is
+    replayed, the rest comes from the merge_trip_results {results}.
+    """
+    with stage('live') as record:
+        live_vehicle = LiveVehicle.after_track(route, route_grid, gps_data_vehicle, results['trips'])
+        record['points'] = len(gps_data_vehicle) - sum(trip['points'] for trip in results['trips'][:-1])
+
+    if live_vehicle is not None:
+        save_tail(vehicle.analysis, live_vehicle)
+
+@app.route('/api/route/<int:route_id>/reanalyze', methods=['POST'])
+@token_required
+@admin_only
+def reanalyze_route(curr_user, route_id):
+    route = Route.query.get(route_id)
+
+    if not route or not route_is_analyzed(route):
+        return jsonify({'error': 'route is not set up for analysis'}), 400
+
+    route_grid = get_route_grid(route, lambda: load_route_files(route))
+    parameters = analysis_parameters(route.parameters)
+    cutoff = get_gps_cutoff()
+    vehicles = [vehicle for vehicle in route.vehicles if vehicle.analysis]
+    batch_size = app.config.get('ANALYSIS_BATCH_SIZE', ANALYSIS_BATCH_SIZE)
+
+    # a batch of vehicles shares the process pool, the writes stay here
+    for start in range(0, len(vehicles), batch_size):
+        batch = vehicles[start:start + batch_size]
+        tracks = [load_vehicle_track(vehicle) for vehicle in batch]
+        results = run_trip_analyses(tracks, parameters, route_grid)
+
+        for vehicle, track, result in zip(batch, tracks, results):
+            track_store.index(vehicle, track)
+            clear_vehicle_info(vehicle.analysis)
+            store_distance(vehicle, track)
+            compute_vehicle_info(vehicle, route, track, route_grid, result)
+            save_vehicle_tail(vehicle, route, route_grid, track, result)
+            VehicleUpload.query.filter_by(vehicle_id=vehicle.id).update({'cut_off_time': cutoff})
+        db.session.commit()
+
+    data = {
+        'id': route.id,
+        'route_name': route.name,
+        'vehicles': len(vehicles)
+    }
+
+    return jsonify(data), 200
+
+def headway_event_data(event):
+    return {
+        'event': event.event,
+        'stop': event.stop,
+        'headway': event.headway,
+        'leader_id': event.leader_id,
+        'follower_id': event.follower_id,
+        'time1': event.time1.strftime("%I:%M %p, %m/%d/%Y"),
+        'time2': event.time2.strftime("%I:%M %p, %m/%d/%Y"),
+        'center_lat': event.center_lat,
+        'center_long': event.center_long
+    }
+
+@app.route('/api/route/<int:route_id>/headway', methods=['POST'])
+@token_required
+@admin_only
+def analyze_route_headways(curr_user, route_id):
+    route = Route.query.get(route_id)
+
+    try:
+        date = datetime.strptime(request.get_json()['date'], "%Y-%m-%d").date()
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'error': 'invalid date'}), 400
+
+    if not route or not route_is_analyzed(route):
+        return jsonify({'error': 'route is not set up for analysis'}), 400
+
+    fences = stop_fences(get_route_grid(route, lambda: load_route_files(route))['stops'])
+    vehicles = Vehicle.query.filter_by(route_id=route.id, date_uploaded=date).all()
+
+    arrivals = []
+    timezones = {}
+    for vehicle in vehicles:
+        gps_data = stored_track(vehicle)
+        timezones[vehicle.id] = gps_data.tzinfo
+        arrivals.append((vehicle.id, *stop_arrivals(gps_data, fences)))
+
+    with stage('headways') as record:
+        headways = compute_headways(arrivals, app.config.get('BUNCHING_HEADWAY', BUNCHING_HEADWAY), app.config.get('GAP_HEADWAY', GAP_HEADWAY))
+        record['arrivals'] = sum(len(stop) for vehicle_id, stop, timestamp in arrivals)
+
+    HeadwayEvent.query.filter_by(route_id=route.id, date=date).delete()
+    events = []
+    for event in headways['events']:
+        point1, point2 = fences[event['stop']]
+        events.append(HeadwayEvent(
+            route.id, date, event['type'], event['stop'], event['headway'], event['leader'], event['follower'],
+            to_datetime(event['time1'], timezones[event['leader']]), to_datetime(event['time2'], timezones[event['follower']]),
+            (point1.lat + point2.lat) / 2, (point1.lon + point2.lon) / 2
+        ))
+    db.session.add_all(events)
+    db.session.commit()
+
+    data = {
+        'id': route.id,
+        'route_name': route.name,
+        'date': date.strftime("%b %d, %Y"),
+        'vehicles': len(vehicles),
+        'stops': [],
+        'events': [headway_event_data(event) for event in events]
+    }
+
+    for stop, summary in sorted(headways['stops'].items()):
+        point1, point2 = fences[stop]
+        data['stops'].append(dict(summary, stop=stop, center_lat=(point1.lat + point2.lat) / 2, center_long=(point1.lon + point2.lon) / 2))
+
+    return jsonify(data), 200
+
+@app.route('/api/route/<int:route_id>/headway', methods=['GET'])
+@token_required
+def get_route_headways(curr_user, route_id):
+    try:
+        date = datetime.strptime(request.args['date'], "%Y-%m-%d").date()
+    except (KeyError, ValueError):
+        return jsonify({'error': 'invalid date'}), 400
+
+    events = HeadwayEvent.query.filter_by(route_id=route_id, date=date).order_by(HeadwayEvent.time2).all()
+
+    data = {
+        'id': route_id,
+        'date': date.strftime("%b %d, %Y"),
+        'events': [headway_event_data(event) for event in events]
+    }
+
+    return jsonify(data), 200
+
+def route_is_analyzed(route):
+    return bool(route.parameters and route.parameters.cell_size and route.ref_filename)
+
+def analysis_is_current(analysis, parameters):
+    analyzed_with = (analysis.cell_size, analysis.stop_min_time, analysis.stop_max_time, analysis.speeding_time_limit, analysis.speeding_speed_limit, analysis.liveness_time_limit)
+    return analyzed_with == (parameters.cell_size, parameters.stop_min_time, parameters.stop_max_time, parameters.speeding_time_limit, parameters.speeding_speed_limit, parameters.liveness_time_limit)
+
+def load_vehicle_track(vehicle):
+    """
+    The vehicle's upload and the segments appended to it as one
+    trajectory, deduplicated by timestamp as if it were one file,
+    without the fixes past the GPS cutoff time on the upload's
+    service date
+    """
+    tracks = []
+    cutoff = get_gps_cutoff()
+    track_date = None
+    for filename in [vehicle.filename] + [segment.filename for segment in vehicle.segments]:
+        with stage('s3_download'):
+            gpx_file = s3.get_object(Bucket=VEHICLE_BUCKET, Key=filename)['Body'].read()
+
+        with stage('parse_gpx') as record:
+            tracks.append(parse_gpx_file(gpx_file, cutoff, record, track_date))
+            record['points'] = len(tracks[-1])
+
+        if track_date is None:
+            track_date = service_date(tracks[-1])
+
+    if len(tracks) == 1:
+        return tracks[0]
+
+    return concatenate_trajectories(tracks).unique_times()
+
+def stored_service_date(vehicle):
+    """
+    The service date of the vehicle's first stored fix, which an
+    appended segment is cut off on
+    """
+    try:
+        return service_date(track_store.read_slice(vehicle, 0, 1))
+    except ClientError:
+        return None
+
+def segment_filename(vehicle):
+    return f"{vehicle.filename.rsplit('.', 1)[0]}.part{len(vehicle.segments) + 1}.gpx"
+
+@app.route('/api/vehicle/<int:vehicle_id>/segment', methods=['POST'])
+@token_required
+@admin_only
+def append_vehicle_segment(curr_user, vehicle_id):
+    vehicle = Vehicle.query.get(vehicle_id)
+    gpx_file = request.files['gpx_file']
+
+    if not vehicle or not vehicle.analysis or not gpx_file or not is_gpx_file(gpx_file.filename):
+        return jsonify({'error': 'vehicle segment upload failed'}), 400
+
+    segment_gpx = gpx_file.read()
+    cutoff = get_gps_cutoff()
+    track_date = stored_service_date(vehicle) if cutoff is not None else None
+    with stage('parse_gpx') as record:
+        gps_data_segment = parse_gpx_file(segment_gpx, cutoff, record, track_date)
+        record['points'] = len(gps_data_segment)
+
+    if not len(gps_data_segment):
+        return jsonify({'error': 'segment has no track points'}), 400
+
+    route = vehicle.route
+    analysis = vehicle.analysis
+    live_vehicle = None
+
+    # the saved tail state only holds while the route and its parameters are unchanged
+    if route_is_analyzed(route) and analysis.tail and analysis_is_current(analysis, route.parameters):
+        route_grid = get_route_grid(route, lambda: load_route_files(route))
+        live_vehicle = LiveVehicle.from_state(route, route_grid, json.loads(analysis.tail.state))
+
+    filename = segment_filename(vehicle)
+    with stage('s3_upload'):
+        res = s3.put_object(Body=segment_gpx, Bucket=VEHICLE_BUCKET, Key=filename)
+
+    segment = VehicleSegment(vehicle.id, filename, date.today(), gps_data_segment.time(0), gps_data_segment.time(len(gps_data_segment) - 1), len(gps_data_segment))
+    db.session.add(segment)
+    db.session.commit()
+
+    # only a segment that starts after the stored track can be analyzed on its own
+    timestamp = gps_data_segment.timestamp
+    follows = live_vehicle is not None and live_vehicle.last_fix is not None and timestamp[0] > live_vehicle.last_fix[2] and bool(np.all(timestamp[1:] > timestamp[:-1]))
+
+    if follows:
+        if not track_store.extend(vehicle, gps_data_segment):
+            track_store.index(vehicle, load_vehicle_track(vehicle))
+        extend_vehicle_info(vehicle, live_vehicle, gps_data_segment)
+        reanalyzed = 'tail'
+    else:
+        clear_vehicle_info(analysis)
+        gps_data_vehicle = load_vehicle_track(vehicle)
+        track_store.index(vehicle, gps_data_vehicle)
+        analyze_vehicle(vehicle, route, gps_data_vehicle)
+        db.session.commit()
+        reanalyzed = 'full'
+
+    data = {
+        'id': vehicle.id,
+        'vehicle_name': vehicle.name,
+        'filename': vehicle.filename,
+        'segment_filename': segment.filename,
+        'segments': len(vehicle.segments),
+        'points': segment.points,
+        'reanalyzed': reanalyzed
+    }
+
+    return jsonify(data), 201
+
+def load_route_files(route):
+    with stage('s3_download'):
+        ref_gpx_file = s3.get_object(Bucket=ROUTE_BUCKET, Key=route.ref_filename)['Body'].read()
+        stop_gpx_file = s3.get_object(Bucket=ROUTE_BUCKET, Key=route.stop_filename)['Body'].read()
+
+    with stage('parse_gpx') as record:
+        gps_data_route = parse_gpx_file(ref_gpx_file)
+        stops = parse_gpx_waypoints(stop_gpx_file)
+        record['points'] = len(gps_data_route) + len(stops)
+
+    return gps_data_route, stops
+
+@app.route('/api/live', methods=['POST'])
+@token_required
+@admin_only
+def ingest_live_points(curr_user):
+    vehicle_name = request.get_json()['vehicle_name']
+    route_name = request.get_json()['route_name']
+    points = request.get_json()['points']
+
+    route = Route.query.filter_by(name=route_name).first()
+    if not route or not route.parameters or not route.parameters.cell_size or not route.ref_filename:
+        return jsonify({'error': 'route is not set up for analysis'}), 400
+
+    try:
+        gps_data = parse_live_points(points)
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'error': 'invalid points'}), 400
+
+    route_grid = get_route_grid(route, lambda: load_route_files(route))
+    session, live_vehicle = get_live_vehicle(route, vehicle_name, route_grid)
+
+    with stage('live') as record:
+        events = live_vehicle.update(gps_data)
+        record['points'] = len(gps_data)
+
+    save_live_vehicle(session, live_vehicle)
+    db.session.commit()
+
+    return jsonify({'events': events, 'state': live_vehicle.summary()}), 200
+
+@app.route('/api/live/<route_name>/<vehicle_name>', methods=['DELETE'])
+@token_required
+@admin_only
+def finish_live_points(curr_user, route_name, vehicle_name):
+    route = Route.query.filter_by(name=route_name).first()
+    live_vehicle = None
+    if route and route_is_analyzed(route):
+        live_vehicle = pop_live_vehicle(route, vehicle_name, get_route_grid(route, lambda: load_route_files(route)))
+        db.session.commit()
+
+    if not live_vehicle:
+        return jsonify({'error': 'no live session for vehicle'}), 404
+
+    events = live_vehicle.finish()
+
+    return jsonify({'events': events, 'state': live_vehicle.summary()}), 200
+
 @app.route('/api/route/<int:route_id>', methods=['PUT'])
 @token_required
 @admin_only
@@ -245,6 +644,7 @@ def update_route(curr_user, route_id):
         route.date_uploaded = date.today()
         
         db.session.commit()
+        discard_route_grids(route.id)
 
         data = {
             'id': route.id,
@@ -280,6 +680,7 @@ def update_parameters(curr_user, parameters_id):
         parameters.liveness_time_limit = liveness_time_limit
 
         db.session.commit()
+        discard_route_grids(parameters.route_id)
 
         data = {
             'id': parameters.id,
@@ -318,16 +719,16 @@ def get_route(curr_user, route_id):
         if route.ref_filename:
             gpx_file = s3.get_object(Bucket=ROUTE_BUCKET, Key=route.ref_filename)['Body'].read()
             gps_data = parse_gpx_file(gpx_file)
-            data['geojson'] = create_geojson_feature(gps_data)
+            data['geojson'] = create_geometry_feature(gps_data)
             data['ref_filename'] = route.ref_filename
 
         if route.stop_filename:
             gpx_file = s3.get_object(Bucket=ROUTE_BUCKET, Key=route.stop_filename)['Body'].read()
             gps_data = parse_gpx_waypoints(gpx_file)
-            data['polygon'] = create_geojson_feature(gps_data)
+            data['polygon'] = create_geometry_feature(gps_data)
             data['stop_filename'] = route.stop_filename
 
-        return jsonify(data), 200
+        return json_response(data), 200
 
     return jsonify({'error': 'route does not exist'}), 400
 
@@ -387,9 +788,8 @@ def get_vehicle(curr_user, vehicle_id):
     vehicle = Vehicle.query.get(vehicle_id)
 
     if vehicle:            
-        gpx_file = s3.get_object(Bucket=VEHICLE_BUCKET, Key=vehicle.filename)['Body'].read()
-        gps_data = parse_gpx_file(gpx_file)
-        geojson = create_geojson_feature(gps_data)
+        gps_data = load_vehicle_track(vehicle)
+        geojson = create_geometry_feature(gps_data)
 
         data = {
             'id': vehicle.id,
@@ -402,10 +802,158 @@ def get_vehicle(curr_user, vehicle_id):
             'geojson': geojson
         }
 
-        return jsonify(data), 200
+        return json_response(data), 200
 
     return jsonify({'error': 'vehicle does not exist'}), 400
 
+def stored_track_timezone(vehicle):
+    """
+    tzinfo of the vehicle's stored track. Vehicles uploaded before
+    tracks were stored get theirs here.
+    """
+    header = track_store.header(vehicle)
+    if header is None:
+        track_store.index(vehicle, load_vehicle_track(vehicle))
+        header = track_store.header(vehicle)
+
+    return header[1]
+
+def stored_track(vehicle):
+    gps_data = track_store.read(vehicle)
+    if gps_data is None:
+        gps_data = load_vehicle_track(vehicle)
+        track_store.index(vehicle, gps_data)
+
+    return gps_data
+
+def stored_timestamp(value, tzinfo):
+    # analysis times are stored as wall clock time in the track's time zone
+    return value.replace(tzinfo=tzinfo).timestamp()
+
+def window_times(vehicle, tzinfo):
+    """
+    The window ?time1=&time2= asks for, or the one around violation
+    ?violation=<kind>&violation_id=<id> padded by ?padding= seconds,
+    as epoch seconds. None if the request names neither.
+    """
+    kinds = {'speeding': Speeding, 'stop': Stops, 'liveness': Liveness, 'deviation': Deviation}
+
+    if request.args.get('violation'):
+        model = kinds.get(request.args.get('violation'))
+        violation = model.query.get(request.args.get('violation_id', type=int)) if model else None
+        if not violation or not vehicle.analysis or violation.analysis_id != vehicle.analysis.id or violation.duration == -1:
+            return None
+
+        padding = request.args.get('padding', WINDOW_PADDING, type=float)
+        return stored_timestamp(violation.time1, tzinfo) - padding, stored_timestamp(violation.time2, tzinfo) + padding
+
+    try:
+        return parse_time(request.args['time1']).timestamp(), parse_time(request.args['time2']).timestamp()
+    except (KeyError, TypeError, ValueError, AttributeError):
+        return None
+
+@app.route('/api/vehicle/<int:vehicle_id>/track', methods=['GET'])
+@token_required
+def get_vehicle_track_window(curr_user, vehicle_id):
+    vehicle = Vehicle.query.get(vehicle_id)
+
+    if not vehicle:
+        return jsonify({'error': 'vehicle does not exist'}), 400
+
+    tzinfo = stored_track_timezone(vehicle)
+    window = window_times(vehicle, tzinfo)
+    if window is None or window[0] > window[1]:
+        return jsonify({'error': 'invalid time window'}), 400
+
+    with stage('track_window') as record:
+        gps_data = track_store.window(vehicle, window[0], window[1], tzinfo)
+        record['points'] = len(gps_data)
+
+    # ?format=binary sends the slice in the stored track format
+    if request.args.get('format') == 'binary':
+        return app.response_class(encode_track(gps_data), mimetype='application/octet-stream'), 200
+
+    data = {
+        'id': vehicle.id,
+        'vehicle_name': vehicle.name,
+        'time1': gps_data.time(0) if len(gps_data) else json.dumps(None),
+        'time2': gps_data.time(len(gps_data) - 1) if len(gps_data) else json.dumps(None),
+        'points': len(gps_data),
+        'geojson': create_geometry_feature(gps_data)
+    }
+
+    return json_response(data), 200
+
+@app.route('/api/vehicle/<int:vehicle_id>/speed', methods=['GET'])
+@token_required
+def get_vehicle_speed_profile(curr_user, vehicle_id):
+    vehicle = Vehicle.query.get(vehicle_id)
+    width = request.args.get('width', type=int)
+
+    if not vehicle:
+        return jsonify({'error': 'vehicle does not exist'}), 400
+    if not width or width < 3:
+        return jsonify({'error': 'width must be at least 3'}), 400
+
+    profile = get_speed_profile(vehicle, min(width, SPEED_PROFILE_MAX_WIDTH), lambda: stored_track(vehicle))
+    analysis = vehicle.analysis
+
+    data = {
+        'id': vehicle.id,
+        'vehicle_name': vehicle.name,
+        'points': profile['points'],
+        'timestamps': profile['timestamps'],
+        'speeds': profile['speeds'],
+        'speed_limit': analysis.speeding_speed_limit if analysis else None,
+        'speeding': []
+    }
+
+    for violation in analysis.speeding if analysis else []:
+        if violation.duration == -1:
+            continue
+
+        data['speeding'].append({
+            'duration': violation.duration,
+            'time1': stored_timestamp(violation.time1, profile['tzinfo']),
+            'time2': stored_timestamp(violation.time2, profile['tzinfo'])
+        })
+
+    return json_response(data), 200
+
+@app.route('/api/vehicle/visits', methods=['POST'])
+@token_required
+def get_vehicle_visits(curr_user):
+    try:
+        point1 = Point(float(request.get_json()['lat1']), float(request.get_json()['long1']))
+        point2 = Point(float(request.get_json()['lat2']), float(request.get_json()['long2']))
+        time1 = parse_time(request.get_json()['time1']).timestamp()
+        time2 = parse_time(request.get_json()['time2']).timestamp()
+    except (KeyError, TypeError, ValueError, AttributeError):
+        return jsonify({'error': 'invalid area or time range'}), 400
+
+    if point1.lat < point2.lat or point1.lon > point2.lon or time1 > time2:
+        return jsonify({'error': 'invalid area or time range'}), 400
+
+    max_degrees = app.config.get('VISIT_MAX_DEGREES', VISIT_MAX_DEGREES)
+    if point1.lat - point2.lat > max_degrees or point2.lon - point1.lon > max_degrees:
+        return jsonify({'error': 'area is larger than %g degrees' % max_degrees}), 400
+
+    route_names = None if curr_user.admin else curr_user.routes.split(', ')
+    with stage('visits') as record:
+        visits = track_store.visits(point1, point2, time1, time2, route_names)
+        record['vehicles'] = len(visits)
+
+    data = {'vehicles': []}
+    for vehicle, vehicle_visits in visits:
+        data['vehicles'].append({
+            'id': vehicle.id,
+            'vehicle_name': vehicle.name,
+            'route_name': vehicle.route_name,
+            'visits': vehicle_visits
+        })
+
+    return jsonify(data), 200
+
 @app.route('/api/vehicle/paged/<int:page_no>', methods=['POST'])
 @token_required
 def get_paged_vehicles(curr_user, page_no):
@@ -485,16 +1033,16 @@ def get_parameter(curr_user, parameter_id):
         if route.ref_filename:
             gpx_file = s3.get_object(Bucket=ROUTE_BUCKET, Key=route.ref_filename)['Body'].read()
             gps_data = parse_gpx_file(gpx_file)
-            data['geojson'] = create_geojson_feature(gps_data)
+            data['geojson'] = create_geometry_feature(gps_data)
             data['ref_filename'] = route.ref_filename
 
         if route.stop_filename:
             gpx_file = s3.get_object(Bucket=ROUTE_BUCKET, Key=route.stop_filename)['Body'].read()
             gps_data = parse_gpx_waypoints(gpx_file)
-            data['polygon'] = create_geojson_feature(gps_data)
+            data['polygon'] = create_geometry_feature(gps_data)
             data['stop_filename'] = route.stop_filename
 
-        return jsonify(data), 200
+        return json_response(data), 200
 
     return jsonify({'error': 'parameter does not exist'}), 400
 
@@ -594,20 +1142,17 @@ def search_vehicles(curr_user, page_no):
     }
 
     filters = {k:v for k,v in columns.items() if v != ""}
-    search_vehicles = search_vehicles.filter_by(**filters).paginate(page=page_no, per_page=PER_PAGE)
+    search_vehicles = search_vehicles.filter_by(**filters).options(db.joinedload(Vehicle.route)).paginate(page=page_no, per_page=PER_PAGE)
 
     if search_vehicles:
         data = []
 
         for vehicle in search_vehicles.items:
-            if not route_name:
-                route = Route.query.filter_by(id=vehicle.route_id).first()
-
             vehicle_data = {
                 'id': vehicle.id,
                 'vehicle_name': vehicle.name,
                 'date_uploaded': vehicle.date_uploaded.strftime("%b %d, %Y"),
-                'route_name': route.name
+                'route_name': vehicle.route.name
             }
 
             data.append(vehicle_data)
@@ -858,6 +1403,66 @@ def get_liveness(curr_user, id):
 
     return jsonify({'error': 'liveness does not exist'}), 400
 
+@app.route('/api/vehicle/analyze/deviation/<int:id>', methods=['GET'])
+@token_required
+def get_deviations(curr_user, id):
+    deviations = Deviation.query.filter_by(analysis_id=id).all()
+
+    if deviations:
+        data = {
+            'distance_limit': app.config.get('DEVIATION_DISTANCE', DEVIATION_DISTANCE),
+            'time_limit': app.config.get('DEVIATION_MIN_TIME', DEVIATION_MIN_TIME),
+            'deviations': []
+        }
+
+        for deviation in deviations:
+            if deviation.duration == -1:
+                continue
+
+            temp = {
+                'duration': deviation.duration,
+                'distance': round(deviation.distance, 1),
+                'lat': deviation.lat,
+                'long': deviation.long,
+                'time1': deviation.time1.strftime("%I:%M %p, %m/%d/%Y"),
+                'time2': deviation.time2.strftime("%I:%M %p, %m/%d/%Y")
+            }
+            data['deviations'].append(temp)
+
+        return jsonify(data), 200
+
+    return jsonify({'error': 'deviations does not exist'}), 400
+
+@app.route('/api/vehicle/analyze/trip/<int:id>', methods=['GET'])
+@token_required
+def get_trips(curr_user, id):
+    trips = Trip.query.filter_by(analysis_id=id).order_by(Trip.number).all()
+
+    if trips:
+        vehicle = Vehicle.query.get(id)
+
+        data = {
+            'time_limit': vehicle.analysis.liveness_time_limit,
+            'trips': []
+        }
+
+        for trip in trips:
+            temp = {
+                'number': trip.number,
+                'points': trip.points,
+                'loops': trip.loops,
+                'speeding': trip.speeding,
+                'stops': trip.stops,
+                'deviations': trip.deviations,
+                'time1': trip.time1.strftime("%I:%M %p, %m/%d/%Y"),
+                'time2': trip.time2.strftime("%I:%M %p, %m/%d/%Y")
+            }
+            data['trips'].append(temp)
+
+        return jsonify(data), 200
+
+    return jsonify({'error': 'trips does not exist'}), 400
+
 @app.route('/api/admin/cutofftime', methods=['GET'])
 @token_required
 @admin_only
@@ -889,6 +1494,7 @@ def set_cutofftime(curr_user):
         db.session.add(cut_off_time)
 
     db.session.commit()
+    set_gps_cutoff(cut_off_time.time)
 
     data = {
         'cut_off_time': cut_off_time.time.strftime('%H:%M')
@@ -900,22 +1506,7 @@ def set_cutofftime(curr_user):
 @token_required
 @admin_only
 def get_northbound_key(curr_user):
-    config_file = open(CONFIG_FILE_PATH, 'r')
-    lines = config_file.readlines()
-
-    northbound_url = ''
-    northbound_username = ''
-    northbound_password = ''
-
-    for line in lines:
-        if 'NORTHBOUND_URL' in line[1:15]:
-            northbound_url = line[19:-2]
-        elif 'NORTHBOUND_USERNAME' in line[1:21]:
-            northbound_username = line[24:-2]
-        elif 'NORTHBOUND_PASSWORD' in line[1:21]:
-            northbound_password = line[24:-2]
-
-    config_file.close()
+    northbound_url, northbound_username, northbound_password = read_northbound_config(CONFIG_FILE_PATH)
 
     return jsonify({'northbound_url': northbound_url, 'northbound_username': northbound_username, 'northbound_password': northbound_password}), 200
 
@@ -947,6 +1538,7 @@ def set_northbound_key(curr_user):
             config_file.write(line)
 
     config_file.close()
+    reset_northbound_client()
 
     return jsonify({'new_url': new_url, 'new_username': new_username, 'new_password': new_password}), 200
 
@@ -954,46 +1546,65 @@ def set_northbound_key(curr_user):
 @token_required
 @admin_only
 def northbound_connect(curr_user):
-    config_file = open(CONFIG_FILE_PATH, 'r')
-    lines = config_file.readlines()
-
-    northbound_url = ''
-    northbound_username = ''
-    northbound_password = ''
-
-    for line in lines:
-        if 'NORTHBOUND_URL' in line[1:15]:
-            northbound_url = line[19:-2]
-        elif 'NORTHBOUND_USERNAME' in line[1:21]:
-            northbound_username = line[24:-2]
-        elif 'NORTHBOUND_PASSWORD' in line[1:21]:
-            northbound_password = line[24:-2]
+    client = get_northbound_client(CONFIG_FILE_PATH)
 
-    access_token = post(northbound_url + '/login', auth=(northbound_username, northbound_password)).json()['access_token']
+    try:
+        access_token = client.access_token()
+    except NorthboundError:
+        access_token = None
 
     if access_token:
-        return jsonify({'northbound_url': northbound_url, 'access_token': access_token}), 200
+        return jsonify({'northbound_url': client.url, 'access_token': access_token}), 200
 
     return jsonify({'error': 'Cannot login to Northbound API'})
 
+def northbound_routes():
+    # routes relayed by the browser take precedence, otherwise fetch them here
+    data = request.get_json(silent=True) or {}
+
+    if 'routes' in data:
+        return data['routes']
+
+    return get_northbound_client(CONFIG_FILE_PATH).get_routes(app.config.get('NORTHBOUND_ROUTES_PATH', '/routes'))
+
+def sync_routes(list_of_routes):
+    """
+    Stores the routes that do not exist yet, together with their
+    parameters entry, in one transaction
+    Output: (inserted, unchanged) route counts
+    """
+    names = list(dict.fromkeys(str(route['route_id']) for route in list_of_routes))
+    chunks = [names[i:i + SYNC_CHUNK_SIZE] for i in range(0, len(names), SYNC_CHUNK_SIZE)]
+
+    stored_names = set()
+    for chunk in chunks:
+        stored_names.update(name for (name,) in db.session.query(Route.name).filter(Route.name.in_(chunk)))
+
+    missing_names = [name for name in names if name not in stored_names]
+
+    if missing_names:
+        db.session.bulk_insert_mappings(Route, [{'name': name} for name in missing_names])
+
+        new_routes = []
+        for i in range(0, len(missing_names), SYNC_CHUNK_SIZE):
+            chunk = missing_names[i:i + SYNC_CHUNK_SIZE]
+            new_routes += db.session.query(Route.id, Route.name).filter(Route.name.in_(chunk)).all()
+
+        db.session.bulk_insert_mappings(Parameters, [{'name': name, 'route_id': route_id} for route_id, name in new_routes])
+        db.session.commit()
+
+    return len(missing_names), len(stored_names)
+
 @app.route('/api/route/refresh', methods=['PUT'])
 @token_required
 @admin_only
 def route_refresh(curr_user):
-    list_of_routes = request.get_json()['routes']
-    
-    for route in list_of_routes:
-        stored_route = Route.query.filter_by(name=route['route_id']).first()
+    try:
+        list_of_routes = northbound_routes()
+    except NorthboundError as e:
+        return jsonify({'error': str(e)}), 502
 
-        if not stored_route:
-            new_route = Route(route['route_id'])
-
-            db.session.add(new_route)
-            db.session.commit()
-
-            new_parameter = Parameters(route['route_id'], new_route.id)
-            db.session.add(new_parameter)
-            db.session.commit()
+    inserted, unchanged = sync_routes(list_of_routes)
 
     paged_routes = Route.query.order_by(Route.name.asc()).paginate(page=1, per_page=PER_PAGE)
 
@@ -1015,7 +1626,9 @@ def route_refresh(curr_user):
             'routes': data,
             'total_rows': paged_routes.total,
             'per_page': paged_routes.per_page,
-            'curr_page': paged_routes.page
+            'curr_page': paged_routes.page,
+            'inserted': inserted,
+            'unchanged': unchanged
         }), 200
 
     return jsonify({'error': 'paged routes cannot be found'}), 200
@@ -1024,32 +1637,22 @@ def route_refresh(curr_user):
 @token_required
 @admin_only
 def parameter_refresh(curr_user):
-    list_of_routes = request.get_json()['routes']
-
-    for route in list_of_routes:
-        stored_route = Route.query.filter_by(name=route['route_id']).first()
+    try:
+        list_of_routes = northbound_routes()
+    except NorthboundError as e:
+        return jsonify({'error': str(e)}), 502
 
-        if not stored_route:
-            new_route = Route(route['route_id'])
+    inserted, unchanged = sync_routes(list_of_routes)
 
-            db.session.add(new_route)
-            db.session.commit()
-
-            new_parameter = Parameters(route['route_id'], new_route.id)
-            db.session.add(new_parameter)
-            db.session.commit()
-
-    paged_parameters = Parameters.query.order_by(Parameters.name.asc()).paginate(page=1, per_page=PER_PAGE)
+    paged_parameters = Parameters.query.options(db.joinedload(Parameters.route)).order_by(Parameters.name.asc()).paginate(page=1, per_page=PER_PAGE)
 
     if paged_parameters:
         data = []
 
         for parameter in paged_parameters.items:
-            route = Route.query.get(parameter.route_id)
-            
             parameter_data = {
                 'id': parameter.id,
-                'route_name': route.name,
+                'route_name': parameter.route.name,
                 'cell_size': parameter.cell_size if parameter.cell_size else json.dumps(None),
                 'stop_min_time': parameter.stop_min_time if parameter.stop_min_time else json.dumps(None),
                 'stop_max_time': parameter.stop_max_time if parameter.stop_max_time else json.dumps(None),
@@ -1064,7 +1667,9 @@ def parameter_refresh(curr_user):
             'parameters': data,
             'total_rows': paged_parameters.total,
             'per_page': paged_parameters.per_page,
-            'curr_page': paged_parameters.page
+            'curr_page': paged_parameters.page,
+            'inserted': inserted,
+            'unchanged': unchanged
         }), 200
     
     return jsonify({'error': 'paged parameters cannot be found'}), 400
@@ -0,0 +1,82 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.security import generate_password_hash, check_password_hash, DEFAULT_PBKDF2_ITERATIONS
+from project2 import app
+
+PASSWORD_HASH_METHOD = 'pbkdf2:sha256:260000'
+PASSWORD_SALT_LENGTH = 16
+VERIFY_WORKERS = 2
+VERIFY_QUEUE_SIZE = 32
+VERIFY_WAIT = 5
+# what Werkzeug uses for scrypt:<n>:<r>:<p> without the numbers
+SCRYPT_DEFAULTS = (2 ** 15, 8, 1)
+
+class LoginBusy(Exception):
+    pass
+
+def password_hash_method():
+    return app.config.get('PASSWORD_HASH_METHOD', PASSWORD_HASH_METHOD)
+
+def hash_password(password, method=None):
+    """
+    Hashes with the configured method, e.g. pbkdf2:sha256:<iterations>
+    or scrypt:<n>:<r>:<p> where Werkzeug supports it
+    """
+    return generate_password_hash(password, method=method or password_hash_method(), salt_length=app.config.get('PASSWORD_SALT_LENGTH', PASSWORD_SALT_LENGTH))
+
+def hash_settings(method):
+    """
+    (algorithm, digest or costs...) of a Werkzeug method string, with
+    the numbers Werkzeug fills in when they are left out, so
+    'pbkdf2:sha256' and 'pbkdf2:sha256:<default iterations>' compare
+    equal
+    """
+    name, *args = method.split(':')
+
+    if name == 'pbkdf2':
+        digest = args[0] if args and args[0] else 'sha256'
+        iterations = int(args[1]) if len(args) > 1 and args[1] else DEFAULT_PBKDF2_ITERATIONS
+        return (name, digest, iterations)
+
+    if name == 'scrypt':
+        costs = [int(arg) if arg else default for arg, default in zip(args, SCRYPT_DEFAULTS)]
+        return (name, *costs, *SCRYPT_DEFAULTS[len(costs):])
+
+    return (name, *args)
+
+def needs_rehash(pwhash):
+    return hash_settings(pwhash.split('$', 1)[0]) != hash_settings(password_hash_method())
+
+def check_and_rehash(pwhash, password):
+    if not check_password_hash(pwhash, password):
+        return False, None
+
+    if needs_rehash(pwhash):
+        return True, hash_password(password)
+
+    return True, None
+
+# hashing is deliberately slow, keep it off the request threads and
+# bound how many logins may queue up behind it
+_executor = ThreadPoolExecutor(max_workers=app.config.get('PASSWORD_VERIFY_WORKERS', VERIFY_WORKERS), thread_name_prefix='password-verify')
+_slots = threading.BoundedSemaphore(app.config.get('PASSWORD_VERIFY_WORKERS', VERIFY_WORKERS) + app.config.get('PASSWORD_VERIFY_QUEUE_SIZE', VERIFY_QUEUE_SIZE))
+
+def verify_password(pwhash, password):
+    """
+    Verifies {password} on the hashing pool
+    Output: (valid, new_hash), new_hash is set when the stored
+            hash uses an outdated method and should be replaced
+    Raises LoginBusy when the pool queue is full
+    """
+    if not _slots.acquire(timeout=app.config.get('PASSWORD_VERIFY_WAIT', VERIFY_WAIT)):
+        raise LoginBusy()
+
+    try:
+        future = _executor.submit(check_and_rehash, pwhash, password)
+    except Exception:
+        _slots.release()
+        raise
+
+    future.add_done_callback(lambda f: _slots.release())
+
+    return future.result()
@@ -0,0 +1,168 @@
+import math
+import numpy as np
+
+EARTH_RADIUS_M = 6371008.8
+NODE_SIZE = 16
+QUERY_CHUNK = 4096
+
+def str_order(x, y, node_size):
+    """
+    Sort-Tile-Recursive order of entries centred at {x}, {y}:
+    vertical slices by x, each sorted by y, so that every run of
+    {node_size} entries is a compact tile
+    """
+    nodes = math.ceil(len(x) / node_size)
+    per_slice = math.ceil(math.sqrt(nodes)) * node_size
+
+    order = np.argsort(x, kind='stable')
+    for start in range(0, len(order), per_slice):
+        part = order[start:start + per_slice]
+        order[start:start + per_slice] = part[np.argsort(y[part], kind='stable')]
+
+    return order
+
+class SegmentIndex():
+    """
+    STR-packed R-tree over the segments of a path. Coordinates are
+    projected to meters around the path's mean latitude, which is
+    accurate to well under a percent over the extent of a city.
+    levels[0] holds the segments, each level above holds the
+    bounding boxes of runs of NODE_SIZE entries of the level below,
+    up to a single root.
+    """
+    __slots__ = ('lat0', 'lon0', 'scale', 'segment', 'x1', 'y1', 'dx', 'dy', 'inverse_length', 'levels', 'node_size')
+
+    def __init__(self, latitude, longitude, node_size=NODE_SIZE):
+        latitude = np.asarray(latitude, dtype=np.float64)
+        longitude = np.asarray(longitude, dtype=np.float64)
+        valid = ~(np.isnan(latitude) | np.isnan(longitude))
+        latitude, longitude = latitude[valid], longitude[valid]
+
+        if not len(latitude):
+            raise ValueError('path has no points')
+
+        self.node_size = node_size
+        self.lat0 = float(latitude.mean())
+        self.lon0 = float(longitude.mean())
+        self.scale = math.cos(math.radians(self.lat0))
+
+        x, y = self.project(latitude, longitude)
+        # a single point is a segment of length zero
+        if len(x) == 1:
+            x, y = np.repeat(x, 2), np.repeat(y, 2)
+
+        x1, y1, x2, y2 = x[:-1], y[:-1], x[1:], y[1:]
+        order = str_order((x1 + x2) / 2, (y1 + y2) / 2, node_size)
+
+        # segment i runs from path point i to i + 1 of the valid points
+        self.segment = order
+        self.x1, self.y1 = x1[order], y1[order]
+        self.dx, self.dy = (x2 - x1)[order], (y2 - y1)[order]
+        length = self.dx ** 2 + self.dy ** 2
+        self.inverse_length = np.divide(1.0, length, out=np.zeros_like(length), where=length > 0)
+
+        boxes = (
+            np.minimum(self.x1, self.x1 + self.dx), np.minimum(self.y1, self.y1 + self.dy),
+            np.maximum(self.x1, self.x1 + self.dx), np.maximum(self.y1, self.y1 + self.dy)
+        )
+        self.levels = [boxes + (None,)]
+
+        while len(boxes[0]) > 1 or len(self.levels) == 1:
+            starts = np.arange(0, len(boxes[0]), node_size)
+            parents = (
+                np.minimum.reduceat(boxes[0], starts), np.minimum.reduceat(boxes[1], starts),
+                np.maximum.reduceat(boxes[2], starts), np.maximum.reduceat(boxes[3], starts)
+            )
+            order = str_order((parents[0] + parents[2]) / 2, (parents[1] + parents[3]) / 2, node_size)
+            boxes = tuple(side[order] for side in parents)
+            self.levels.append(boxes + (starts[order],))
+
+    def __len__(self):
+        return len(self.segment)
+
+    def project(self, latitude, longitude):
+        x = np.radians(np.asarray(longitude, dtype=np.float64) - self.lon0) * EARTH_RADIUS_M * self.scale
+        y = np.radians(np.asarray(latitude, dtype=np.float64) - self.lat0) * EARTH_RADIUS_M
+        return x, y
+
+    def children(self, level, nodes):
+        """
+        Entries of level - 1 under {nodes} of {level}, as a
+        (len(nodes), node_size) array and a mask of the real ones
+        """
+        below = len(self.levels[level - 1][0])
+        child = self.levels[level][4][nodes][:, None] + np.arange(self.node_size)
+        valid = child < below
+        return np.minimum(child, below - 1), valid
+
+    def box_distances(self, x, y, level, entries, valid):
+        minx, miny, maxx, maxy = (side[entries] for side in self.levels[level][:4])
+        dx = np.maximum(np.maximum(minx - x, x - maxx), 0)
+        dy = np.maximum(np.maximum(miny - y, y - maxy), 0)
+        return np.where(valid, np.hypot(dx, dy), np.inf)
+
+    def segment_distances(self, x, y, entries, valid):
+        x1, y1, dx, dy = self.x1[entries], self.y1[entries], self.dx[entries], self.dy[entries]
+        t = np.clip(((x - x1) * dx + (y - y1) * dy) * self.inverse_length[entries], 0, 1)
+        return np.where(valid, np.hypot(x - x1 - t * dx, y - y1 - t * dy), np.inf)
+
+    def nearest(self, latitude, longitude):
+        """
+        Input:  latitude, longitude (arrays of fixes)
+        Output: distance in meters from each fix to the path and the
+                nearest segment (i joins path points i and i + 1),
+                NaN and -1 for fixes without coordinates
+        """
+        x, y = self.project(latitude, longitude)
+        distance = np.full(len(x), np.nan)
+        segment = np.full(len(x), -1, dtype=np.int64)
+
+        known = np.flatnonzero(~(np.isnan(x) | np.isnan(y)))
+        for start in range(0, len(known), QUERY_CHUNK):
+            fixes = known[start:start + QUERY_CHUNK]
+            distance[fixes], segment[fixes] = self.query(x[fixes], y[fixes])
+
+        return distance, segment
+
+    def query(self, x, y):
+        top = len(self.levels) - 1
+        rows = np.arange(len(x))
+
+        # one greedy descent per fix gives a segment, and its
+        # distance bounds the search below
+        nodes = np.zeros(len(x), dtype=np.int64)
+        for level in range(top, 1, -1):
+            child, valid = self.children(level, nodes)
+            nodes = child[rows, np.argmin(self.box_distances(x[:, None], y[:, None], level - 1, child, valid), axis=1)]
+        child, valid = self.children(1, nodes)
+        bound = self.segment_distances(x[:, None], y[:, None], child, valid).min(axis=1)
+        # box and segment distances round differently, keep ties
+        bound += 1e-9 * bound + 1e-6
+
+        # then every branch that could hold a closer segment, all
+        # fixes one level at a time
+        fixes, nodes = rows, np.zeros(len(x), dtype=np.int64)
+        for level in range(top, 1, -1):
+            child, valid = self.children(level, nodes)
+            distance = self.box_distances(x[fixes, None], y[fixes, None], level - 1, child, valid)
+            keep = distance <= bound[fixes, None]
+            fixes, nodes = np.broadcast_to(fixes[:, None], keep.shape)[keep], child[keep]
+
+        child, valid = self.children(1, nodes)
+        distance = self.segment_distances(x[fixes, None], y[fixes, None], child, valid)
+        best = np.argmin(distance, axis=1)
+        distance = distance[np.arange(len(fixes)), best]
+        entries = child[np.arange(len(fixes)), best]
+
+        # closest candidate per fix: sort by fix, then distance
+        order = np.lexsort((distance, fixes))
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = fixes[order][1:] != fixes[order][:-1]
+        order = order[first]
+
+        nearest = np.full(len(x), np.inf)
+        entry = np.zeros(len(x), dtype=np.int64)
+        nearest[fixes[order]] = distance[order]
+        entry[fixes[order]] = entries[order]
+
+        return nearest, self.segment[entry]
@@ -0,0 +1,108 @@
+import time
+import pickle
+from collections import OrderedDict
+from multiprocessing import shared_memory
+import numpy as np
+from project2.analysis import Trajectory, ANALYSIS_STAGES
+
+# the worker side of project2.executor. Workers are spawned and import
+# this module and project2.analysis, not the routes, the models or the
+# S3 client (see project2/__init__.py)
+
+TRAJECTORY_FIELDS = ('latitude', 'longitude', 'elevation', 'timestamp', 'speed')
+
+class SharedTrajectory():
+    """
+    A Trajectory copied once into a shared memory block. Workers get
+    handle(), a few names and numbers, instead of a pickled copy of
+    the fixes, and map the arrays in place.
+    """
+    def __init__(self, gps_data):
+        self.length = len(gps_data)
+        self.tzinfo = gps_data.tzinfo
+        self.memory = shared_memory.SharedMemory(create=True, size=max(len(TRAJECTORY_FIELDS) * self.length * 8, 1))
+
+        block = np.ndarray((len(TRAJECTORY_FIELDS), self.length), dtype=np.float64, buffer=self.memory.buf)
+        for row, field in zip(block, TRAJECTORY_FIELDS):
+            row[:] = getattr(gps_data, field)
+        del block, row
+
+    def handle(self):
+        return (self.memory.name, self.length, self.tzinfo)
+
+    def release(self):
+        self.memory.close()
+        self.memory.unlink()
+
+def attach_trajectory(handle):
+    name, length, tzinfo = handle
+    memory = shared_memory.SharedMemory(name=name)
+    block = np.ndarray((len(TRAJECTORY_FIELDS), length), dtype=np.float64, buffer=memory.buf)
+    return memory, Trajectory(*block, tzinfo)
+
+class SharedRouteGrid():
+    """
+    A route grid pickled once into a shared memory block. Tasks carry
+    handle(), and a worker only unpickles the block the first time it
+    sees the grid's build. A worker keeps the last {cache_size}.
+    """
+    def __init__(self, route_grid, cache_size):
+        body = pickle.dumps(route_grid, protocol=pickle.HIGHEST_PROTOCOL)
+        self.build = route_grid['build']
+        self.cache_size = cache_size
+        self.size = len(body)
+        self.memory = shared_memory.SharedMemory(create=True, size=max(self.size, 1))
+        self.memory.buf[:self.size] = body
+
+    def handle(self):
+        return (self.build, self.memory.name, self.size, self.cache_size)
+
+    def release(self):
+        self.memory.close()
+        self.memory.unlink()
+
+# the route grids a worker process has unpickled, by build
+worker_route_grids = OrderedDict()
+
+def attach_route_grid(handle):
+    build, name, size, cache_size = handle
+    route_grid = worker_route_grids.get(build)
+    if route_grid is not None:
+        worker_route_grids.move_to_end(build)
+        return route_grid
+
+    memory = shared_memory.SharedMemory(name=name)
+    try:
+        route_grid = pickle.loads(bytes(memory.buf[:size]))
+    finally:
+        memory.close()
+
+    worker_route_grids[build] = route_grid
+    while len(worker_route_grids) > cache_size:
+        worker_route_grids.popitem(last=False)
+    return route_grid
+
+def run_stage(name, handle, parameters, grid_handle):
+    """
+    Runs in a worker process. The result holds plain values only,
+    so nothing refers to the shared block once it is closed.
+    """
+    route_grid = attach_route_grid(grid_handle)
+    memory, gps_data = attach_trajectory(handle)
+    start_wall = time.perf_counter()
+    start_cpu = time.process_time()
+
+    try:
+        result = ANALYSIS_STAGES[name](gps_data, parameters, route_grid)
+    finally:
+        del gps_data
+        memory.close()
+
+    record = {
+        'stage': name,
+        'wall_seconds': time.perf_counter() - start_wall,
+        'cpu_seconds': time.process_time() - start_cpu,
+        'peak_bytes': None,
+        'counts': {'points': handle[1]}
+    }
+    return result, record
@@ -0,0 +1,363 @@
+import math
+import struct
+from datetime import timezone, timedelta
+import numpy as np
+from botocore.exceptions import ClientError
+from project2 import app, db
+from project2.models import Vehicle, VehicleVisit, TrackPart
+from project2.metrics import stage
+from project2.api import Trajectory, concatenate_trajectories, fence_membership, to_datetime
+
+TRACK_MAGIC = b'P2TRACK1'
+TRACK_HEADER = struct.Struct('<8sqd')
+TRACK_FIELDS = ('timestamp', 'latitude', 'longitude', 'elevation', 'speed')
+RECORD_SIZE = 8 * len(TRACK_FIELDS)
+
+VISIT_CELL_DEGREES = 0.01
+VISIT_COLUMNS = int(round(360 / VISIT_CELL_DEGREES))
+VISIT_ROWS = int(round(180 / VISIT_CELL_DEGREES))
+VISIT_BUCKET_SECONDS = 3600
+VISIT_SPAN_GAP = 64
+VISIT_MAX_DEGREES = 1.0
+TRACK_MAX_PARTS = 32
+
+def encode_track(gps_data):
+    """
+    A 24 byte header (magic, number of fixes, UTC offset in seconds
+    or NaN) and one little-endian float64 record per fix, in
+    TRACK_FIELDS order and sorted by time, so fixes i .. j - 1 are
+    one byte range
+    """
+    order = np.argsort(gps_data.timestamp, kind='stable')
+    utcoffset = math.nan if gps_data.tzinfo is None else gps_data.tzinfo.utcoffset(None).total_seconds()
+
+    records = np.empty((len(gps_data), len(TRACK_FIELDS)), dtype='<f8')
+    for column, field in enumerate(TRACK_FIELDS):
+        records[:, column] = getattr(gps_data, field)[order]
+
+    return TRACK_HEADER.pack(TRACK_MAGIC, len(gps_data), utcoffset) + records.tobytes()
+
+def decode_records(body, tzinfo):
+    records = np.frombuffer(body, dtype='<f8').reshape(-1, len(TRACK_FIELDS))
+    fields = dict(zip(TRACK_FIELDS, records.T))
+    return Trajectory(fields['latitude'], fields['longitude'], fields['elevation'], fields['timestamp'], fields['speed'], tzinfo)
+
+def decode_header(body):
+    magic, length, utcoffset = TRACK_HEADER.unpack(body[:TRACK_HEADER.size])
+    if magic != TRACK_MAGIC:
+        raise ValueError('not a track file')
+
+    tzinfo = None if math.isnan(utcoffset) else timezone(timedelta(seconds=utcoffset))
+    return length, tzinfo
+
+def visit_rows(latitude):
+    return np.floor((np.asarray(latitude, dtype=np.float64) + 90) / VISIT_CELL_DEGREES).astype(np.int64)
+
+def visit_columns(longitude):
+    return np.floor((np.asarray(longitude, dtype=np.float64) + 180) / VISIT_CELL_DEGREES).astype(np.int64)
+
+def visit_cells(latitude, longitude):
+    return visit_rows(latitude) * VISIT_COLUMNS + visit_columns(longitude)
+
+def visit_buckets(gps_data, offset=0):
+    """
+    Input:  gps_data (Trajectory sorted by time, as in the track file)
+            offset, the track index of gps_data's first fix
+    Output: list of (cell, hour, index1, index2, points), one per
+            grid cell and hour the fixes fall in; index1 .. index2
+            spans every fix of that cell in that hour
+    """
+    known = np.flatnonzero(~(np.isnan(gps_data.timestamp) | np.isnan(gps_data.latitude) | np.isnan(gps_data.longitude)))
+    if not len(known):
+        return []
+
+    cell = visit_cells(gps_data.latitude[known], gps_data.longitude[known])
+    hour = np.floor(gps_data.timestamp[known] / VISIT_BUCKET_SECONDS).astype(np.int64)
+    key = hour * (VISIT_ROWS * VISIT_COLUMNS) + cell
+
+    keys, first, points = np.unique(key, return_index=True, return_counts=True)
+    last = len(key) - 1 - np.unique(key[::-1], return_index=True)[1]
+
+    return list(zip(
+        (keys % (VISIT_ROWS * VISIT_COLUMNS)).tolist(),
+        (keys // (VISIT_ROWS * VISIT_COLUMNS)).tolist(),
+        (known[first] + offset).tolist(),
+        (known[last] + offset).tolist(),
+        points.tolist()
+    ))
+
+def merge_spans(spans, gap=VISIT_SPAN_GAP):
+    """
+    Sorted, merged (start, stop) index ranges, joining ranges less
+    than {gap} fixes apart so they are read in one request
+    """
+    merged = []
+    for start, stop in sorted(spans):
+        if merged and start <= merged[-1][1] + gap:
+            merged[-1][1] = max(merged[-1][1], stop)
+        else:
+            merged.append([start, stop])
+    return merged
+
+class TrackStore():
+    """
+    A binary copy of each vehicle's whole track next to its GPX
+    upload, read back a byte range at a time, and the visit index
+    (grid cell x hour -> fixes) over it. Appended segments are
+    stored as part objects after the track (TrackPart rows say where
+    they start), so an append writes only the new fixes; the parts
+    are folded back into one object every TRACK_MAX_PARTS appends.
+    """
+    def __init__(self, s3, bucket):
+        self.s3 = s3
+        self.bucket = bucket
+
+    def key(self, vehicle):
+        return f"{vehicle.filename.rsplit('.', 1)[0]}.track"
+
+    def part_key(self, vehicle, offset):
+        return f'{self.key(vehicle)}.{offset}'
+
+    def parts(self, vehicle):
+        return TrackPart.query.filter_by(vehicle_id=vehicle.id).order_by(TrackPart.offset).all()
+
+    def get_object(self, key, byte_range=None):
+        with stage('s3_download') as record:
+            if byte_range is None:
+                body = self.s3.get_object(Bucket=self.bucket, Key=key)['Body'].read()
+            else:
+                body = self.s3.get_object(Bucket=self.bucket, Key=key, Range='bytes=%d-%d' % byte_range)['Body'].read()
+            record['bytes'] = len(body)
+        return body
+
+    def put_object(self, key, gps_data):
+        with stage('s3_upload'):
+            self.s3.put_object(Body=encode_track(gps_data), Bucket=self.bucket, Key=key)
+
+    def put(self, vehicle, gps_data):
+        """
+        Stores {gps_data} as the whole track, dropping any parts
+        """
+        self.put_object(self.key(vehicle), gps_data)
+
+        for part in self.parts(vehicle):
+            self.s3.delete_object(Bucket=self.bucket, Key=self.part_key(vehicle, part.offset))
+            db.session.delete(part)
+
+    def read(self, vehicle):
+        """
+        The whole track, or None if it has not been stored yet
+        """
+        try:
+            body = self.get_object(self.key(vehicle))
+        except ClientError:
+            return None
+
+        length, tzinfo = decode_header(body)
+        bodies = [body[TRACK_HEADER.size:TRACK_HEADER.size + length * RECORD_SIZE]]
+        for part in self.parts(vehicle):
+            bodies.append(self.get_object(self.part_key(vehicle, part.offset))[TRACK_HEADER.size:])
+
+        return decode_records(b''.join(bodies), tzinfo)
+
+    def header(self, vehicle):
+        """
+        (number of fixes, tzinfo) of the stored track, or None if it
+        has not been stored yet
+        """
+        try:
+            length, tzinfo = decode_header(self.get_object(self.key(vehicle), (0, TRACK_HEADER.size - 1)))
+        except ClientError:
+            return None
+
+        return length + sum(part.length for part in self.parts(vehicle)), tzinfo
+
+    def read_slice(self, vehicle, start, stop, tzinfo=None):
+        """
+        Fixes start .. stop - 1 of the time sorted track, one ranged
+        request per object the slice touches
+        """
+        parts = self.parts(vehicle) if stop > start else []
+        objects = [(self.key(vehicle), 0, parts[0].offset if parts else math.inf)]
+        objects += [(self.part_key(vehicle, part.offset), part.offset, part.offset + part.length) for part in parts]
+
+        bodies = []
+        for key, offset, end in objects:
+            first, last = max(start, offset), min(stop, end)
+            if first < last:
+                byte = TRACK_HEADER.size + (first - offset) * RECORD_SIZE
+                bodies.append(self.get_object(key, (byte, byte + (last - first) * RECORD_SIZE - 1)))
+
+        return decode_records(b''.join(bodies), tzinfo)
+
+    def window(self, vehicle, time1, time2, tzinfo=None):
+        """
+        The fixes between epoch seconds time1 and time2. The visit
+        index narrows the track down to the hours of the window, a
+        binary search over the timestamps of that slice finds the
+        exact ends.
+        """
+        hour1, hour2 = math.floor(time1 / VISIT_BUCKET_SECONDS), math.floor(time2 / VISIT_BUCKET_SECONDS)
+        start, stop = db.session.query(db.func.min(VehicleVisit.index1), db.func.max(VehicleVisit.index2)).filter(
+            VehicleVisit.vehicle_id == vehicle.id, VehicleVisit.hour.between(hour1, hour2)
+        ).one()
+
+        if start is None:
+            return self.read_slice(vehicle, 0, 0, tzinfo)
+
+        track = self.read_slice(vehicle, start, stop + 1, tzinfo)
+        first = np.searchsorted(track.timestamp, time1, side='left')
+        last = np.searchsorted(track.timestamp, time2, side='right')
+
+        return track[first:last]
+
+    def copy(self, source, vehicle):
+        """
+        Gives {vehicle} a copy of {source}'s track and index, for an
+        upload with the same content. The objects are copied within
+        S3. Returns False if {source} has no stored track.
+        """
+        parts = self.parts(source)
+        try:
+            with stage('s3_copy'):
+                self.s3.copy_object(CopySource={'Bucket': self.bucket, 'Key': self.key(source)}, Bucket=self.bucket, Key=self.key(vehicle))
+                for part in parts:
+                    self.s3.copy_object(CopySource={'Bucket': self.bucket, 'Key': self.part_key(source, part.offset)}, Bucket=self.bucket, Key=self.part_key(vehicle, part.offset))
+        except ClientError:
+            return False
+
+        rows = VehicleVisit.query.filter_by(vehicle_id=source.id).with_entities(
+            VehicleVisit.cell, VehicleVisit.hour, VehicleVisit.index1, VehicleVisit.index2, VehicleVisit.points
+        ).all()
+        VehicleVisit.query.filter_by(vehicle_id=vehicle.id).delete()
+        TrackPart.query.filter_by(vehicle_id=vehicle.id).delete()
+        db.session.bulk_insert_mappings(VehicleVisit, [
+            {'vehicle_id': vehicle.id, 'cell': cell, 'hour': hour, 'index1': index1, 'index2': index2, 'points': points}
+            for cell, hour, index1, index2, points in rows
+        ])
+        for part in parts:
+            db.session.add(TrackPart(vehicle.id, part.offset, part.length))
+        db.session.commit()
+
+        return True
+
+    def index(self, vehicle, gps_data):
+        """
+        Stores {gps_data} as the vehicle's whole track and indexes it
+        from scratch
+        """
+        VehicleVisit.query.filter_by(vehicle_id=vehicle.id).delete()
+        self.put(vehicle, gps_data)
+
+        order = np.argsort(gps_data.timestamp, kind='stable')
+        with stage('visit_index') as record:
+            buckets = visit_buckets(gps_data.take(order))
+            record['rows'] = len(buckets)
+
+        db.session.bulk_insert_mappings(VehicleVisit, [
+            {'vehicle_id': vehicle.id, 'cell': cell, 'hour': hour, 'index1': index1, 'index2': index2, 'points': points}
+            for cell, hour, index1, index2, points in buckets
+        ])
+        db.session.commit()
+
+    def extend(self, vehicle, gps_data):
+        """
+        Appends {gps_data}, which must start after the stored track
+        ends, to the track and the index. Only the new fixes are
+        written, as a part object. Returns False if there is no
+        stored track to extend.
+        """
+        header = self.header(vehicle)
+        if header is None:
+            return False
+
+        length = header[0]
+        # fixes without a time sort last and would end up mid track
+        if length and np.isnan(self.read_slice(vehicle, length - 1, length).timestamp[-1]):
+            return False
+
+        if len(self.parts(vehicle)) >= app.config.get('TRACK_MAX_PARTS', TRACK_MAX_PARTS):
+            self.put(vehicle, concatenate_trajectories([self.read(vehicle), gps_data]))
+        else:
+            self.put_object(self.part_key(vehicle, length), gps_data)
+            db.session.add(TrackPart(vehicle.id, length, len(gps_data)))
+
+        with stage('visit_index') as record:
+            buckets = visit_buckets(gps_data, offset=length)
+            record['rows'] = len(buckets)
+
+        # only the hour the old track ended in can have rows already
+        hours = {bucket[1] for bucket in buckets}
+        existing = {}
+        if hours:
+            rows = VehicleVisit.query.filter_by(vehicle_id=vehicle.id).filter(VehicleVisit.hour == min(hours)).all()
+            existing = {(row.cell, row.hour): row for row in rows}
+
+        for cell, hour, index1, index2, points in buckets:
+            row = existing.get((cell, hour))
+            if row is not None:
+                row.index2 = index2
+                row.points += points
+            else:
+                db.session.add(VehicleVisit(vehicle.id, cell, hour, index1, index2, points))
+        db.session.commit()
+
+        return True
+
+    def visits(self, point1, point2, time1, time2, route_names=None):
+        """
+        Vehicles with fixes inside the box from point1 (top left) to
+        point2 (bottom right) between epoch seconds time1 and time2,
+        only on {route_names} unless it is None. Only the index and the
+        slices of track it points to are read.
+        Output: list of (vehicle, visits) by vehicle id, each visit a
+                dict of entry and exit time and number of fixes
+        """
+        row1, row2 = visit_rows([point2.lat, point1.lat]).tolist()
+        column1, column2 = visit_columns([point1.lon, point2.lon]).tolist()
+        hour1, hour2 = math.floor(time1 / VISIT_BUCKET_SECONDS), math.floor(time2 / VISIT_BUCKET_SECONDS)
+
+        # cell numbers run row by row: one range over the rows the box
+        # covers, then the columns inside it
+        query = VehicleVisit.query.filter(
+            VehicleVisit.cell.between(row1 * VISIT_COLUMNS + column1, row2 * VISIT_COLUMNS + column2),
+            (VehicleVisit.cell % VISIT_COLUMNS).between(column1, column2),
+            VehicleVisit.hour.between(hour1, hour2)
+        )
+        if route_names is not None:
+            query = query.join(Vehicle, Vehicle.id == VehicleVisit.vehicle_id).filter(Vehicle.route_name.in_(route_names))
+        rows = query.all()
+
+        spans = {}
+        for row in rows:
+            spans.setdefault(row.vehicle_id, []).append((row.index1, row.index2 + 1))
+
+        results = []
+        if not spans:
+            return results
+
+        for vehicle in Vehicle.query.filter(Vehicle.id.in_(list(spans))).order_by(Vehicle.id).all():
+            tzinfo = self.header(vehicle)[1]
+            visits = []
+
+            for start, stop in merge_spans(spans[vehicle.id]):
+                track = self.read_slice(vehicle, start, stop, tzinfo)
+                timestamp = track.timestamp
+                inside = fence_membership(track.latitude, track.longitude, [(point1, point2)])[0] & (timestamp >= time1) & (timestamp <= time2)
+                index = np.flatnonzero(inside)
+                if not len(index):
+                    continue
+
+                # a fix outside the box or window ends a visit
+                breaks = np.flatnonzero(np.diff(index) > 1)
+                for first, last in zip(np.concatenate([[0], breaks + 1]).tolist(), np.concatenate([breaks, [len(index) - 1]]).tolist()):
+                    visits.append({
+                        'time1': to_datetime(float(timestamp[index[first]]), tzinfo),
+                        'time2': to_datetime(float(timestamp[index[last]]), tzinfo),
+                        'points': last - first + 1
+                    })
+
+            if visits:
+                results.append((vehicle, visits))
+
+        return results
@@ -0,0 +1,132 @@
+import io
+import re
+import datetime
+import jwt
+import pytest
+from botocore.exceptions import ClientError
+from benchmarks import gpx_generator
+from project2 import app, db
+from project2 import routes
+from project2.models import User, Route
+from project2.api import parse_gpx_file, parse_gpx_waypoints, build_route_grid
+
+class MemoryS3():
+    """
+    The parts of the boto3 S3 client the app uses, over a dict
+    """
+    def __init__(self):
+        self.objects = {}
+        self.requests = []
+
+    def put_object(self, Body, Bucket, Key, **kwargs):
+        self.objects[(Bucket, Key)] = Body.encode() if isinstance(Body, str) else Body
+        return {}
+
+    def get_object(self, Bucket, Key, Range=None, **kwargs):
+        if (Bucket, Key) not in self.objects:
+            raise ClientError({'Error': {'Code': 'NoSuchKey'}}, 'GetObject')
+
+        self.requests.append((Key, Range))
+        body = self.objects[(Bucket, Key)]
+        if Range:
+            first, last = map(int, re.match(r'bytes=(\d+)-(\d+)', Range).groups())
+            body = body[first:last + 1]
+        return {'Body': io.BytesIO(body)}
+
+    def copy_object(self, Bucket, Key, CopySource, **kwargs):
+        source = (CopySource['Bucket'], CopySource['Key'])
+        if source not in self.objects:
+            raise ClientError({'Error': {'Code': 'NoSuchKey'}}, 'CopyObject')
+
+        self.objects[(Bucket, Key)] = self.objects[source]
+        return {}
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        self.objects.pop((Bucket, Key), None)
+        return {}
+
+class ApiClient():
+    """
+    Test client signed in as {username}, with the requests the
+    tests repeat
+    """
+    def __init__(self, client, username):
+        self.client = client
+        token = jwt.encode({'username': username, 'exp': datetime.datetime.utcnow() + datetime.timedelta(hours=1)}, app.config['SECRET_KEY'])
+        self.headers = {'X-Access-Token': token}
+
+    def get(self, url, **kwargs):
+        return self.client.get(url, headers=self.headers, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.client.post(url, headers=self.headers, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.client.put(url, headers=self.headers, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.client.delete(url, headers=self.headers, **kwargs)
+
+    def setup_route(self, name='R1', cell_size=0.1):
+        self.post('/api/route', json={'name': name})
+        route = Route.query.filter_by(name=name).first()
+        self.post('/api/parameter', json={'name': name})
+
+        corners = gpx_generator.stop_corners(8)
+        csv = 'stop,lat1,long1,lat2,long2\n' + ''.join('s,%f,%f,%f,%f\n' % (a[0], a[1], b[0], b[1]) for a, b in zip(corners[0::2], corners[1::2]))
+        self.put(f'/api/route/{route.id}', data={
+            'ref_file': (io.BytesIO(gpx_generator.to_gpx(gpx_generator.route_points())), f'ref_{name}.gpx'),
+            'stop_file': (io.BytesIO(csv.encode()), f'stops_{name}.csv')
+        }, content_type='multipart/form-data')
+        self.put(f'/api/parameter/{route.parameters.id}', json={
+            'cell_size': cell_size, 'stop_min_time': 30, 'stop_max_time': 120,
+            'speeding_time_limit': 30, 'speeding_speed_limit': 40, 'liveness_time_limit': 300
+        })
+        return route
+
+    def upload(self, name, points, route='R1', filename=None):
+        return self.post('/api/vehicle', data={
+            'vehicle_name': name, 'route_name': route, 'date': '2021-03-01',
+            'gpx_file': (io.BytesIO(gpx_generator.to_gpx(points)), filename or f'{name}.gpx')
+        }, content_type='multipart/form-data')
+
+    def append(self, vehicle_id, points):
+        return self.post(f'/api/vehicle/{vehicle_id}/segment', data={
+            'gpx_file': (io.BytesIO(gpx_generator.to_gpx(points)), 'segment.gpx')
+        }, content_type='multipart/form-data')
+
+@pytest.fixture(scope='session')
+def route_grid():
+    gps_data_route = parse_gpx_file(gpx_generator.to_gpx(gpx_generator.route_points()))
+    stops = parse_gpx_waypoints(gpx_generator.to_waypoints_gpx(gpx_generator.stop_corners(8)))
+    return build_route_grid(gps_data_route, stops, 0.1)
+
+@pytest.fixture
+def s3(monkeypatch):
+    memory = MemoryS3()
+    monkeypatch.setattr(routes, 's3', memory)
+    monkeypatch.setattr(routes.track_store, 's3', memory)
+    return memory
+
+@pytest.fixture
+def api(tmp_path, monkeypatch, s3):
+    """
+    An admin ApiClient on an empty database, with analysis inline
+    """
+    monkeypatch.setitem(app.config, 'SQLALCHEMY_DATABASE_URI', f'sqlite:///{tmp_path}/test.db')
+    monkeypatch.setitem(app.config, 'ANALYSIS_WORKERS', 0)
+
+    with app.app_context():
+        db.create_all()
+        db.session.add(User('admin', 'password', True))
+        db.session.add(User('viewer', 'password', False, 'R1'))
+        db.session.commit()
+
+        yield ApiClient(app.test_client(), 'admin')
+
+        db.session.remove()
+        db.drop_all()
+
+@pytest.fixture
+def viewer(api):
+    return ApiClient(api.client, 'viewer')
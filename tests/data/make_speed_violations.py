@@ -0,0 +1,117 @@
+"""
+Writes speed_violations.json: tracks built from datetimes, as parsing
+a GPX file builds them, and the violations the per-fix loop
+compute_speed_violation had before it was vectorized finds in them.
+Run from the repository root:
+    python -m tests.data.make_speed_violations
+"""
+import json
+import os
+import subprocess
+import types
+from datetime import datetime, timezone, timedelta
+import numpy as np
+from haversine import haversine
+from benchmarks import gpx_generator
+
+BASELINE = 'e2c2f30^'
+TYPES = ('Explicit', 'Location')
+SPEED_LIMITS = (20, 40, 60)
+TIMES = (10, 30, 60)
+
+def baseline_api():
+    source = subprocess.run(['git', 'show', f'{BASELINE}:project2/api.py'], capture_output=True, text=True, check=True).stdout
+    module = types.ModuleType('baseline_api')
+    exec(compile(source, 'baseline_api.py', 'exec'), module.__dict__)
+    return module
+
+def make_case(api, name, gps_data):
+    case = {
+        'name': name,
+        'utcoffset': gps_data.tzinfo.utcoffset(None).total_seconds(),
+        'latitude': gps_data.latitude.tolist(),
+        'longitude': gps_data.longitude.tolist(),
+        'timestamp': gps_data.timestamp.tolist(),
+        'speed': gps_data.speed.tolist(),
+        'expected': []
+    }
+
+    for type in TYPES:
+        for speed_limit in SPEED_LIMITS:
+            for time in TIMES:
+                try:
+                    violations = api.compute_speed_violation(gps_data, type, speed_limit, time)
+                except ZeroDivisionError:
+                    # two fixes at the same time, the loop had no answer
+                    continue
+
+                for violation in violations:
+                    violation['time1'] = violation['time1'].isoformat()
+                    violation['time2'] = violation['time2'].isoformat()
+                case['expected'].append({'type': type, 'speed_limit': speed_limit, 'time': time, 'violations': violations})
+
+    return case
+
+def random_points(rng, trial):
+    """
+    A random walk with fixes 1 to 20 seconds apart, some with
+    microseconds, some without a time and some out of order
+    """
+    n = int(rng.integers(2, 80))
+    tzinfo = timezone(timedelta(hours=8)) if trial % 4 == 0 else timezone.utc
+    steps = rng.integers(1, 20, n) * 1000000
+    if trial % 3 == 0:
+        steps += rng.integers(0, 1000000, n)
+    times = [datetime(2021, 3, 1, 6, 0, tzinfo=tzinfo) + timedelta(microseconds=int(step)) for step in np.cumsum(steps)]
+
+    if trial % 7 == 0:
+        for i in rng.integers(0, n, 3):
+            times[i] = None
+    if trial % 11 == 0:
+        times = [times[i] for i in rng.permutation(n)]
+
+    latitude = 14.6 + np.cumsum(rng.normal(0, 0.0005, n))
+    longitude = 121.0 + np.cumsum(rng.normal(0, 0.0005, n))
+    if trial % 2:
+        speed = rng.choice([np.nan, 30.0, 40.0, 50.0, 60.0], n, p=[0.5, 0.1, 0.2, 0.1, 0.1])
+    else:
+        speed = np.full(n, np.nan)
+
+    return [
+        {'latitude': float(latitude[i]), 'longitude': float(longitude[i]), 'time': times[i], 'speed': None if np.isnan(speed[i]) else float(speed[i])}
+        for i in range(n)
+    ]
+
+def limit_points(rng):
+    """
+    Fixes spaced so the speed between them lands within a rounding
+    error of 40 km/hr, every 17th at 10 km/hr
+    """
+    n = 120
+    latitude = 14.6 + np.cumsum(rng.uniform(0.0005, 0.0015, n))
+    longitude = 121.0 + np.cumsum(rng.uniform(-0.001, 0.001, n))
+    times = [datetime(2021, 3, 1, 6, 0, tzinfo=timezone.utc)]
+    for i in range(n - 1):
+        distance = haversine((latitude[i], longitude[i]), (latitude[i + 1], longitude[i + 1]))
+        times.append(times[-1] + timedelta(hours=distance / (40.0 if i % 17 else 10.0)))
+
+    return [{'latitude': float(latitude[i]), 'longitude': float(longitude[i]), 'time': times[i]} for i in range(n)]
+
+def main():
+    api = baseline_api()
+    cases = []
+
+    for seed, options in [(0, {}), (3, {'explicit_speed': 0.0, 'gap_every': 150}), (4, {'explicit_speed': 1.0, 'stop_dwell': 20})]:
+        gpx = gpx_generator.to_gpx(gpx_generator.vehicle_points(300, seed=seed, **options))
+        cases.append(make_case(api, f'vehicle_points seed {seed}', api.parse_gpx_file(gpx)))
+
+    rng = np.random.default_rng(1)
+    for trial in range(36):
+        cases.append(make_case(api, f'random {trial}', api.Trajectory.from_points(random_points(rng, trial))))
+    cases.append(make_case(api, 'at the limit', api.Trajectory.from_points(limit_points(rng))))
+
+    with open(os.path.join(os.path.dirname(__file__), 'speed_violations.json'), 'w') as f:
+        json.dump({'baseline': BASELINE, 'cases': cases}, f)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+import pytest
+from project2 import routes
+from project2.assets import StaticIndex, IMMUTABLE_CACHE_CONTROL, REVALIDATE_CACHE_CONTROL
+
+FILES = {
+    'index.html': b'<html>app</html>',
+    'style.css': b'body {}',
+    'js/app.3f2a1b9c.js': b'console.log("app")',
+    'js/app.3f2a1b9c.js.gz': b'gzip bytes',
+    'js/app.3f2a1b9c.js.br': b'brotli bytes'
+}
+
+@pytest.fixture
+def static(api, tmp_path, monkeypatch):
+    for name, body in FILES.items():
+        path = tmp_path / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(body)
+
+    index = StaticIndex(str(tmp_path))
+    monkeypatch.setattr(routes, 'static_index', index)
+    return api.client
+
+def test_etag_and_not_modified(static):
+    response = static.get('/style.css')
+    again = static.get('/style.css', headers={'If-None-Match': response.headers['ETag']})
+
+    assert response.status_code == 200
+    assert response.data == FILES['style.css']
+    assert response.headers['ETag']
+    assert again.status_code == 304
+    assert again.data == b''
+
+def test_cache_control(static):
+    assert static.get('/js/app.3f2a1b9c.js').headers['Cache-Control'] == IMMUTABLE_CACHE_CONTROL
+    assert static.get('/style.css').headers['Cache-Control'] == REVALIDATE_CACHE_CONTROL
+    assert static.get('/').headers['Cache-Control'] == REVALIDATE_CACHE_CONTROL
+
+@pytest.mark.parametrize('accept, encoding, body', [
+    ('br, gzip', 'br', FILES['js/app.3f2a1b9c.js.br']),
+    ('gzip', 'gzip', FILES['js/app.3f2a1b9c.js.gz']),
+    ('identity', None, FILES['js/app.3f2a1b9c.js'])
+])
+def test_precompressed_siblings(static, accept, encoding, body):
+    response = static.get('/js/app.3f2a1b9c.js', headers={'Accept-Encoding': accept})
+
+    assert response.content_encoding == encoding
+    assert response.data == body
+    assert response.mimetype in ('application/javascript', 'text/javascript')
+    assert 'Accept-Encoding' in response.vary
+
+def test_compressed_siblings_are_not_assets(static):
+    assert static.get('/js/app.3f2a1b9c.js.gz').data == FILES['index.html']
+
+def test_unknown_paths_get_the_app(static):
+    response = static.get('/vehicles/12')
+
+    assert response.status_code == 200
+    assert response.mimetype == 'text/html'
+    assert response.data == FILES['index.html']
+
+def test_unknown_path_without_index(api, tmp_path, monkeypatch):
+    monkeypatch.setattr(routes, 'static_index', StaticIndex(str(tmp_path)))
+
+    assert api.client.get('/vehicles/12').status_code == 404
+
+def test_range_request(static):
+    response = static.get('/style.css', headers={'Range': 'bytes=0-3'})
+
+    assert response.status_code == 206
+    assert response.data == FILES['style.css'][:4]
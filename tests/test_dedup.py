@@ -0,0 +1,62 @@
+import pytest
+from benchmarks import gpx_generator
+from project2 import routes
+from project2.models import VehicleUpload
+from project2.routes import VEHICLE_BUCKET
+from tests.test_segments import analysis_rows
+
+@pytest.fixture
+def puts(s3, monkeypatch):
+    """
+    The keys of the vehicle GPX files put to S3
+    """
+    keys = []
+    put_object = s3.put_object
+    def recorded(Body, Bucket, Key, **kwargs):
+        if Bucket == VEHICLE_BUCKET and Key.endswith('.gpx'):
+            keys.append(Key)
+        return put_object(Body, Bucket, Key, **kwargs)
+
+    monkeypatch.setattr(s3, 'put_object', recorded)
+    return keys
+
+@pytest.fixture
+def analyzed(monkeypatch):
+    """
+    The ids of the vehicles analyzed from their track
+    """
+    ids = []
+    analyze_vehicle = routes.analyze_vehicle
+    def recorded(vehicle, route, gps_data_vehicle):
+        ids.append(vehicle.id)
+        return analyze_vehicle(vehicle, route, gps_data_vehicle)
+
+    monkeypatch.setattr(routes, 'analyze_vehicle', recorded)
+    return ids
+
+def test_same_file_twice(api, s3, puts, analyzed):
+    route = api.setup_route()
+    points = gpx_generator.vehicle_points(600, loops=2)
+    first = api.upload('V1', points).get_json()['id']
+    response = api.upload('V2', points)
+    second = response.get_json()['id']
+
+    # filenames are unique, the second is stored by copying within S3 rather than uploaded again
+    assert response.status_code == 201
+    assert puts == ['V1.gpx']
+    assert s3.objects[(VEHICLE_BUCKET, 'V2.gpx')] == s3.objects[(VEHICLE_BUCKET, 'V1.gpx')]
+    assert [(upload.vehicle_id, upload.route_id) for upload in VehicleUpload.query.order_by(VehicleUpload.id)] == [(first, route.id), (second, route.id)]
+    assert len({upload.digest for upload in VehicleUpload.query}) == 1
+    assert analyzed == [first]
+    assert analysis_rows(second) == analysis_rows(first)
+
+def test_another_route_is_not_a_duplicate(api, s3, puts, analyzed):
+    api.setup_route('R1')
+    api.setup_route('R2')
+    points = gpx_generator.vehicle_points(600, loops=2)
+    first = api.upload('V1', points, route='R1').get_json()['id']
+    second = api.upload('V2', points, route='R2').get_json()['id']
+
+    assert puts == ['V1.gpx', 'V2.gpx']
+    assert analyzed == [first, second]
+    assert VehicleUpload.query.filter_by(vehicle_id=second).one().route_id != VehicleUpload.query.filter_by(vehicle_id=first).one().route_id
@@ -0,0 +1,43 @@
+import os
+import subprocess
+import sys
+from collections import OrderedDict
+from project2 import stages
+from project2.stages import SharedRouteGrid, attach_route_grid
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def test_route_grid_is_unpickled_once_per_build(route_grid, monkeypatch):
+    monkeypatch.setattr(stages, 'worker_route_grids', OrderedDict())
+    shared = SharedRouteGrid(route_grid, 4)
+    handle = shared.handle()
+
+    try:
+        first = attach_route_grid(handle)
+    finally:
+        shared.release()
+
+    # the block is gone, the worker's copy is used
+    assert attach_route_grid(handle) is first
+    assert first['route_path'] == route_grid['route_path']
+
+WORKER_IMPORTS = '''
+import multiprocessing
+import sys
+import project2.stages
+
+def loaded(names):
+    return [name for name in names if name in sys.modules]
+
+if __name__ == '__main__':
+    with multiprocessing.get_context('spawn').Pool(1) as pool:
+        print(','.join(pool.apply(loaded, (['project2.stages', 'project2.routes', 'project2.api', 'project2.models', 'boto3'],))))
+'''
+
+def test_workers_do_not_import_the_routes(tmp_path):
+    script = tmp_path / 'worker_imports.py'
+    script.write_text(WORKER_IMPORTS)
+
+    output = subprocess.run([sys.executable, str(script)], cwd=ROOT, env=dict(os.environ, PYTHONPATH=ROOT), capture_output=True, text=True, timeout=120)
+
+    assert output.stdout.strip() == 'project2.stages', output.stderr
@@ -0,0 +1,33 @@
+from datetime import datetime, time, timedelta
+import pytest
+from benchmarks import gpx_generator
+from project2 import app
+from project2.api import parse_gpx_file, stream_gpx_file, read_gpx_file
+
+def fixes(start, count, interval=600):
+    return [(14.6 + i * 0.001, 121.0, start + timedelta(seconds=i * interval), None) for i in range(count)]
+
+@pytest.mark.parametrize('parse', [stream_gpx_file, read_gpx_file])
+def test_cutoff_in_service_timezone(monkeypatch, parse):
+    monkeypatch.setitem(app.config, 'SERVICE_TIMEZONE', 'Asia/Manila')
+    # 21:00 to 23:50 in Manila, the GPX times are UTC
+    gpx = gpx_generator.to_gpx(fixes(datetime(2021, 3, 1, 13, 0), 18))
+    counts = {}
+
+    with app.app_context():
+        gps_data = parse(gpx.decode(), time(22, 0), counts)
+
+    assert len(gps_data) == 7
+    assert gps_data.time(6) == datetime.fromisoformat('2021-03-01T14:00:00+00:00')
+    assert counts['dropped'] == 11
+
+def test_cutoff_stays_past_midnight(monkeypatch):
+    monkeypatch.setitem(app.config, 'SERVICE_TIMEZONE', 'UTC')
+    # 23:00 on one day to 01:00 on the next
+    gpx = gpx_generator.to_gpx(fixes(datetime(2021, 3, 1, 23, 0), 13))
+
+    with app.app_context():
+        gps_data = parse_gpx_file(gpx, time(23, 30))
+
+    assert len(gps_data) == 4
+    assert gps_data.time(3) == datetime.fromisoformat('2021-03-01T23:30:00+00:00')
@@ -0,0 +1,77 @@
+from datetime import datetime, timedelta
+from benchmarks import gpx_generator
+from project2 import app
+from project2.models import HeadwayEvent
+
+def shifted(points, seconds):
+    return [(lat, lon, time + timedelta(seconds=seconds), speed) for lat, lon, time, speed in points]
+
+def headway_time(value):
+    return datetime.strptime(value, "%I:%M %p, %m/%d/%Y")
+
+def upload_fleet(api):
+    """
+    Three runs of one lap over the same fixes: the second a minute
+    behind the first, the third fifty minutes behind that
+    """
+    points = gpx_generator.vehicle_points(300, loops=1)
+    return [api.upload(name, shifted(points, offset)).get_json()['id'] for name, offset in (('V1', 0), ('V2', 60), ('V3', 3060))]
+
+def test_bunching_and_gaps(api):
+    route = api.setup_route()
+    first, second, third = upload_fleet(api)
+
+    response = api.post(f'/api/route/{route.id}/headway', json={'date': '2021-03-01'})
+    data = response.get_json()
+    events = data['events']
+
+    assert response.status_code == 200
+    assert data['vehicles'] == 3
+    assert data['stops']
+    assert {stop['count'] for stop in data['stops']} == {2}
+
+    bunching = [event for event in events if event['event'] == 'bunching']
+    gaps = [event for event in events if event['event'] == 'gap']
+    assert len(bunching) == len(gaps) == len(data['stops'])
+    assert {(event['leader_id'], event['follower_id'], event['headway']) for event in bunching} == {(first, second, 60)}
+    assert {(event['leader_id'], event['follower_id'], event['headway']) for event in gaps} == {(second, third, 3000)}
+
+def test_stored_events_in_time_order(api):
+    route = api.setup_route()
+    upload_fleet(api)
+    api.post(f'/api/route/{route.id}/headway', json={'date': '2021-03-01'})
+
+    # analyzing the day again replaces its events
+    api.post(f'/api/route/{route.id}/headway', json={'date': '2021-03-01'})
+    events = api.get(f'/api/route/{route.id}/headway?date=2021-03-01').get_json()['events']
+
+    assert len(events) == HeadwayEvent.query.count()
+    assert [headway_time(event['time2']) for event in events] == sorted(headway_time(event['time2']) for event in events)
+    assert all(headway_time(event['time1']) <= headway_time(event['time2']) for event in events)
+
+def test_thresholds_come_from_config(api, monkeypatch):
+    monkeypatch.setitem(app.config, 'BUNCHING_HEADWAY', 30)
+    monkeypatch.setitem(app.config, 'GAP_HEADWAY', 4000)
+    route = api.setup_route()
+    upload_fleet(api)
+
+    response = api.post(f'/api/route/{route.id}/headway', json={'date': '2021-03-01'})
+
+    assert response.get_json()['events'] == []
+
+def test_route_without_vehicles(api):
+    route = api.setup_route()
+
+    response = api.post(f'/api/route/{route.id}/headway', json={'date': '2021-03-01'})
+
+    assert response.status_code == 200
+    assert (response.get_json()['vehicles'], response.get_json()['stops'], response.get_json()['events']) == (0, [], [])
+    assert api.get(f'/api/route/{route.id}/headway?date=2021-03-01').get_json()['events'] == []
+
+def test_bad_requests(api):
+    route = api.setup_route()
+    api.post('/api/route', json={'name': 'R2'})
+
+    assert api.post(f'/api/route/{route.id}/headway', json={'date': '03/01/2021'}).status_code == 400
+    assert api.post(f'/api/route/{route.id + 1}/headway', json={'date': '2021-03-01'}).status_code == 400
+    assert api.get(f'/api/route/{route.id}/headway').status_code == 400
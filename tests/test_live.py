@@ -0,0 +1,29 @@
+import json
+from benchmarks import gpx_generator
+from project2.models import LiveSession
+
+def live_body(points, vehicle_name='L1'):
+    return {'vehicle_name': vehicle_name, 'route_name': 'R1', 'points': [
+        {'latitude': lat, 'longitude': lon, 'time': time.strftime('%Y-%m-%dT%H:%M:%SZ'), 'speed': speed}
+        for lat, lon, time, speed in points
+    ]}
+
+def test_live_session_is_kept_in_the_database(api):
+    api.setup_route()
+    points = gpx_generator.vehicle_points(900, seed=2)
+
+    batches = [api.post('/api/live', json=live_body(points[start:start + 300])).get_json() for start in range(0, len(points), 300)]
+    whole = api.post('/api/live', json=live_body(points, 'L2')).get_json()
+
+    # every batch resumed from the stored state
+    assert json.loads(LiveSession.query.filter_by(vehicle_name='L1').one().state)['points'] == len(points)
+    assert batches[-1]['state'] == whole['state']
+    assert sum(len(batch['events']) for batch in batches) == len(whole['events'])
+
+def test_finished_live_session_is_removed(api):
+    api.setup_route()
+    api.post('/api/live', json=live_body(gpx_generator.vehicle_points(300)))
+
+    assert api.delete('/api/live/R1/L1').status_code == 200
+    assert LiveSession.query.count() == 0
+    assert api.delete('/api/live/R1/L1').status_code == 404
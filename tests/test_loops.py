@@ -0,0 +1,30 @@
+from project2.api import compute_loops
+from project2.live import LoopMonitor
+
+def live_loops(route_grid, path):
+    monitor = LoopMonitor(route_grid)
+    for timestamp, cell in enumerate(path):
+        monitor.update(cell, float(timestamp))
+    monitor.finish()
+    return monitor.loops
+
+def test_path_shorter_than_route_steps_back(route_grid):
+    route = route_grid['route_path']
+    path = [route[40], route[39], route[40]]
+
+    loops = compute_loops(route, path, route_grid['grid'], route_grid['adjacency'])
+
+    assert loops == 0
+    assert loops == live_loops(route_grid, path)
+
+def test_short_paths_match_live(route_grid):
+    route = route_grid['route_path']
+    paths = [
+        [route[5]],
+        [route[0], route[1], route[0]],
+        [route[10], route[2], route[11], route[3]],
+        [route[-2], route[1], route[2], route[-3]]
+    ]
+
+    for path in paths:
+        assert compute_loops(route, path, route_grid['grid'], route_grid['adjacency']) == live_loops(route_grid, path)
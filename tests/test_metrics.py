@@ -0,0 +1,9 @@
+def test_metrics_need_an_admin(api, viewer):
+    assert api.client.get('/metrics').status_code == 401
+    assert viewer.get('/metrics').status_code == 403
+
+    response = api.get('/metrics')
+
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    assert '# TYPE project2_stage_wall_seconds summary' in response.get_data(as_text=True)
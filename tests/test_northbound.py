@@ -0,0 +1,94 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import pytest
+from project2 import northbound
+from project2.models import Route, Parameters
+from project2.northbound import NorthboundClient
+
+class NorthboundStub(BaseHTTPRequestHandler):
+    """
+    The Northbound API's /login and /routes. server.failures holds
+    the statuses to answer /routes with before it succeeds.
+    """
+    def reply(self, status, body=None):
+        data = json.dumps(body).encode() if body is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        self.server.logins += 1
+        self.reply(200, {'access_token': f'token{self.server.logins}', 'expires_in': self.server.expires_in})
+
+    def do_GET(self):
+        self.server.requests.append(self.headers['Authorization'])
+        if self.server.failures:
+            self.reply(self.server.failures.pop(0))
+        else:
+            self.reply(200, {'routes': [{'route_id': 'N1'}, {'route_id': 'N2'}, {'route_id': 'N1'}]})
+
+    def log_message(self, format, *args):
+        pass
+
+@pytest.fixture
+def stub():
+    server = HTTPServer(('127.0.0.1', 0), NorthboundStub)
+    server.logins = 0
+    server.expires_in = 3600
+    server.failures = []
+    server.requests = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    yield server
+
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture
+def client(stub, monkeypatch):
+    client = NorthboundClient(f'http://127.0.0.1:{stub.server_port}', 'user', 'password', timeout=5)
+    monkeypatch.setattr(northbound, '_client', client)
+    yield client
+    client.close()
+
+def test_sync_routes_retries_server_errors(api, stub, client):
+    stub.failures = [503, 502]
+
+    response = api.put('/api/route/refresh')
+
+    assert response.status_code == 200
+    assert (response.get_json()['inserted'], response.get_json()['unchanged']) == (2, 0)
+    assert sorted(route.name for route in Route.query.all()) == ['N1', 'N2']
+    assert Parameters.query.count() == 2
+    assert len(stub.requests) == 3 and stub.logins == 1
+
+def test_sync_routes_logs_in_again_on_401(api, stub, client):
+    api.put('/api/route/refresh')
+    stub.failures = [401]
+
+    response = api.put('/api/route/refresh')
+
+    assert response.status_code == 200
+    assert (response.get_json()['inserted'], response.get_json()['unchanged']) == (0, 2)
+    assert stub.requests == ['Bearer token1', 'Bearer token1', 'Bearer token2']
+
+def test_token_is_refreshed_before_it_expires(api, stub, client):
+    # expires inside the refresh margin, so every request logs in first
+    stub.expires_in = 30
+
+    api.put('/api/route/refresh')
+    api.put('/api/route/refresh')
+
+    assert stub.requests == ['Bearer token1', 'Bearer token2']
+
+def test_sync_routes_reports_unreachable_api(api, stub, client):
+    stub.failures = [503] * 4
+
+    response = api.put('/api/route/refresh')
+
+    assert response.status_code == 502
+    assert Route.query.count() == 0
@@ -0,0 +1,25 @@
+import pytest
+from flask import g
+from sqlalchemy.exc import OperationalError
+from project2 import app, db
+
+def test_failed_statement_leaves_no_start_time(api, monkeypatch):
+    monkeypatch.setitem(app.config, 'SQL_PROFILING', True)
+
+    with app.test_request_context():
+        connection = db.session.connection()
+        with pytest.raises(OperationalError):
+            connection.execute('SELECT * FROM missing_table')
+        connection.execute('SELECT 1')
+
+        assert not connection.info.get('query_start')
+        assert [statement for statement, duration in g.sql_queries] == ['SELECT 1']
+
+def test_queries_are_reported(api, monkeypatch):
+    monkeypatch.setitem(app.config, 'SQL_PROFILING', True)
+    route = api.setup_route()
+
+    response = api.get(f'/api/route/{route.id}')
+
+    assert response.status_code == 200
+    assert int(response.headers['X-SQL-Queries'].split(';')[0]) > 0
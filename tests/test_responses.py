@@ -0,0 +1,88 @@
+import gzip
+import json
+from datetime import datetime, date, timezone, timedelta
+import pytest
+from flask import jsonify
+from benchmarks import gpx_generator
+from project2 import app, responses
+from project2.api import encode_polyline, parse_gpx_file
+
+PAYLOAD = {
+    'utc': datetime(2021, 3, 1, 13, 0, 5, tzinfo=timezone.utc),
+    'manila': datetime(2021, 3, 1, 21, 0, 5, tzinfo=timezone(timedelta(hours=8))),
+    'naive': datetime(2021, 3, 1, 13, 0, 5),
+    'date': date(2021, 3, 1),
+    'rows': [{'time': datetime(2021, 3, 2, tzinfo=timezone.utc)}],
+    'counts': {1: 0.5, 2: 1.5}
+}
+
+def serialized(payload):
+    with app.test_request_context():
+        return json.loads(responses.dumps(payload))
+
+def test_orjson_path_matches_jsonify():
+    pytest.importorskip('orjson')
+
+    with app.test_request_context():
+        expected = json.loads(jsonify(PAYLOAD).get_data())
+
+    assert serialized(PAYLOAD) == expected
+    assert serialized(PAYLOAD)['utc'] == 'Mon, 01 Mar 2021 13:00:05 GMT'
+
+def test_fallback_matches_orjson_path(monkeypatch):
+    with app.test_request_context():
+        expected = json.loads(jsonify(PAYLOAD).get_data())
+    monkeypatch.setattr(responses, 'orjson', None)
+
+    assert serialized(PAYLOAD) == expected
+    assert serialized(PAYLOAD)['manila'] == 'Mon, 01 Mar 2021 13:00:05 GMT'
+
+def compressed(accept, size):
+    with app.test_request_context(headers={'Accept-Encoding': accept}):
+        rv = responses.json_response({'values': list(range(size))})
+        return rv.content_encoding, rv.get_data(), rv.vary
+
+def test_small_responses_are_not_compressed():
+    encoding, body, vary = compressed('gzip, br', 10)
+
+    assert encoding is None
+    assert json.loads(body) == {'values': list(range(10))}
+    assert 'Accept-Encoding' in vary
+
+def test_gzip_when_brotli_is_not_accepted():
+    encoding, body, vary = compressed('gzip', 1000)
+
+    assert encoding == 'gzip'
+    assert json.loads(gzip.decompress(body)) == {'values': list(range(1000))}
+
+def test_brotli_when_accepted():
+    brotli = pytest.importorskip('brotli')
+    encoding, body, vary = compressed('gzip, br', 1000)
+
+    assert encoding == 'br'
+    assert json.loads(brotli.decompress(body)) == {'values': list(range(1000))}
+
+def test_identity_when_nothing_is_accepted():
+    encoding, body, vary = compressed('identity', 1000)
+
+    assert encoding is None
+    assert json.loads(body) == {'values': list(range(1000))}
+
+def test_encode_polyline_reference():
+    # the example in the Encoded Polyline Algorithm Format documentation
+    coordinates = [(38.5, -120.2), (40.7, -120.95), (43.252, -126.453)]
+    gps_data = parse_gpx_file(gpx_generator.to_gpx([(lat, lon, datetime(2021, 3, 1, 0, 0, i), None) for i, (lat, lon) in enumerate(coordinates)]))
+
+    assert encode_polyline(gps_data) == '_p~iF~ps|U_ulLnnqC_mqNvxq`@'
+
+def test_vehicle_geometry_as_polyline(api):
+    api.setup_route()
+    points = gpx_generator.vehicle_points(200)
+    vehicle_id = api.upload('V1', points).get_json()['id']
+
+    geojson = api.get(f'/api/vehicle/{vehicle_id}').get_json()['geojson']
+    polyline = api.get(f'/api/vehicle/{vehicle_id}?encoding=polyline').get_json()['geojson']
+
+    assert len(geojson['coordinates']) == len(points)
+    assert polyline['type'] == 'EncodedPolyline'
+    assert polyline['coordinates'] == encode_polyline(parse_gpx_file(gpx_generator.to_gpx(points)))
@@ -0,0 +1,12 @@
+from project2.api import route_check, count_occurrences
+
+def test_cells_are_compared_whole():
+    # as digit strings "12" would be found in "1" "2" and the other way round
+    assert route_check([1, 2], [12, 5, 12]) == 0
+    assert route_check([12], [1, 2, 1, 2]) == 0
+    assert route_check([1, 2], [3, 1, 2, 12, 1, 2]) == 2
+
+def test_overlapping_occurrences_are_counted():
+    assert count_occurrences([4, 4], [4, 4, 4]) == 2
+    assert count_occurrences([1, 2, 1], [1, 2, 1, 2, 1]) == 2
+    assert count_occurrences([], [1, 2]) == 0
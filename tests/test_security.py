@@ -0,0 +1,57 @@
+import threading
+import pytest
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS
+from project2 import app, db, security
+from project2.models import User
+from project2.security import hash_password, needs_rehash
+
+def login(api, username='admin', password='password'):
+    return api.client.post('/api/login', json={'username': username, 'password': password})
+
+def test_login(api):
+    response = login(api)
+
+    assert response.status_code == 200
+    assert response.get_json()['username'] == 'admin' and response.get_json()['admin']
+    assert login(api, password='wrong').status_code == 422
+    assert login(api, username='nobody').status_code == 422
+
+@pytest.mark.parametrize('stored, configured, rehash', [
+    ('pbkdf2:sha256:260000', 'pbkdf2:sha256:260000', False),
+    (f'pbkdf2:sha256:{DEFAULT_PBKDF2_ITERATIONS}', 'pbkdf2:sha256', False),
+    ('pbkdf2:sha256', f'pbkdf2:sha256:{DEFAULT_PBKDF2_ITERATIONS}', False),
+    ('pbkdf2:sha256:150000', 'pbkdf2:sha256:260000', True),
+    ('pbkdf2:sha256:260000', 'pbkdf2:sha512:260000', True),
+    ('sha256', 'pbkdf2:sha256:260000', True)
+])
+def test_needs_rehash_compares_settings(monkeypatch, stored, configured, rehash):
+    monkeypatch.setitem(app.config, 'PASSWORD_HASH_METHOD', configured)
+
+    assert needs_rehash(f'{stored}$salt$hash') == rehash
+
+def test_login_rehashes_outdated_hash(api):
+    user = User.query.filter_by(username='admin').first()
+    user.password = hash_password('password', 'pbkdf2:sha256:1000')
+    db.session.commit()
+
+    assert login(api).status_code == 200
+    db.session.refresh(user)
+    assert user.password.startswith(security.password_hash_method() + '$')
+
+    # the new hash is used from then on and not replaced again
+    rehashed = user.password
+    assert login(api).status_code == 200
+    db.session.refresh(user)
+    assert user.password == rehashed
+
+def test_login_busy(api, monkeypatch):
+    monkeypatch.setitem(app.config, 'PASSWORD_VERIFY_WAIT', 0.01)
+    slots = threading.BoundedSemaphore(1)
+    monkeypatch.setattr(security, '_slots', slots)
+    slots.acquire()
+
+    response = login(api)
+
+    assert response.status_code == 503
+    slots.release()
+    assert login(api).status_code == 200
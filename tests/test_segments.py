@@ -0,0 +1,143 @@
+import json
+import math
+from datetime import datetime, time, timedelta
+import numpy as np
+import pytest
+from benchmarks import gpx_generator
+from project2 import app, api as project_api, routes
+from project2.models import Vehicle
+from project2.api import parse_gpx_file
+from project2.spatial import SegmentIndex, NODE_SIZE
+
+def test_segment_after_upload_continues_tail(api):
+    api.setup_route()
+    points = gpx_generator.vehicle_points(600)
+    vehicle_id = api.upload('V1', points[:300]).get_json()['id']
+
+    response = api.append(vehicle_id, points[300:])
+
+    assert response.status_code == 201
+    assert response.get_json()['reanalyzed'] == 'tail'
+
+def test_segment_after_reanalyze_continues_tail(api):
+    route = api.setup_route()
+    points = gpx_generator.vehicle_points(600)
+    vehicle_id = api.upload('V1', points[:300]).get_json()['id']
+
+    assert api.post(f'/api/route/{route.id}/reanalyze').status_code == 200
+    response = api.append(vehicle_id, points[300:])
+
+    assert response.get_json()['reanalyzed'] == 'tail'
+
+def analysis_rows(vehicle_id):
+    """
+    Everything stored for a vehicle's analysis, without row ids
+    """
+    analysis = Vehicle.query.get(vehicle_id).analysis
+    columns = lambda rows, *names: sorted(tuple(getattr(row, name) for name in names) for row in rows)
+    return {
+        'loops': analysis.loops.loops,
+        'distance': analysis.distance.distance,
+        'total_liveness': analysis.total_liveness,
+        'speeding': columns(analysis.speeding, 'duration', 'time1', 'time2', 'lat1', 'long1', 'lat2', 'long2'),
+        'stops': columns(analysis.stops, 'violation', 'duration', 'time1', 'time2', 'center_lat', 'center_long'),
+        'liveness': columns(analysis.liveness_segments, 'liveness', 'time1', 'time2'),
+        'deviations': columns(analysis.deviations, 'duration', 'distance', 'time1', 'time2', 'lat', 'long'),
+        'trips': columns(analysis.trips, 'number', 'time1', 'time2', 'points', 'loops', 'speeding', 'stops', 'deviations')
+    }
+
+def test_tail_after_full_analysis_matches_one_analysis(api):
+    api.setup_route()
+    # liveness gaps split the upload into trips, only the last is replayed
+    points = gpx_generator.vehicle_points(1500, gap_every=400, seed=5)
+    vehicle_id = api.upload('V1', points[:1000]).get_json()['id']
+    state = json.loads(Vehicle.query.get(vehicle_id).analysis.tail.state)
+
+    response = api.append(vehicle_id, points[1000:])
+    whole_id = api.upload('V2', points).get_json()['id']
+
+    assert state['trip']['number'] > 1
+    assert response.get_json()['reanalyzed'] == 'tail'
+    assert analysis_rows(vehicle_id) == analysis_rows(whole_id)
+
+def test_segment_ending_on_liveness_gap_matches_one_analysis(api):
+    api.setup_route()
+    points = gpx_generator.vehicle_points(600, seed=3)
+    # only the segment's last fix comes after the gap, back at the
+    # start of the route
+    lat, lon = points[1][:2]
+    points[-1] = (lat, lon, points[-1][2] + timedelta(seconds=900), points[-1][3])
+    vehicle_id = api.upload('V1', points[:300]).get_json()['id']
+
+    response = api.append(vehicle_id, points[300:])
+    whole_id = api.upload('V2', points).get_json()['id']
+    rows = analysis_rows(vehicle_id)
+
+    assert response.get_json()['reanalyzed'] == 'tail'
+    assert rows == analysis_rows(whole_id)
+    assert max(rows['liveness'], key=lambda row: row[1])[0] == 0
+
+def test_segment_is_cut_off_on_the_upload_service_date(api, monkeypatch):
+    monkeypatch.setitem(app.config, 'SERVICE_TIMEZONE', 'UTC')
+    monkeypatch.setitem(project_api.gps_cutoff, 'time', time(23, 50))
+    monkeypatch.setitem(project_api.gps_cutoff, 'expires', math.inf)
+    api.setup_route()
+    # 23:30 to 00:20, five seconds apart
+    shift = datetime(2021, 3, 1, 23, 30) - gpx_generator.START_TIME
+    points = [(lat, lon, t + shift, speed) for lat, lon, t, speed in gpx_generator.vehicle_points(600)]
+    vehicle_id = api.upload('V1', points[:120]).get_json()['id']
+
+    across = api.append(vehicle_id, points[120:300])
+    # the next day's fixes are past the cutoff of the day the vehicle started on
+    next_day = api.append(vehicle_id, points[360:])
+    vehicle = Vehicle.query.get(vehicle_id)
+
+    assert across.status_code == 201
+    assert next_day.status_code == 400
+    assert routes.track_store.header(vehicle)[0] == len(parse_gpx_file(gpx_generator.to_gpx(points), time(23, 50)))
+    assert len(routes.load_vehicle_track(vehicle)) == routes.track_store.header(vehicle)[0]
+
+def brute_force_distances(index, latitude, longitude, x, y):
+    """
+    Distance from each of {x}, {y} to every segment of the path, in
+    the index's projection
+    """
+    px, py = index.project(latitude, longitude)
+    if len(px) == 1:
+        px, py = np.repeat(px, 2), np.repeat(py, 2)
+    x1, y1, dx, dy = px[:-1], py[:-1], np.diff(px), np.diff(py)
+    length = dx ** 2 + dy ** 2
+    t = np.clip(np.divide((x[:, None] - x1) * dx + (y[:, None] - y1) * dy, length, out=np.zeros((len(x), len(x1))), where=length > 0), 0, 1)
+    return np.hypot(x[:, None] - x1 - t * dx, y[:, None] - y1 - t * dy)
+
+@pytest.mark.parametrize('node_size', [2, NODE_SIZE])
+@pytest.mark.parametrize('points', [1, 2, 3, NODE_SIZE, NODE_SIZE + 1, NODE_SIZE + 2, NODE_SIZE ** 2 + 1, NODE_SIZE ** 2 + 2, 500])
+def test_segment_index_matches_brute_force(points, node_size):
+    random = np.random.default_rng(points)
+    path = gpx_generator.route_points()
+    latitude = np.array([lat for lat, lon, time, speed in path])[:points] + random.normal(0, 1e-4, points)
+    longitude = np.array([lon for lat, lon, time, speed in path])[:points] + random.normal(0, 1e-4, points)
+    # fixes on the path's points, between them, and around its extent
+    fix_latitude = np.concatenate([latitude, random.uniform(latitude.min() - 0.01, latitude.max() + 0.01, 500)])
+    fix_longitude = np.concatenate([longitude, random.uniform(longitude.min() - 0.01, longitude.max() + 0.01, 500)])
+    index = SegmentIndex(latitude, longitude, node_size)
+
+    distance, segment = index.nearest(fix_latitude, fix_longitude)
+    x, y = index.project(fix_latitude, fix_longitude)
+    expected = brute_force_distances(index, latitude, longitude, x, y)
+
+    assert len(index) == max(points - 1, 1)
+    assert np.allclose(distance, expected.min(axis=1), rtol=1e-9, atol=1e-6)
+    # ties may go either way, the chosen segment must be as close
+    assert np.allclose(expected[np.arange(len(x)), segment], expected.min(axis=1), rtol=1e-9, atol=1e-6)
+
+def test_segment_index_skips_missing_coordinates():
+    latitude = np.array([40.0, np.nan, 40.001, 40.002])
+    longitude = np.array([-74.0, -74.0005, np.nan, -74.002])
+    index = SegmentIndex(latitude, longitude)
+
+    distance, segment = index.nearest(np.array([40.0, np.nan]), np.array([-74.0, -74.0]))
+
+    assert len(index) == 1
+    assert distance[0] == pytest.approx(0, abs=1e-6) and segment[0] == 0
+    assert np.isnan(distance[1]) and segment[1] == -1
@@ -0,0 +1,79 @@
+from collections import OrderedDict
+import numpy as np
+import pytest
+from benchmarks import gpx_generator
+from project2 import api as project_api, routes
+from project2.models import Vehicle
+from project2.api import parse_gpx_file, speed_series
+
+@pytest.fixture
+def vehicle(api, monkeypatch):
+    # profiles are cached per vehicle id, which the next test reuses
+    monkeypatch.setattr(project_api, 'speed_profiles', OrderedDict())
+    api.setup_route()
+    points = gpx_generator.vehicle_points(600, seed=1)
+    # one fix far over every other speed, which the budget must keep
+    lat, lon, time, speed = points[250]
+    points[250] = (lat, lon, time, 200.0)
+    vehicle_id = api.upload('V1', points).get_json()['id']
+    return vehicle_id, points
+
+def test_profile_keeps_the_point_budget(api, vehicle):
+    vehicle_id, points = vehicle
+    timestamp, speed = speed_series(parse_gpx_file(gpx_generator.to_gpx(points)))
+
+    profile = api.get(f'/api/vehicle/{vehicle_id}/speed?width=50').get_json()
+
+    assert profile['points'] == len(timestamp)
+    assert len(profile['timestamps']) == len(profile['speeds']) == 50
+    assert profile['timestamps'][0] == timestamp[0] and profile['timestamps'][-1] == timestamp[-1]
+    assert np.all(np.diff(profile['timestamps']) > 0)
+    assert set(profile['timestamps']) <= set(timestamp.tolist())
+    assert 200.0 in profile['speeds']
+
+def test_profile_below_the_budget_is_the_whole_series(api, vehicle):
+    vehicle_id, points = vehicle
+    timestamp, speed = speed_series(parse_gpx_file(gpx_generator.to_gpx(points)))
+
+    profile = api.get(f'/api/vehicle/{vehicle_id}/speed?width=10000').get_json()
+
+    assert profile['timestamps'] == timestamp.tolist()
+    assert profile['speeds'] == np.round(speed, 2).tolist()
+
+def test_width_is_capped(api, vehicle, monkeypatch):
+    monkeypatch.setattr(routes, 'SPEED_PROFILE_MAX_WIDTH', 20)
+    vehicle_id, points = vehicle
+
+    assert len(api.get(f'/api/vehicle/{vehicle_id}/speed?width=500').get_json()['timestamps']) == 20
+
+def test_profile_lists_speeding(api, vehicle):
+    vehicle_id, points = vehicle
+    analysis = Vehicle.query.get(vehicle_id).analysis
+
+    profile = api.get(f'/api/vehicle/{vehicle_id}/speed?width=50').get_json()
+
+    assert profile['speed_limit'] == analysis.speeding_speed_limit
+    assert profile['speeding']
+    assert len(profile['speeding']) == len([row for row in analysis.speeding if row.duration != -1])
+    for violation in profile['speeding']:
+        assert profile['timestamps'][0] <= violation['time1'] <= violation['time2'] <= profile['timestamps'][-1]
+
+def test_profile_follows_an_append(api, vehicle):
+    vehicle_id, points = vehicle
+    more = [(lat, lon, time.replace(hour=time.hour + 1), speed) for lat, lon, time, speed in gpx_generator.vehicle_points(100, seed=2)]
+
+    before = api.get(f'/api/vehicle/{vehicle_id}/speed?width=50').get_json()
+    assert api.append(vehicle_id, more).status_code == 201
+    after = api.get(f'/api/vehicle/{vehicle_id}/speed?width=50').get_json()
+
+    assert after['points'] > before['points']
+    assert after['timestamps'][-1] > before['timestamps'][-1]
+
+@pytest.mark.parametrize('query', ['', '?width=2', '?width=wide'])
+def test_width_is_required(api, vehicle, query):
+    vehicle_id, points = vehicle
+
+    assert api.get(f'/api/vehicle/{vehicle_id}/speed{query}').status_code == 400
+
+def test_unknown_vehicle(api):
+    assert api.get('/api/vehicle/99/speed?width=50').status_code == 400
@@ -0,0 +1,43 @@
+import json
+import os
+from datetime import datetime, timezone, timedelta
+import numpy as np
+import pytest
+from project2.api import Trajectory, compute_speed_violation
+
+# tracks and the violations the per-fix loop compute_speed_violation
+# had before it was vectorized found in them, written by
+# tests/data/make_speed_violations.py
+with open(os.path.join(os.path.dirname(__file__), 'data', 'speed_violations.json')) as f:
+    GOLDEN = json.load(f)['cases']
+
+@pytest.mark.parametrize('case', GOLDEN, ids=[case['name'] for case in GOLDEN])
+def test_speed_violations_match_golden(case):
+    n = len(case['timestamp'])
+    gps_data = Trajectory(case['latitude'], case['longitude'], np.zeros(n), case['timestamp'], case['speed'], timezone(timedelta(seconds=case['utcoffset'])))
+
+    for expected in case['expected']:
+        violations = compute_speed_violation(gps_data, expected['type'], expected['speed_limit'], expected['time'])
+        for violation in violations:
+            violation['time1'] = violation['time1'].isoformat()
+            violation['time2'] = violation['time2'].isoformat()
+
+        assert violations == expected['violations'], (expected['type'], expected['speed_limit'], expected['time'])
+
+def test_zero_time_reports_each_run_once():
+    # the per-fix loop reported the 0 s run again at the second slower
+    # fix, as 0 s from fix 0 to fix 1, and failed when fix 0 was slower
+    start = datetime(2021, 3, 1, tzinfo=timezone.utc)
+    speed = [50, 10, 10, 50, 50, 10, 30]
+    gps_data = Trajectory.from_points([
+        {'latitude': 14.6 + i * 0.001, 'longitude': 121.0, 'time': start + timedelta(seconds=10 * i), 'speed': s}
+        for i, s in enumerate(speed)
+    ])
+
+    violations = compute_speed_violation(gps_data, 'Explicit', 40, 0)
+
+    assert [(v['duration'], v['time1'], v['time2']) for v in violations] == [
+        (0, start, start),
+        (10, start + timedelta(seconds=30), start + timedelta(seconds=40))
+    ]
+    assert compute_speed_violation(gps_data[1:], 'Explicit', 40, 0) == violations[1:]
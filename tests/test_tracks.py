@@ -0,0 +1,48 @@
+import numpy as np
+from benchmarks import gpx_generator
+from project2 import app, routes
+from project2.models import Vehicle, TrackPart
+from project2.api import parse_gpx_file
+
+def store_in_segments(api, points, segments):
+    """
+    Indexes the first of {segments} runs of {points} and extends the
+    track with the rest
+    """
+    api.setup_route()
+    vehicle = Vehicle.query.get(api.upload('V1', points).get_json()['id'])
+    gps_data = parse_gpx_file(gpx_generator.to_gpx(points))
+    chunks = np.array_split(np.arange(len(gps_data)), segments)
+
+    routes.track_store.index(vehicle, gps_data.take(chunks[0]))
+    for chunk in chunks[1:]:
+        assert routes.track_store.extend(vehicle, gps_data.take(chunk))
+    return vehicle
+
+def test_append_writes_only_a_part(api, s3):
+    points = gpx_generator.vehicle_points(600)
+    vehicle = store_in_segments(api, points, 3)
+    store = routes.track_store
+    base = s3.objects[(store.bucket, store.key(vehicle))]
+
+    parts = TrackPart.query.filter_by(vehicle_id=vehicle.id).order_by(TrackPart.offset).all()
+    expected = parse_gpx_file(gpx_generator.to_gpx(points))
+    track = store.read(vehicle)
+
+    assert [part.offset for part in parts] == [len(points) // 3, 2 * len(points) // 3]
+    assert len(base) < len(points) // 2 * 40
+    assert store.header(vehicle)[0] == len(points)
+    assert np.array_equal(track.timestamp, expected.timestamp)
+    assert np.array_equal(track.latitude, expected.latitude)
+    # a slice across the base and both parts
+    assert np.array_equal(store.read_slice(vehicle, 100, len(points) - 100).timestamp, expected.timestamp[100:-100])
+
+def test_parts_are_compacted(api, s3, monkeypatch):
+    monkeypatch.setitem(app.config, 'TRACK_MAX_PARTS', 1)
+    points = gpx_generator.vehicle_points(600)
+    vehicle = store_in_segments(api, points, 3)
+    store = routes.track_store
+
+    assert TrackPart.query.filter_by(vehicle_id=vehicle.id).count() == 0
+    assert [key for bucket, key in s3.objects if key.startswith(store.key(vehicle))] == [store.key(vehicle)]
+    assert np.array_equal(store.read(vehicle).timestamp, parse_gpx_file(gpx_generator.to_gpx(points)).timestamp)
@@ -0,0 +1,43 @@
+import datetime
+from benchmarks import gpx_generator
+
+def visits_body(lat1, long1, lat2, long2):
+    return {
+        'lat1': lat1, 'long1': long1, 'lat2': lat2, 'long2': long2,
+        'time1': '2021-03-01T00:00:00Z', 'time2': '2021-03-02T00:00:00Z'
+    }
+
+def route_box(margin=0.03):
+    lat, lon = gpx_generator.CENTER
+    return visits_body(lat + margin, lon - margin, lat - margin, lon + margin)
+
+def test_visits_finds_vehicles_in_box(api):
+    api.setup_route()
+    vehicle_id = api.upload('V1', gpx_generator.vehicle_points(600)).get_json()['id']
+
+    response = api.post('/api/vehicle/visits', json=route_box())
+
+    assert response.status_code == 200
+    vehicles = response.get_json()['vehicles']
+    assert [vehicle['id'] for vehicle in vehicles] == [vehicle_id]
+    assert sum(visit['points'] for visit in vehicles[0]['visits']) > 0
+
+def test_visits_rejects_oversized_box(api):
+    lat, lon = gpx_generator.CENTER
+
+    response = api.post('/api/vehicle/visits', json=visits_body(lat + 10, lon - 0.01, lat - 10, lon + 0.01))
+
+    assert response.status_code == 400
+
+def test_visits_only_on_users_routes(api, viewer):
+    api.setup_route('R1')
+    api.setup_route('R2')
+    points = gpx_generator.vehicle_points(600)
+    own = api.upload('V1', points, route='R1').get_json()['id']
+    api.upload('V2', points, route='R2')
+
+    admin_ids = [vehicle['id'] for vehicle in api.post('/api/vehicle/visits', json=route_box()).get_json()['vehicles']]
+    viewer_ids = [vehicle['id'] for vehicle in viewer.post('/api/vehicle/visits', json=route_box()).get_json()['vehicles']]
+
+    assert len(admin_ids) == 2
+    assert viewer_ids == [own]